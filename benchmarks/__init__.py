@@ -0,0 +1 @@
+"""Offline benchmarks for remy. See README.md for how to run them."""
@@ -0,0 +1,216 @@
+"""End to end benchmark of the bot against local fakes of its services.
+
+Starts a FakeSpoonacularServer and a FakeTelegramServer, points the bot at
+them, pushes synthetic command updates through the real dispatcher and
+measures how long each takes to get its first reply back to Telegram. Needs
+no network.
+
+Telegram's own rate limits (30 messages a second) would otherwise be what we
+measure, so they are lifted unless --telegram-rate says otherwise.
+
+Run with:
+    pipenv run python -m benchmarks.bench_bot --count 500 --rate 50
+"""
+
+import argparse
+import collections
+import math
+import os
+import random
+import tempfile
+import time
+
+from remy.fakes import spoonacular as fs
+from remy.fakes import telegram as ft
+
+
+ERROR_REPLIES = (
+    "Something went wrong",
+    "We've hit our recipe quota",
+    "Yikes!",
+    "Only the following are allowed",
+)
+
+RANDOM_TAGS = ["", "vegan", "drink"]
+
+
+def percentile(values, p):
+    """Returns the nearest-rank p-th percentile of values."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def make_commands(count, seed):
+    """Returns a reproducible mix of command strings."""
+    rng = random.Random(seed)
+    names = sorted({
+        ingredient["name"]
+        for recipe in fs.load_fixtures()
+        for ingredient in recipe["extendedIngredients"]
+    })
+    commands = []
+    for _ in range(count):
+        roll = rng.random()
+        if roll < 0.5:
+            ingredients = rng.sample(names, rng.randint(1, 3))
+            commands.append("/recipe " + ", ".join(ingredients))
+        elif roll < 0.75:
+            commands.append(f"/random {rng.choice(RANDOM_TAGS)}".strip())
+        elif roll < 0.9:
+            commands.append("/happyhour")
+        else:
+            commands.append("/help")
+    return commands
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--count", type=int, default=300,
+                        help="updates to send")
+    parser.add_argument("--rate", type=float, default=30,
+                        help="updates sent per second")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="seconds the fake Spoonacular takes per call")
+    parser.add_argument("--jitter", type=float, default=0.05,
+                        help="max extra random Spoonacular latency")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="fraction of Spoonacular calls failing with 500")
+    parser.add_argument("--quota-error-rate", type=float, default=0,
+                        help="fraction of Spoonacular calls failing with 402")
+    parser.add_argument("--telegram-rate", type=float, default=10000,
+                        help="messages per second the bot may send")
+    parser.add_argument("--timeout", type=float, default=30,
+                        help="seconds to wait for the last replies")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="worker processes behind a supervisor, 0 runs "
+                             "the bot in this process")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="remy-bench-")
+    spoonacular = fs.FakeSpoonacularServer(
+        daily_limit=1e9, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, quota_error_rate=args.quota_error_rate,
+        seed=args.seed).start()
+    telegram_server = ft.FakeTelegramServer().start()
+
+    start = time.perf_counter()
+    import telegram
+    from remy import app
+    from remy import config
+    import_seconds = time.perf_counter() - start
+
+    settings = config.Settings(
+        TELEGRAM_BASE_URL=telegram_server.base_url,
+        SPOONACULAR_API_ROOT=spoonacular.base_url,
+        SPOONACULAR_SLEEP_TIME=0,
+        CACHE_DB_PATH=os.path.join(workdir, "remy.db"),
+        LOGFILE=os.path.join(workdir, "remy.log"),
+        TELEGRAM_GLOBAL_RATE=args.telegram_rate,
+        TELEGRAM_CHAT_RATE=args.telegram_rate,
+        METRICS_ENABLED=False,
+        SNAPSHOT_PATH="",
+    )
+    app.configure_logging(settings)
+    start = time.perf_counter()
+    if args.workers:
+        from remy import supervisor
+        workers = supervisor.Supervisor(settings, workers=args.workers).start()
+        bot = None
+        process_update = workers.dispatch
+        # Each worker fills its pools before it says it's ready.
+        workers.wait_ready()
+        print(f"Started {args.workers} workers in "
+              f"{time.perf_counter() - start:.2f}s "
+              f"({len(spoonacular.requests)} Spoonacular calls), "
+              f"logs in {workdir}\n")
+    else:
+        application = app.create_app(settings)
+        create_seconds = time.perf_counter() - start
+        updater = application.updater
+        application.spoon
+        application.pools
+        build_seconds = time.perf_counter() - start
+        print(f"Imported in {import_seconds * 1000:.0f}ms, app created in "
+              f"{create_seconds * 1000:.2f}ms and built in "
+              f"{build_seconds * 1000:.0f}ms, logs in {workdir}")
+
+        start = time.perf_counter()
+        updater.job_queue.start()
+        application.pools.refill()
+        print(f"Pools filled in {time.perf_counter() - start:.2f}s "
+              f"({len(spoonacular.requests)} Spoonacular calls)\n")
+        bot = updater.bot
+        process_update = application.dispatcher.process_update
+    calls_before = len(spoonacular.requests)
+
+    commands = make_commands(args.count, args.seed)
+    pushed_at = {}
+    first = time.time()
+    for i, text in enumerate(commands):
+        delay = first + i / args.rate - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        chat_id = 1000 + i
+        update = telegram.Update.de_json(
+            dict(ft.command_update(text, chat_id=chat_id), update_id=i + 1),
+            bot)
+        pushed_at[chat_id] = time.time()
+        process_update(update)
+
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        replied = {int(m["chat_id"]) for m in telegram_server.sent}
+        if len(replied) >= len(commands):
+            break
+        time.sleep(0.05)
+    if args.workers:
+        workers.stop(timeout=args.timeout)
+    else:
+        application.shutdown(timeout=args.timeout)
+        updater.job_queue.stop()
+
+    replies = collections.defaultdict(list)
+    for message in telegram_server.sent:
+        replies[int(message["chat_id"])].append(message)
+
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    missing = collections.Counter()
+    for i, text in enumerate(commands):
+        command = text.split()[0]
+        chat_id = 1000 + i
+        if not replies[chat_id]:
+            missing[command] += 1
+            continue
+        first_reply = min(m["sent_at"] for m in replies[chat_id])
+        latencies[command].append(first_reply - pushed_at[chat_id])
+        if any(str(m.get("text", "")).startswith(ERROR_REPLIES)
+               for m in replies[chat_id]):
+            errors[command] += 1
+
+    print(f"{'command':<12}{'count':>7}{'errors':>8}{'missing':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for command in sorted(set(text.split()[0] for text in commands)):
+        values = latencies[command] or [float("nan")]
+        print(f"{command:<12}{len(values):>7}{errors[command]:>8}"
+              f"{missing[command]:>9}"
+              + "".join(f"{percentile(values, p) * 1000:>9.1f}"
+                        for p in (50, 95, 99)))
+
+    sent = telegram_server.sent
+    elapsed = max(m["sent_at"] for m in sent) - first if sent else 0
+    print(f"\n{len(sent)} messages in {elapsed:.2f}s: "
+          f"{len(sent) / elapsed if elapsed else 0:.1f} messages/second")
+    print(f"{len(spoonacular.requests) - calls_before} Spoonacular calls, "
+          f"{spoonacular.used:.1f} points")
+
+    telegram_server.stop()
+    spoonacular.stop()
+
+
+if __name__ == "__main__":
+    main()
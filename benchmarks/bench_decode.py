@@ -0,0 +1,83 @@
+"""Benchmark for decoding a bulk recipe response.
+
+Compares the original path (response.json() once to check for a quota error
+and again for the data, keeping the full recipe dictionaries) against
+SpoonacularFacade.decode_response plus recipes_from_bulk. The bulk body is
+built from the recorded fixtures, repeated to a realistic batch size.
+
+Run with:
+    pipenv run python -m benchmarks.bench_decode
+"""
+
+import json
+import timeit
+import tracemalloc
+
+import requests
+
+from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def make_response(recipes, count):
+    body = [
+        dict(recipes[i % len(recipes)], id=i) for i in range(count)]
+    response = requests.models.Response()
+    response.status_code = 200
+    response._content = json.dumps(body).encode()
+    return response
+
+
+def original_decode(response):
+    sp.raise_for_quota_error(response.json())
+    return response.json()
+
+
+def decode(facade, response):
+    return sp.recipes_from_bulk(facade.decode_response(response))
+
+
+def bench(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{label:<40} {seconds / number * 1e3:10.2f} ms/iter")
+    return seconds
+
+
+def allocations(label, fn):
+    """Prints the peak and retained bytes allocated by one call of fn."""
+    tracemalloc.start()
+    result = fn()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {peak / 1024:10.1f} KiB peak "
+          f"{retained / 1024:10.1f} KiB retained")
+    del result
+    return retained
+
+
+def main(count=100, number=20):
+    recipes = fake_spoonacular.load_fixtures()
+    response = make_response(recipes, count)
+    facade = sp.SpoonacularFacade("BENCHMARK")
+    backend = "orjson" if sp.orjson is not None else "json"
+    print(f"Bulk body: {count} recipes, {len(response.content) / 1024:.0f} "
+          f"KiB, decoded with {backend}.\n")
+
+    before = bench(
+        "original (two json() calls)",
+        lambda: original_decode(response), number)
+    after = bench(
+        "decode_response + recipes_from_bulk",
+        lambda: decode(facade, response), number)
+    print()
+    kept_before = allocations(
+        "original (two json() calls)", lambda: original_decode(response))
+    kept_after = allocations(
+        "decode_response + recipes_from_bulk",
+        lambda: decode(facade, response))
+    print(f"\nSpeedup: {before / after:.1f}x, "
+          f"retained memory: {kept_before / kept_after:.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Memory benchmark for models.Recipe against the raw recipe dictionary.
+
+Decodes each recorded fixture recipe many times, like repeated API responses
+would, and measures how much memory holding them takes as full Spoonacular
+dictionaries versus compact Recipe objects.
+
+Run with:
+    pipenv run python -m benchmarks.bench_recipe_memory
+"""
+
+import json
+import tracemalloc
+
+from remy import models
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def load_bodies(count):
+    """Returns count JSON recipe bodies with distinct ids."""
+    recipes = fake_spoonacular.load_fixtures()
+    return [
+        json.dumps(dict(recipes[i % len(recipes)], id=i))
+        for i in range(count)
+    ]
+
+
+def retained(build):
+    """Returns the bytes still allocated by what build returns."""
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main(count=2000):
+    bodies = load_bodies(count)
+
+    raw = retained(lambda: [json.loads(body) for body in bodies])
+    compact = retained(lambda: [
+        models.Recipe.from_json(json.loads(body)) for body in bodies])
+
+    for label, size in [("raw dict", raw), ("models.Recipe", compact)]:
+        print(f"{label:<20} {size / count / 1024:8.1f} KiB/recipe "
+              f"{1024 * 1024 * count / size:8.0f} recipes/MiB")
+    print(f"\n{raw / compact:.1f}x more recipes in the same memory")
+
+
+if __name__ == "__main__":
+    main()
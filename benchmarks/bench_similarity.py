@@ -0,0 +1,62 @@
+"""Benchmark for /similar over a large ingredient index.
+
+Builds a similarity index of synthetic recipes, each a handful of ingredient
+keys drawn from a skewed vocabulary (salt and garlic are everywhere, saffron
+isn't), and times queries against it with NumPy scoring and in plain Python.
+
+Run with:
+    pipenv run python -m benchmarks.bench_similarity
+"""
+
+import random
+import time
+
+from remy import similarity
+
+
+def build(count, vocabulary=2000, seed=0):
+    """Returns a SimilarityIndex of count synthetic recipes."""
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(vocabulary)]
+    index = similarity.SimilarityIndex(path=None)
+    for recipe_id in range(count):
+        keys = rng.choices(range(vocabulary), weights, k=rng.randint(5, 15))
+        index.add(recipe_id, [f"ingredient {key}" for key in keys])
+    return index
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def time_queries(index, queries, limit=3):
+    """Returns the latency in ms of each query."""
+    latencies = []
+    for recipe_id in queries:
+        start = time.perf_counter()
+        index.similar(recipe_id, limit)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def main(count=100000, queries=200):
+    start = time.perf_counter()
+    index = build(count)
+    print(f"built {count} recipes in {time.perf_counter() - start:.2f}s")
+
+    sample = random.Random(1).sample(range(count), queries)
+    numpy = similarity.np
+    for label, module in [("numpy", numpy), ("python", None)]:
+        if label == "numpy" and numpy is None:
+            print("numpy     not installed")
+            continue
+        similarity.np = module
+        latencies = time_queries(index, sample)
+        print(f"{label:<8} p50 {percentile(latencies, 0.5):7.2f} ms "
+              f"p99 {percentile(latencies, 0.99):7.2f} ms")
+    similarity.np = numpy
+
+
+if __name__ == "__main__":
+    main()
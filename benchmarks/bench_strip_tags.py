@@ -0,0 +1,59 @@
+"""Microbenchmark for strip_tags against the original per-call parser.
+
+Run with:
+    pipenv run python -m benchmarks.bench_strip_tags
+"""
+
+import timeit
+
+from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def original_strip_tags(html):
+    """strip_tags as it was: a fresh HTMLStripper for every call."""
+    if not html:
+        return
+    stripper = sp.HTMLStripper()
+    stripper.feed(html)
+    return stripper.get_data()
+
+
+def load_corpus():
+    recipes = fake_spoonacular.load_fixtures()
+    corpus = []
+    for recipe in recipes:
+        corpus.append(recipe["title"])
+        corpus.append(recipe["instructions"])
+        corpus.extend(
+            ingredient["originalString"]
+            for ingredient in recipe["extendedIngredients"])
+    return corpus
+
+
+def bench(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=5))
+    print(f"{label:<40} {seconds / number * 1e6:10.1f} us/iter")
+    return seconds
+
+
+def main(number=200):
+    corpus = load_corpus()
+    for html in corpus:
+        assert sp.strip_tags(html) == original_strip_tags(html), html
+    print(f"Output identical on {len(corpus)} strings.\n")
+
+    before = bench(
+        "original strip_tags (whole corpus)",
+        lambda: [original_strip_tags(html) for html in corpus], number)
+    after = bench(
+        "strip_tags (whole corpus)",
+        lambda: [sp.strip_tags(html) for html in corpus], number)
+    bench(
+        "strip_tags_many (whole corpus)",
+        lambda: sp.strip_tags_many(corpus), number)
+    print(f"\nSpeedup: {before / after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
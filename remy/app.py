@@ -0,0 +1,326 @@
+"""Module to build the bot from its settings.
+
+Nothing is constructed when remy is imported. An Application builds each of
+its parts the first time it's asked for, so e.g. tests that only need the
+facade never create a Telegram Bot and its connection pool, and several
+applications with different Settings can run in one process.
+"""
+
+import functools
+import logging
+import time
+
+from telegram.ext import Updater
+
+from remy import cache
+from remy import chat_executor
+from remy import config
+from remy import ingredient_index
+from remy import logs
+from remy import meal_plans
+from remy import metrics
+from remy import pools
+from remy import quota
+from remy import resilience
+from remy import sender
+from remy import similarity
+from remy import snapshot
+from remy import spoonacular_helper as sp
+from remy import telegram_helper
+
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging(settings):
+    """Starts the background log writer described by settings."""
+    return logs.configure(
+        settings.LOGFILE,
+        level=settings.LOG_LEVEL,
+        fmt=settings.LOG_FORMAT,
+        levels=settings.LOG_LEVELS,
+        sample_rates=settings.LOG_SAMPLE_RATES,
+        queue_size=settings.LOG_QUEUE_SIZE
+    )
+
+
+class Application(object):
+
+    def __init__(self, settings=None):
+        """Constructs an Application object. Its parts are built lazily.
+
+        Args:
+            settings: the config.Settings to build from, defaults to the
+                environment's.
+        """
+        self.settings = settings or config.Settings()
+
+    @functools.cached_property
+    def spoon(self):
+        s = self.settings
+        spoon = sp.SpoonacularFacade(
+            api_key=s.SPOONACULAR_KEY,
+            recipe_cache=cache.RecipeCache(
+                path=s.CACHE_DB_PATH,
+                ttl=s.RECIPE_CACHE_TTL,
+                max_size=s.RECIPE_CACHE_MAX_SIZE,
+                memory_size=s.RECIPE_CACHE_MEMORY_SIZE
+            ),
+            query_cache=cache.PersistentCache(
+                path=s.CACHE_DB_PATH,
+                table="ingredient_queries",
+                ttl=s.QUERY_CACHE_TTL,
+                max_size=s.QUERY_CACHE_MAX_SIZE,
+                memory_size=s.QUERY_CACHE_MEMORY_SIZE
+            ),
+            quota=quota.QuotaAccountant(
+                path=s.CACHE_DB_PATH,
+                daily_limit=s.QUOTA_DAILY_LIMIT,
+                degrade_ratio=s.QUOTA_DEGRADE_RATIO,
+                pace_burst=s.QUOTA_PACE_BURST
+            ),
+            ingredient_index=ingredient_index.IngredientIndex(
+                path=s.CACHE_DB_PATH,
+                max_recipes=s.INGREDIENT_INDEX_MAX_RECIPES
+            ),
+            api_root=s.SPOONACULAR_API_ROOT,
+            sleep_time=s.SPOONACULAR_SLEEP_TIME,
+            timeout=s.SPOONACULAR_TIMEOUT,
+            resilience=self.resilience,
+            min_coverage=s.INGREDIENT_INDEX_MIN_COVERAGE
+        )
+        spoon.add_recipe_listener(functools.partial(
+            telegram_helper.refresh_rendered_recipes, self.message_cache))
+        return spoon
+
+    @functools.cached_property
+    def message_cache(self):
+        """Rendered recipe messages, see telegram_helper.render_recipe."""
+        return cache.MemoryCache(self.settings.MESSAGE_CACHE_SIZE)
+
+    @functools.cached_property
+    def resilience(self):
+        s = self.settings
+        return resilience.Resilience(
+            timeouts=resilience.parse_durations(s.SPOONACULAR_CALL_TIMEOUTS),
+            default_timeout=s.SPOONACULAR_TIMEOUT,
+            retries=s.SPOONACULAR_RETRIES,
+            backoff=s.SPOONACULAR_RETRY_BACKOFF,
+            hedge_after=resilience.parse_durations(s.SPOONACULAR_HEDGE_AFTER),
+            breaker=resilience.CircuitBreaker(
+                "spoonacular",
+                failure_threshold=s.CIRCUIT_FAILURE_THRESHOLD,
+                reset_timeout=s.CIRCUIT_RESET_TIMEOUT
+            ),
+            workers=s.SPOONACULAR_CALL_WORKERS
+        )
+
+    @functools.cached_property
+    def executor(self):
+        return chat_executor.ChatOrderedExecutor(
+            max_workers=self.settings.HANDLER_WORKERS,
+            max_pending=self.settings.HANDLER_MAX_PENDING,
+            max_pending_per_chat=self.settings.HANDLER_MAX_PENDING_PER_CHAT
+        )
+
+    @functools.cached_property
+    def busy_replies(self):
+        """Chat id -> when we last told it we were too busy."""
+        return cache.MemoryCache(self.settings.TELEGRAM_SENDER_MAX_CHATS)
+
+    @functools.cached_property
+    def sender(self):
+        s = self.settings
+        return sender.MessageSender(
+            global_rate=s.TELEGRAM_GLOBAL_RATE,
+            chat_rate=s.TELEGRAM_CHAT_RATE,
+            group_rate=s.TELEGRAM_GROUP_RATE,
+            chat_burst=s.TELEGRAM_CHAT_BURST,
+            workers=s.TELEGRAM_SENDER_WORKERS,
+            max_retries=s.TELEGRAM_SEND_RETRIES,
+            max_chats=s.TELEGRAM_SENDER_MAX_CHATS
+        )
+
+    @functools.cached_property
+    def pools(self):
+        s = self.settings
+        return pools.PoolManager(
+            self.spoon,
+            functools.partial(
+                telegram_helper.render_recipe,
+                message_cache=self.message_cache),
+            prewarm_tags=s.RANDOM_POOL_PREWARM_TAGS,
+            max_tag_sets=s.RANDOM_POOL_MAX_TAG_SETS,
+            random_size=s.RANDOM_POOL_SIZE,
+            random_low_water=s.RANDOM_POOL_LOW_WATER,
+            random_batch=s.RANDOM_POOL_BATCH,
+            cocktail_size=s.COCKTAIL_POOL_SIZE,
+            cocktail_low_water=s.COCKTAIL_POOL_LOW_WATER,
+            cocktail_batch=s.COCKTAIL_POOL_BATCH,
+            max_quota_ratio=s.POOL_REFILL_MAX_QUOTA_RATIO
+        )
+
+    @functools.cached_property
+    def similarity(self):
+        return similarity.SimilarityIndex(path=self.settings.CACHE_DB_PATH)
+
+    @functools.cached_property
+    def meal_plans(self):
+        s = self.settings
+        return meal_plans.MealPlanScheduler(
+            self.spoon,
+            self.sender,
+            meal_plans.SubscriptionStore(path=s.CACHE_DB_PATH),
+            day=s.MEAL_PLAN_DAY,
+            hour=s.MEAL_PLAN_HOUR,
+            batch_size=s.MEAL_PLAN_BATCH_SIZE,
+            batch_interval=s.MEAL_PLAN_BATCH_INTERVAL
+        )
+
+    @functools.cached_property
+    def updater(self):
+        """The Updater, with our handlers and background jobs added."""
+        logger.info("Creating updaters and dispatchers...")
+        updater = Updater(
+            token=self.settings.TELEGRAM_TOKEN,
+            base_url=self.settings.TELEGRAM_BASE_URL
+        )
+        dispatcher = updater.dispatcher
+        # Handlers find the application they belong to here.
+        dispatcher.bot_data["app"] = self
+
+        logger.info("Registering handlers with dispatcher...")
+        for handler in telegram_helper.handlers:
+            dispatcher.add_handler(handler)
+        dispatcher.add_error_handler(telegram_helper.error_handler)
+
+        # Keep the random recipe and cocktail pools topped up in the
+        # background.
+        updater.job_queue.run_repeating(
+            self.pools.refill,
+            interval=self.settings.POOL_REFILL_INTERVAL,
+            first=0
+        )
+        # Every process checks, the first to claim the week sends it.
+        updater.job_queue.run_repeating(
+            self.meal_plans.send_weekly,
+            interval=self.settings.MEAL_PLAN_CHECK_INTERVAL,
+            first=0
+        )
+        if self.settings.SNAPSHOT_PATH:
+            updater.job_queue.run_repeating(
+                self.save_snapshot,
+                interval=self.settings.SNAPSHOT_INTERVAL,
+                first=self.settings.SNAPSHOT_INTERVAL
+            )
+        logger.info("Updater and Dispatcher created.")
+        return updater
+
+    @property
+    def dispatcher(self):
+        return self.updater.dispatcher
+
+    def register_gauges(self):
+        """Reports cache, quota and queue state on the metrics endpoint.
+
+        The gauges are process wide, so the last application to call this
+        is the one reported.
+        """
+        for name, c in [
+                ("recipes", self.spoon.recipe_cache),
+                ("ingredient_queries", self.spoon.query_cache),
+                ("messages", self.message_cache)]:
+            metrics.CACHE_HIT_RATIO.set_function(
+                lambda c=c: c.stats()["hit_rate"], name)
+        metrics.QUOTA_POINTS.set_function(
+            lambda: self.spoon.quota.used, "used")
+        metrics.QUOTA_POINTS.set_function(
+            lambda: self.spoon.quota.limit, "limit")
+        metrics.QUEUE_DEPTH.set_function(self.executor.queue_depth, "handlers")
+        metrics.QUEUE_DEPTH.set_function(self.sender.queue_depth, "sender")
+        metrics.QUEUE_DEPTH.set_function(logs.queue_depth, "logs")
+        metrics.LOG_RECORDS_DROPPED.set_function(logs.dropped)
+        breaker = self.resilience.breaker
+        metrics.CIRCUIT_STATE.set_function(
+            lambda: breaker.state, breaker.name)
+
+    def save_snapshot(self, unused_context=None):
+        """Saves the hot caches and pools to SNAPSHOT_PATH.
+
+        Has the signature of a telegram JobQueue callback so it can be
+        scheduled directly. Parts that were never built are left out.
+        """
+        if not self.settings.SNAPSHOT_PATH:
+            return
+        data = {
+            "messages": [
+                [list(key), list(value)]
+                for key, value in self.message_cache.items()
+            ],
+        }
+        if "spoon" in self.__dict__:
+            data["recipes"] = self.spoon.recipe_cache.snapshot()
+            data["queries"] = self.spoon.query_cache.snapshot()
+        if "pools" in self.__dict__:
+            # Pooled items hold rendered messages, so like the message cache
+            # they're only good for the formatter version that made them.
+            data["pools"] = dict(
+                self.pools.snapshot(), format_version=sp.FORMAT_VERSION)
+        try:
+            snapshot.write(self.settings.SNAPSHOT_PATH, data)
+        except OSError:
+            logger.exception("Failed to save a snapshot.")
+
+    def load_snapshot(self):
+        """Warms the caches and pools from SNAPSHOT_PATH, if it's usable.
+
+        Call this before starting the updater so the first pool refill sees
+        the restored pools.
+
+        Returns:
+            True if a snapshot was loaded.
+        """
+        if not self.settings.SNAPSHOT_PATH:
+            return False
+        start = time.perf_counter()
+        data = snapshot.read(self.settings.SNAPSHOT_PATH)
+        if data is None:
+            return False
+        try:
+            for (recipe_id, version), (message, parse_mode) in data.get(
+                    "messages", []):
+                if version == sp.FORMAT_VERSION:
+                    self.message_cache.put(
+                        (recipe_id, version), (message, parse_mode))
+            recipes = self.spoon.recipe_cache.restore(data.get("recipes", []))
+            queries = self.spoon.query_cache.restore(data.get("queries", []))
+            pools = data.get("pools", {})
+            pooled = 0
+            if pools.get("format_version") == sp.FORMAT_VERSION:
+                pooled = self.pools.restore(pools)
+            elif pools:
+                logger.info("Dropping pooled recipes from an old formatter.")
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # The checksum matched, so this is a snapshot we wrote but can't
+            # make sense of. Keep whatever was restored and carry on.
+            logger.exception("Failed to restore the snapshot.")
+            return False
+        logger.info(
+            "Loaded a snapshot of %d recipes, %d searches and %d pooled "
+            "recipes in %.3fs.", recipes, queries, pooled,
+            time.perf_counter() - start)
+        return True
+
+    def shutdown(self, timeout=None):
+        """Stops the threads of whichever parts were started."""
+        if "executor" in self.__dict__:
+            self.executor.shutdown()
+        if "sender" in self.__dict__:
+            self.sender.stop(timeout=timeout)
+        if "resilience" in self.__dict__:
+            self.resilience.shutdown()
+
+
+def create_app(settings=None):
+    """Returns a new Application built from settings."""
+    return Application(settings)
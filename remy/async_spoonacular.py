@@ -0,0 +1,270 @@
+"""Module to hold an asyncio flavoured Spoonacular facade.
+
+The synchronous SpoonacularFacade blocks a thread per request. This facade
+talks to the same endpoints over a pooled aiohttp session with keep-alive, so
+a single event loop can keep hundreds of requests in flight. Parsing and
+formatting are shared with spoonacular_helper.
+
+The caches, the ingredient index and the quota accountant are SQLite backed
+and can wait seconds on another process's write lock, so every call into them
+runs on a worker thread rather than on the event loop.
+"""
+
+import asyncio
+import logging
+
+import aiohttp
+
+from remy import config
+from remy import exceptions
+from remy import singleflight
+from remy import spoonacular_helper as sp
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSpoonacularFacade(object):
+
+    def __init__(self, api_key=config.SPOONACULAR_KEY,
+                 api_root=config.SPOONACULAR_API_ROOT,
+                 timeout=config.SPOONACULAR_TIMEOUT,
+                 connection_limit=config.SPOONACULAR_CONNECTION_LIMIT,
+                 keepalive_timeout=config.SPOONACULAR_KEEPALIVE_TIMEOUT,
+                 recipe_cache=None, query_cache=None, quota=None,
+                 ingredient_index=None, session=None):
+        """Constructs an AsyncSpoonacularFacade object.
+
+        The HTTP session is created lazily on the first request so the facade
+        can be built outside of a running event loop.
+
+        Args:
+            api_key: str, the API key to authorize the connection.
+            api_root: str, base URL of the Spoonacular API.
+            timeout: float, total seconds allowed per request.
+            connection_limit: int, max open connections in the pool.
+            keepalive_timeout: float, seconds to keep idle connections open.
+            recipe_cache: optional cache.RecipeCache.
+            query_cache: optional cache.PersistentCache keyed by canonical
+                ingredient query.
+            quota: optional quota.QuotaAccountant.
+            ingredient_index: optional ingredient_index.IngredientIndex, given
+                every recipe we return.
+            session: optional aiohttp.ClientSession to use instead of
+                creating one.
+        """
+        self.api_key = api_key
+        self.api_root = api_root
+        self.timeout = timeout
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.recipe_cache = recipe_cache
+        self.query_cache = query_cache
+        self.quota = quota
+        self.ingredient_index = ingredient_index
+        self.flight = singleflight.SingleFlight()
+        self.session = session
+        self.recipe_listeners = []
+
+    def add_recipe_listener(self, listener):
+        """Registers a callable to be given every recipe fetched from the API.
+
+        See SpoonacularFacade.add_recipe_listener. Listeners are called on a
+        worker thread, not on the event loop.
+
+        Args:
+            listener: callable taking a list of Recipe objects.
+        """
+        self.recipe_listeners.append(listener)
+
+    def _notify_recipe_listeners(self, recipes):
+        for listener in self.recipe_listeners:
+            try:
+                listener(recipes)
+            except Exception:
+                logger.exception("Recipe listener failed.")
+
+    def _index_recipes(self, recipes):
+        if self.ingredient_index is None:
+            return
+        try:
+            self.ingredient_index.add_recipes(recipes)
+        except Exception:
+            logger.exception("Failed to index recipes.")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *unused_exc_info):
+        await self.close()
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    keepalive_timeout=self.keepalive_timeout
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            logger.info("Async Spoonacular session created.")
+        return self.session
+
+    async def close(self):
+        """Closes the HTTP session and its pooled connections."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    def check_quota_and_raise(self):
+        """Refuses to make a call when the quota policy says we shouldn't.
+
+        Raises:
+            QuotaError if the quota accountant won't allow more calls.
+        """
+        if self.quota is not None and not self.quota.allow_request():
+            logger.info("Quota policy refused an upstream call.")
+            raise exceptions.QuotaError("Daily points limit nearly reached.")
+
+    async def _get(self, path, **params):
+        """Makes a GET request and returns the decoded JSON body.
+
+        Args:
+            path: str, endpoint path relative to the API root.
+            **params: query parameters, None values are dropped.
+        Returns:
+            The decoded JSON body.
+        Raises:
+            QuotaError if we're out of points, UpstreamError if the request
+            failed or Spoonacular answered with a server error.
+        """
+        await asyncio.to_thread(self.check_quota_and_raise)
+        params = {k: v for k, v in params.items() if v is not None}
+        params["apiKey"] = self.api_key
+        try:
+            async with self._get_session().get(
+                    self.api_root + path, params=params) as response:
+                body = await response.read()
+        except asyncio.TimeoutError:
+            raise exceptions.UpstreamTimeoutError("Spoonacular timed out.")
+        except aiohttp.ClientError as e:
+            raise exceptions.UpstreamError(f"Spoonacular request failed: {e}")
+        if self.quota is not None:
+            await asyncio.to_thread(self.quota.record, response)
+        if response.status >= 500:
+            raise exceptions.UpstreamError(
+                f"Spoonacular answered {response.status}.")
+        content = sp.loads(body)
+        await asyncio.to_thread(sp.raise_for_quota_error, content, self.quota)
+        return content
+
+    async def get_recipe_ids_for_ingredients(self, ingredients,
+                                             limit=config.RECIPE_LIMIT):
+        """Returns recipe ids from the Spoonacular API given ingredients.
+
+        Args:
+            ingredients: str, a comma separated list of ingredient strings.
+            limit: int, max recipe ids to return.
+        Returns:
+            A list of Spoonacular recipe ids.
+        """
+        query = sp.canonicalize_ingredients(ingredients)
+        recipe_data = None
+        if self.query_cache is not None:
+            recipe_data = await asyncio.to_thread(self.query_cache.get, query)
+
+        if recipe_data is None:
+            recipe_data = await self.flight.do_async(
+                ("search", query), self._search_by_ingredients, query,
+                sp.clean_ingredients(ingredients))
+        else:
+            logger.info("Using cached search results for: %s", query)
+
+        return sp.recipe_ids_from_search(recipe_data, limit)
+
+    async def _search_by_ingredients(self, query, ingredients):
+        logger.info(
+            "Calling Spoonacular to search by ingredients: %s", ingredients)
+        recipe_data = await self._get(
+            "recipes/findByIngredients", ingredients=ingredients)
+        if self.query_cache is not None:
+            await asyncio.to_thread(
+                self.query_cache.put, query,
+                sp.search_results_to_cache(recipe_data))
+        return recipe_data
+
+    async def get_random_recipe(self, tags=None):
+        """Returns a random recipe from the Spoonacular API.
+
+        Args:
+            tags: str, a comma separated list of tags. See
+                SpoonacularFacade.get_random_recipe for valid tags.
+        Returns:
+            A Recipe object for the random recipe.
+        """
+        logger.info(
+            "Calling Spoonacular to get a random recipe with tags %s", tags)
+        content = await self._get("recipes/random", tags=tags)
+        recipe = sp.recipe_from_random(content)
+        await asyncio.to_thread(self._notify_recipe_listeners, [recipe])
+        return recipe
+
+    async def get_random_alcoholic_beverage_recipe_id(self):
+        """Returns a single random alcoholic beverage recipe id from the API.
+
+        Returns:
+            A single int Spoonacular recipe id.
+        """
+        logger.info("Calling Spoonacular to get a random cocktail.")
+        content = await self._get(
+            "recipes/complexSearch", query="", **sp.COCKTAIL_SEARCH_PARAMS)
+        return sp.recipe_id_from_complex_search(content)
+
+    async def get_recipes_for_ids(self, ids):
+        """Gets recipes for a set of ids, serving cached ones when possible.
+
+        Args:
+            ids: list of one or more Spoonacular recipe ids.
+        Returns:
+            A list of Recipe objects, in the order of ids.
+        """
+        if self.recipe_cache is None:
+            recipes = await self.flight.do_async(
+                ("bulk", tuple(ids)), self._fetch_recipes_for_ids, ids)
+            await asyncio.to_thread(self._index_recipes, recipes)
+            return recipes
+
+        ids = [int(_id) for _id in ids]
+        recipes = await asyncio.to_thread(self.recipe_cache.get_many, ids)
+        missing = [_id for _id in dict.fromkeys(ids) if _id not in recipes]
+
+        if missing:
+            try:
+                fetched = {
+                    recipe.id: recipe
+                    for recipe in await self.flight.do_async(
+                        ("bulk", tuple(missing)),
+                        self._fetch_recipes_for_ids,
+                        missing
+                    )
+                }
+            except (exceptions.QuotaError, exceptions.UpstreamError) as e:
+                if not recipes:
+                    raise
+                logger.info("%s, serving cached recipes only.",
+                            type(e).__name__)
+                fetched = {}
+            await asyncio.to_thread(self.recipe_cache.put_many, fetched)
+            recipes.update(fetched)
+
+        recipes = sp.merge_in_order(ids, recipes)
+        await asyncio.to_thread(self._index_recipes, recipes)
+        return recipes
+
+    async def _fetch_recipes_for_ids(self, ids):
+        logger.info("Getting %d recipes from Spoonacular.", len(ids))
+        logger.debug("Recipe ids: %s", ids)
+        recipes = sp.recipes_from_bulk(await self._get(
+            "recipes/informationBulk", ids=sp.ids_param(ids)))
+        logger.info("Retrieved data for %d recipes.", len(recipes))
+        await asyncio.to_thread(self._notify_recipe_listeners, recipes)
+        return recipes
@@ -0,0 +1,321 @@
+"""Module to hold remy's local caches."""
+
+import collections
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from remy import config
+from remy import models
+
+
+logger = logging.getLogger(__name__)
+
+
+def connect(path):
+    """Opens a SQLite connection that several processes can share.
+
+    In WAL mode readers carry on while another process writes, and writers
+    wait up to SQLITE_BUSY_TIMEOUT seconds for each other instead of failing.
+
+    Args:
+        path: str, path to the SQLite database file.
+    Returns:
+        A sqlite3 Connection usable from any thread.
+    """
+    db = sqlite3.connect(
+        path, timeout=config.SQLITE_BUSY_TIMEOUT, check_same_thread=False)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+
+class PersistentCache(object):
+    """A key/value cache stored in SQLite with an in-memory LRU in front.
+
+    Values must be JSON serializable, or made so by a subclass's _encode.
+    Entries expire ttl seconds after they were stored, and once the table
+    holds more than max_size entries the oldest ones are evicted. The most
+    recently used memory_size entries are also kept in memory so hot keys
+    never touch the disk.
+    """
+
+    def __init__(self, path=config.CACHE_DB_PATH, table="cache",
+                 ttl=config.RECIPE_CACHE_TTL,
+                 max_size=config.RECIPE_CACHE_MAX_SIZE,
+                 memory_size=config.RECIPE_CACHE_MEMORY_SIZE):
+        """Constructs a PersistentCache object.
+
+        Args:
+            path: str, path to the SQLite database file.
+            table: str, name of the table holding this cache's entries.
+            ttl: int, seconds an entry stays valid.
+            max_size: int, max entries kept on disk.
+            memory_size: int, max entries kept in the in-memory LRU.
+        """
+        self.table = table
+        self.ttl = ttl
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self.hits = 0
+        self.misses = 0
+
+        self._memory = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self._db = connect(path)
+        with self._db:
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+            self._db.execute(
+                f"CREATE INDEX IF NOT EXISTS {table}_stored_at "
+                f"ON {table} (stored_at)")
+        logger.info("Cache '%s' opened at %s.", table, path)
+
+    def _encode(self, value):
+        """Returns the JSON serializable form of a value to store on disk."""
+        return value
+
+    def _decode(self, data):
+        """Rebuilds a value from its decoded JSON form on disk."""
+        return data
+
+    def _expired(self, stored_at, now):
+        return now - stored_at > self.ttl
+
+    def _remember(self, key, value, stored_at):
+        self._memory[key] = (value, stored_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def get_many(self, keys):
+        """Looks up several keys at once.
+
+        Args:
+            keys: iterable of keys to look up.
+        Returns:
+            A dictionary of key -> value for every key that was found and
+            has not expired. Missing keys are simply absent.
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            pending = {}
+            requested = 0
+            for key in keys:
+                requested += 1
+                entry = self._memory.get(key)
+                if entry is not None and not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    found[key] = entry[0]
+                else:
+                    self._memory.pop(key, None)
+                    pending[str(key)] = key
+
+            if pending:
+                placeholders = ",".join("?" * len(pending))
+                rows = self._db.execute(
+                    f"SELECT key, value, stored_at FROM {self.table} "
+                    f"WHERE key IN ({placeholders})",
+                    list(pending)
+                ).fetchall()
+                for db_key, value, stored_at in rows:
+                    if self._expired(stored_at, now):
+                        continue
+                    key = pending[db_key]
+                    found[key] = self._decode(json.loads(value))
+                    self._remember(key, found[key], stored_at)
+
+            self.hits += len(found)
+            self.misses += requested - len(found)
+        return found
+
+    def get(self, key, default=None):
+        """Looks up a single key, returning default if it isn't cached."""
+        return self.get_many([key]).get(key, default)
+
+    def put_many(self, items):
+        """Stores several values at once, evicting the oldest if needed.
+
+        Args:
+            items: dictionary of key -> value.
+        """
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO {self.table} "
+                    "(key, value, stored_at) VALUES (?, ?, ?)",
+                    [(str(key), json.dumps(self._encode(value)), now)
+                     for key, value in items.items()]
+                )
+                self._evict()
+            for key, value in items.items():
+                self._remember(key, value, now)
+
+    def put(self, key, value):
+        """Stores a single value."""
+        self.put_many({key: value})
+
+    def _evict(self):
+        (count,) = self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table}").fetchone()
+        excess = count - self.max_size
+        if excess > 0:
+            logger.info("Evicting %d entries from '%s'.", excess, self.table)
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE key IN ("
+                f"SELECT key FROM {self.table} ORDER BY stored_at LIMIT ?)",
+                (excess,)
+            )
+
+    def snapshot(self):
+        """Returns the entries held in memory, least recently used first.
+
+        Returns:
+            A JSON serializable list of [key, value, stored at] entries.
+        """
+        with self._lock:
+            return [
+                [key, self._encode(value), stored_at]
+                for key, (value, stored_at) in self._memory.items()
+            ]
+
+    def restore(self, entries):
+        """Loads entries from snapshot back into memory.
+
+        Entries are also written to disk, with their original timestamps,
+        unless the disk already has them. Expired entries are skipped.
+
+        Args:
+            entries: list of [key, value, stored at] entries.
+        Returns:
+            The number of entries restored.
+        """
+        now = time.time()
+        fresh = [
+            (key, self._decode(value), stored_at)
+            for key, value, stored_at in entries
+            if not self._expired(stored_at, now)
+        ]
+        with self._lock:
+            with self._db:
+                self._db.executemany(
+                    f"INSERT OR IGNORE INTO {self.table} "
+                    "(key, value, stored_at) VALUES (?, ?, ?)",
+                    [(str(key), json.dumps(self._encode(value)), stored_at)
+                     for key, value, stored_at in fresh]
+                )
+                self._evict()
+            for key, value, stored_at in fresh:
+                self._remember(key, value, stored_at)
+        return len(fresh)
+
+    def clear(self):
+        """Drops every entry from memory and disk."""
+        with self._lock:
+            with self._db:
+                self._db.execute(f"DELETE FROM {self.table}")
+            self._memory.clear()
+
+    def stats(self):
+        """Returns the hit/miss counts for this cache.
+
+        Returns:
+            A dictionary with hits, misses and the hit rate.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class RecipeCache(PersistentCache):
+    """A PersistentCache of models.Recipe objects keyed by recipe id.
+
+    Recipes are kept in memory as compact Recipe objects and stored on disk in
+    the Spoonacular JSON shape. Plain recipe dictionaries can be stored too;
+    they come back as Recipes.
+    """
+
+    def __init__(self, path=config.CACHE_DB_PATH, table="recipes", **kwargs):
+        super().__init__(path=path, table=table, **kwargs)
+
+    def _encode(self, value):
+        return value.to_json()
+
+    def _decode(self, data):
+        return models.Recipe.from_json(data)
+
+    def put_many(self, items):
+        super().put_many({
+            key: models.as_recipe(value) for key, value in items.items()})
+
+
+class MemoryCache(object):
+    """A small thread-safe in-memory LRU cache."""
+
+    def __init__(self, max_size):
+        """Constructs a MemoryCache object.
+
+        Args:
+            max_size: int, max entries kept before the least recently used
+                ones are dropped.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Looks up a key, returning default if it isn't cached."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Stores a value, dropping the least recently used if we're full."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def items(self):
+        """Returns the (key, value) entries, least recently used first."""
+        with self._lock:
+            return list(self._entries.items())
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Returns the hit/miss counts for this cache.
+
+        Returns:
+            A dictionary with hits, misses and the hit rate.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,124 @@
+"""Module to run handlers on a worker pool while keeping each chat in order.
+
+Updates from different chats run concurrently, so one slow /recipe doesn't
+hold up everyone else. Updates from the same chat still run one at a time in
+the order they arrived, so replies never come back shuffled. A chat with too
+many updates already waiting has the rest dropped, so one flooding chat can't
+take every pending slot from the others.
+"""
+
+import collections
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from remy import config
+from remy import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChatOrderedExecutor(object):
+
+    def __init__(self, max_workers=config.HANDLER_WORKERS,
+                 max_pending=config.HANDLER_MAX_PENDING,
+                 max_pending_per_chat=config.HANDLER_MAX_PENDING_PER_CHAT):
+        """Constructs a ChatOrderedExecutor object.
+
+        Args:
+            max_workers: int, threads running handlers.
+            max_pending: int, max tasks queued or running at once. submit
+                blocks when this many are pending, which pushes back on the
+                dispatcher instead of queueing without bound.
+            max_pending_per_chat: int, max tasks queued or running at once
+                for one chat. Tasks past this are dropped.
+        """
+        self.max_pending = max_pending
+        self.max_pending_per_chat = max_pending_per_chat
+        self.pending = 0
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="remy-handler")
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # chat id -> tasks waiting behind the one currently running.
+        self._chats = {}
+
+    def submit(self, chat_id, fn, *args, **kwargs):
+        """Queues fn to run after any earlier tasks for the same chat.
+
+        Args:
+            chat_id: the chat the task belongs to. Tasks with a None chat id
+                are ordered together.
+            fn: callable to run.
+            *args, **kwargs: passed to fn.
+        Returns:
+            True if the task was queued, False if it was dropped because its
+            chat already has max_pending_per_chat tasks pending.
+        """
+        if self._chat_full(chat_id):
+            return self._drop(chat_id)
+        self._slots.acquire()
+        task = (fn, args, kwargs)
+        with self._lock:
+            waiting = self._chats.get(chat_id)
+            if waiting is not None:
+                # Checked again, the chat may have filled up while we waited
+                # for a slot.
+                if len(waiting) + 1 >= self.max_pending_per_chat:
+                    self._slots.release()
+                    return self._drop(chat_id)
+                self.pending += 1
+                waiting.append(task)
+                return True
+            self.pending += 1
+            self._chats[chat_id] = collections.deque()
+        self._pool.submit(self._run, chat_id, task)
+        return True
+
+    def _chat_full(self, chat_id):
+        with self._lock:
+            waiting = self._chats.get(chat_id)
+            return (waiting is not None and
+                    len(waiting) + 1 >= self.max_pending_per_chat)
+
+    def _drop(self, chat_id):
+        logger.warning("Chat %s has too many pending updates, dropping one.",
+                       chat_id)
+        metrics.UPDATES_DROPPED.inc("chat_busy")
+        return False
+
+    def _run(self, chat_id, task):
+        fn, args, kwargs = task
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Task for chat %s failed.", chat_id)
+        finally:
+            with self._lock:
+                self.pending -= 1
+                waiting = self._chats[chat_id]
+                next_task = waiting.popleft() if waiting else None
+                if next_task is None:
+                    del self._chats[chat_id]
+                if not self.pending:
+                    self._idle.notify_all()
+            self._slots.release()
+
+        # Go to the back of the pool's queue rather than looping here, so a
+        # busy chat doesn't keep a worker to itself.
+        if next_task is not None:
+            self._pool.submit(self._run, chat_id, next_task)
+
+    def queue_depth(self):
+        """Returns the number of tasks queued or running."""
+        return self.pending
+
+    def shutdown(self, wait=True):
+        """Stops the worker pool, by default after pending tasks finish."""
+        if wait:
+            with self._lock:
+                while self.pending:
+                    self._idle.wait()
+        self._pool.shutdown(wait=wait)
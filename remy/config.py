@@ -1,14 +1,17 @@
 import os
-import logging
 
+# Logs are written by a background thread, see logs.py. Nothing is logged to
+# the file until runner.main (or app.configure_logging) sets that up.
 LOGFILE = os.environ.get("LOGFILE", "/tmp/remy.log")
-
-logging.basicConfig(
-    filename=LOGFILE,
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)-8s %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+# Either "json" (one object per line) or "text".
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+# Per-logger levels, e.g. "remy.cache=WARNING,telegram=ERROR".
+LOG_LEVELS = os.environ.get("LOG_LEVELS", "")
+# Fraction of INFO lines kept per logger, e.g. "remy.spoonacular_helper=0.1".
+LOG_SAMPLE_RATES = os.environ.get("LOG_SAMPLE_RATES", "")
+# Records beyond this many waiting to be written are dropped.
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
 
 # Telegram Constants
 # Default to a fake Telegram token for testing purposes if none is provided.
@@ -17,12 +20,195 @@ TELEGRAM_TOKEN = os.environ.get("TELEGRAM_TOKEN", f"{'1' * 10}:{'A' * 35}")
 # https://core.telegram.org/method/messages.sendMessage 
 # https://limits.tginfo.me/en
 TELEGRAM_MESSAGE_CHAR_LIMIT = 4096
+# Outgoing messages are throttled to Telegram's limits:
+# https://core.telegram.org/bots/faq#my-bot-is-hitting-limits-how-do-i-avoid-this
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GROUP_RATE = float(os.environ.get("TELEGRAM_GROUP_RATE", 20 / 60))
+# A /recipe reply is three messages, so let chats receive that many at once.
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", 3))
+TELEGRAM_SENDER_WORKERS = int(os.environ.get("TELEGRAM_SENDER_WORKERS", 8))
+TELEGRAM_SEND_RETRIES = int(os.environ.get("TELEGRAM_SEND_RETRIES", 3))
+TELEGRAM_SENDER_MAX_CHATS = 10000
+# Override to point the bot at another Bot API server, e.g. a local fake.
+TELEGRAM_BASE_URL = os.environ.get("TELEGRAM_BASE_URL")
+
+# Run this many worker processes behind a supervisor, see supervisor.py.
+WORKERS = int(os.environ.get("WORKERS", 1))
+# Seconds the supervisor gives each worker to finish its queue and exit when
+# stopping before terminating it.
+WORKER_STOP_TIMEOUT = float(os.environ.get("WORKER_STOP_TIMEOUT", 30))
+
+# Handlers run on a worker pool, one update at a time per chat. Once this
+# many updates are queued the dispatcher waits for workers to catch up. A
+# chat with HANDLER_MAX_PENDING_PER_CHAT updates queued has the rest dropped.
+HANDLER_WORKERS = int(os.environ.get("HANDLER_WORKERS", 16))
+HANDLER_MAX_PENDING = int(os.environ.get("HANDLER_MAX_PENDING", 256))
+HANDLER_MAX_PENDING_PER_CHAT = int(
+    os.environ.get("HANDLER_MAX_PENDING_PER_CHAT", 8))
+# A chat whose updates are dropped is told to try again, at most once every
+# this many seconds.
+HANDLER_BUSY_REPLY_INTERVAL = float(
+    os.environ.get("HANDLER_BUSY_REPLY_INTERVAL", 10))
+
+# Prometheus metrics are served at http://METRICS_LISTEN:METRICS_PORT/metrics
+# unless METRICS_ENABLED is set to 0.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 8000))
+
+# Either "polling" or "webhook". Webhook mode runs a local HTTP server that
+# Telegram (or a load balancer in front of us) posts updates to.
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+# Public base URL Telegram should post to, e.g. https://remy.example.com
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
+# Secret path segment so only Telegram knows where to post updates.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# Max simultaneous connections Telegram opens to the webhook (1-100).
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
 
 # Spoonacular Constants
 SPOONACULAR_KEY = os.environ.get("SPOONACULAR_KEY", "TESTKEY")
+SPOONACULAR_API_ROOT = os.environ.get(
+    "SPOONACULAR_API_ROOT", "https://api.spoonacular.com/")
+# The spoonacular client sleeps this long after every request as a crude
+# rate limit. 1.5 seconds is the client's own default.
+SPOONACULAR_SLEEP_TIME = float(os.environ.get("SPOONACULAR_SLEEP_TIME", 1.5))
+# Connection settings for the async client's pooled HTTP session.
+SPOONACULAR_TIMEOUT = float(os.environ.get("SPOONACULAR_TIMEOUT", 10))
+SPOONACULAR_CONNECTION_LIMIT = int(
+    os.environ.get("SPOONACULAR_CONNECTION_LIMIT", 100))
+SPOONACULAR_KEEPALIVE_TIMEOUT = float(
+    os.environ.get("SPOONACULAR_KEEPALIVE_TIMEOUT", 30))
+# Seconds a facade call may wait on Spoonacular before giving up, by method
+# ("search", "bulk", "random", "cocktails" and "mealplan"), e.g.
+# "search=5,bulk=10". Methods not listed get SPOONACULAR_TIMEOUT. These
+# include the client's SPOONACULAR_SLEEP_TIME after each request.
+SPOONACULAR_CALL_TIMEOUTS = os.environ.get(
+    "SPOONACULAR_CALL_TIMEOUTS",
+    "search=8,bulk=12,random=8,cocktails=8,mealplan=20")
+# Failed or timed out calls are retried this many times, after a random wait
+# of up to SPOONACULAR_RETRY_BACKOFF seconds, doubling each time.
+SPOONACULAR_RETRIES = int(os.environ.get("SPOONACULAR_RETRIES", 2))
+SPOONACULAR_RETRY_BACKOFF = float(
+    os.environ.get("SPOONACULAR_RETRY_BACKOFF", 0.2))
+# Seconds to wait on a call before sending a second, hedged copy and taking
+# whichever answers first, by method, e.g. "search=1.5". Hedges can spend
+# points twice, so none are sent by default.
+SPOONACULAR_HEDGE_AFTER = os.environ.get("SPOONACULAR_HEDGE_AFTER", "")
+# Threads making Spoonacular calls, so callers can stop waiting on one. A
+# caller can leave one abandoned attempt per retry running, so allow for
+# (SPOONACULAR_RETRIES + 1) threads per concurrent caller.
+SPOONACULAR_CALL_WORKERS = int(
+    os.environ.get("SPOONACULAR_CALL_WORKERS", 32))
+# After this many failed calls in a row we stop calling Spoonacular, and
+# answer from the caches, for CIRCUIT_RESET_TIMEOUT seconds. Then a single
+# call is let through to see if it has recovered.
+CIRCUIT_FAILURE_THRESHOLD = int(
+    os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
 RECIPE_LIMIT = 3
-ALLOWED_TAGS = [
-    # Diets https://spoonacular.com/food-api/docs#Diets
+# /recipe takes several ";" separated ingredient sets and searches them all at
+# once. Anything past this many sets is ignored.
+MAX_INGREDIENT_SETS = int(os.environ.get("MAX_INGREDIENT_SETS", 5))
+# /similar answers with this many recipes.
+SIMILAR_LIMIT = int(os.environ.get("SIMILAR_LIMIT", 3))
+# Inline queries (@remybot eggs, spinach) are answered from the local caches
+# with this many recipe cards per page, out of at most INLINE_MAX_RESULTS.
+INLINE_PAGE_SIZE = int(os.environ.get("INLINE_PAGE_SIZE", 10))
+INLINE_MAX_RESULTS = int(os.environ.get("INLINE_MAX_RESULTS", 50))
+# Seconds Telegram may serve an inline answer from its own cache.
+INLINE_CACHE_TIME = int(os.environ.get("INLINE_CACHE_TIME", 300))
+# Seconds a user has to stop typing before an inline query nothing local
+# matches is searched on Spoonacular.
+INLINE_DEBOUNCE = float(os.environ.get("INLINE_DEBOUNCE", 0.7))
+# Free plans get 150 points a day. The real limit is picked up from the quota
+# headers on the first response.
+QUOTA_DAILY_LIMIT = float(os.environ.get("QUOTA_DAILY_LIMIT", 150))
+# Once this fraction of the daily points is spent we stop calling Spoonacular
+# and only answer from local caches.
+QUOTA_DEGRADE_RATIO = float(os.environ.get("QUOTA_DEGRADE_RATIO", 0.95))
+# When the pace so far would spend more than the daily points by midnight,
+# calls are rationed to an even pace plus this fraction of the day's points,
+# and pool refills pause.
+QUOTA_PACE_BURST = float(os.environ.get("QUOTA_PACE_BURST", 0.1))
+
+# Cache Constants
+# Caches, the ingredient index and the quota totals share this database, and
+# with it every worker process in supervisor mode.
+CACHE_DB_PATH = os.environ.get("CACHE_DB_PATH", "/tmp/remy.db")
+# Seconds a write waits for another process's write to finish.
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 10))
+# Recipes are cached for a day by default and the on-disk cache is capped so
+# it can't grow without bound.
+RECIPE_CACHE_TTL = int(os.environ.get("RECIPE_CACHE_TTL", 60 * 60 * 24))
+RECIPE_CACHE_MAX_SIZE = int(os.environ.get("RECIPE_CACHE_MAX_SIZE", 10000))
+# Recipes are held in memory as compact models.Recipe objects (about a tenth
+# of the raw dictionary's size, see benchmarks/bench_recipe_memory.py).
+RECIPE_CACHE_MEMORY_SIZE = int(
+    os.environ.get("RECIPE_CACHE_MEMORY_SIZE", 5000))
+QUERY_CACHE_TTL = int(os.environ.get("QUERY_CACHE_TTL", 60 * 60 * 24))
+QUERY_CACHE_MAX_SIZE = int(os.environ.get("QUERY_CACHE_MAX_SIZE", 5000))
+QUERY_CACHE_MEMORY_SIZE = int(os.environ.get("QUERY_CACHE_MEMORY_SIZE", 500))
+# /recipe answers from the local ingredient index without calling Spoonacular
+# when each of the top results uses at least this fraction of the ingredients.
+INGREDIENT_INDEX_MIN_COVERAGE = float(
+    os.environ.get("INGREDIENT_INDEX_MIN_COVERAGE", 1.0))
+# The index keeps this many recipes, the first indexed dropped first. Matches
+# the recipe cache by default, as results it no longer holds cost a call.
+INGREDIENT_INDEX_MAX_RECIPES = int(os.environ.get(
+    "INGREDIENT_INDEX_MAX_RECIPES", RECIPE_CACHE_MAX_SIZE))
+# Hot caches and pools are saved here every SNAPSHOT_INTERVAL seconds and at
+# shutdown, and loaded at startup. Set SNAPSHOT_PATH to "" to turn it off.
+SNAPSHOT_PATH = os.environ.get("SNAPSHOT_PATH", "/tmp/remy.snapshot")
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", 300))
+# Rendered (message, parse mode) pairs for recently sent recipes.
+MESSAGE_CACHE_SIZE = int(os.environ.get("MESSAGE_CACHE_SIZE", 2000))
+
+# Random Pool Constants
+# /random and /happyhour answer from pools of pre-fetched recipes that a
+# background job refills in batches once they drop below the low-water mark.
+RANDOM_POOL_SIZE = int(os.environ.get("RANDOM_POOL_SIZE", 20))
+RANDOM_POOL_LOW_WATER = int(os.environ.get("RANDOM_POOL_LOW_WATER", 5))
+RANDOM_POOL_BATCH = int(os.environ.get("RANDOM_POOL_BATCH", 20))
+# Tag sets (as typed after /random) whose pools are filled at startup and
+# kept however many other tag sets are asked for.
+RANDOM_POOL_PREWARM_TAGS = [
+    "",
+    "breakfast",
+    "main course",
+    "dessert",
+    "vegetarian",
+]
+# Pools for other tag sets are created on demand, up to this many, the least
+# recently used dropped first.
+RANDOM_POOL_MAX_TAG_SETS = int(os.environ.get("RANDOM_POOL_MAX_TAG_SETS", 32))
+COCKTAIL_POOL_SIZE = int(os.environ.get("COCKTAIL_POOL_SIZE", 10))
+COCKTAIL_POOL_LOW_WATER = int(os.environ.get("COCKTAIL_POOL_LOW_WATER", 3))
+COCKTAIL_POOL_BATCH = int(os.environ.get("COCKTAIL_POOL_BATCH", 10))
+POOL_REFILL_INTERVAL = int(os.environ.get("POOL_REFILL_INTERVAL", 60))
+# Refills are skipped once this fraction of the daily quota is spent so the
+# remaining points go to live requests.
+POOL_REFILL_MAX_QUOTA_RATIO = float(
+    os.environ.get("POOL_REFILL_MAX_QUOTA_RATIO", 0.8))
+
+# Weekly meal plans go out on this day of the week (0 is Monday), at or after
+# this hour, UTC. Every process checks every MEAL_PLAN_CHECK_INTERVAL seconds
+# and the first to claim the week sends it, so a failed week is retried.
+MEAL_PLAN_DAY = int(os.environ.get("MEAL_PLAN_DAY", 6))
+MEAL_PLAN_HOUR = int(os.environ.get("MEAL_PLAN_HOUR", 17))
+MEAL_PLAN_CHECK_INTERVAL = int(
+    os.environ.get("MEAL_PLAN_CHECK_INTERVAL", 60 * 60))
+# Plans are handed to the sender this many at a time, every
+# MEAL_PLAN_BATCH_INTERVAL seconds, so they don't crowd out replies.
+MEAL_PLAN_BATCH_SIZE = int(os.environ.get("MEAL_PLAN_BATCH_SIZE", 20))
+MEAL_PLAN_BATCH_INTERVAL = float(
+    os.environ.get("MEAL_PLAN_BATCH_INTERVAL", 2))
+
+# Diets https://spoonacular.com/food-api/docs#Diets
+ALLOWED_DIETS = [
     "gluten free",
     "ketogenic",
     "vegetarian",
@@ -33,6 +219,9 @@ ALLOWED_TAGS = [
     "paleo",
     "primal",
     "whole30",
+]
+
+ALLOWED_TAGS = ALLOWED_DIETS + [
     # Intolerances https://spoonacular.com/food-api/docs#Intolerances
     "dairy",
     "egg",
@@ -90,3 +279,41 @@ ALLOWED_TAGS = [
     "drink",
     "",
 ]
+
+
+# Settings an Application doesn't build anything from: process wide values
+# and Telegram's and Spoonacular's own constants. They can only be set through
+# the environment.
+FIXED_SETTINGS = {
+    "ALLOWED_DIETS",
+    "ALLOWED_TAGS",
+    "SPOONACULAR_CONNECTION_LIMIT",
+    "SPOONACULAR_KEEPALIVE_TIMEOUT",
+    "SQLITE_BUSY_TIMEOUT",
+    "TELEGRAM_MESSAGE_CHAR_LIMIT",
+}
+
+
+class Settings(object):
+    """The settings an Application is built from.
+
+    Starts from the values above, which are read from the environment when
+    this module is imported, so different instances can run side by side in
+    one process with their own overrides, e.g.
+
+        Settings(CACHE_DB_PATH="/tmp/other.db", TELEGRAM_TOKEN=token)
+
+    Overriding one of FIXED_SETTINGS raises a ValueError, since it wouldn't
+    take effect.
+    """
+
+    def __init__(self, **overrides):
+        for name, value in globals().items():
+            if name.isupper() and name != "FIXED_SETTINGS":
+                setattr(self, name, value)
+        for name, value in overrides.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown setting: {name}")
+            if name in FIXED_SETTINGS:
+                raise ValueError(f"{name} can't be set per application")
+            setattr(self, name, value)
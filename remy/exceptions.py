@@ -19,3 +19,28 @@ class RecipesNotFoundError(Exception):
 class InvalidRandomTagError(Exception):
     """Error if an invalid tag is passed to the /random command."""
     pass
+
+
+class UpstreamError(Exception):
+    """Error when Spoonacular fails or doesn't answer in time."""
+    pass
+
+
+class UpstreamTimeoutError(UpstreamError):
+    """Error when a Spoonacular call takes longer than its timeout."""
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    """Error when we've stopped calling Spoonacular after repeated failures."""
+    pass
+
+
+class InvalidMealPlanError(Exception):
+    """Error if /mealplan is given settings we don't understand."""
+    pass
+
+
+class SimilarRecipesNotFoundError(Exception):
+    """Error if /similar has no recipe to go on or nothing is like it."""
+    pass
@@ -0,0 +1 @@
+"""Local stand-ins for the services remy talks to, for tests and benchmarks."""
@@ -0,0 +1,264 @@
+"""A local fake of the Spoonacular API.
+
+Point a SpoonacularFacade at FakeSpoonacularServer.base_url (the api_root
+argument, or SPOONACULAR_API_ROOT) and it will get recipes from the recorded
+fixtures instead of api.spoonacular.com. The fixtures are repeated under new
+ids to build a catalogue of any size. Responses carry the usual quota
+headers, and latency, server errors and 402 quota errors can be injected.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "spoonacular_recipes.json")
+
+QUOTA_ERROR = {
+    "status": "failure",
+    "code": 402,
+    "message": "Your daily points limit of 150 has been reached. Please "
+               "upgrade your plan to continue using the API.",
+}
+
+DAYS = (
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday",
+    "sunday")
+
+SERVER_ERROR = {
+    "status": "failure",
+    "code": 500,
+    "message": "Something went wrong on our side.",
+}
+
+
+def load_fixtures(path=FIXTURES):
+    with open(path) as f:
+        return json.load(f)
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        status, result, headers = self.server.fake.handle(
+            url.path.strip("/"), params)
+        payload = json.dumps(result).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *unused_args):
+        pass
+
+
+class FakeSpoonacularServer(object):
+
+    def __init__(self, host="127.0.0.1", port=0, recipes=None,
+                 catalogue_size=500, daily_limit=float("inf"), latency=0,
+                 jitter=0, error_rate=0, quota_error_rate=0, seed=None):
+        """Constructs a FakeSpoonacularServer object. Call start to serve.
+
+        Args:
+            host: str, address to listen on.
+            port: int, port to listen on, 0 picks a free one.
+            recipes: list of recipe dictionaries to build the catalogue from,
+                defaults to the recorded fixtures.
+            catalogue_size: int, number of distinct recipes served.
+            daily_limit: float, points available before every call gets a
+                402.
+            latency: float, seconds added to every response.
+            jitter: float, max extra seconds added at random.
+            error_rate: float, fraction of calls answered with a 500.
+            quota_error_rate: float, fraction of calls answered with a 402.
+            seed: optional seed for the random choices.
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.fake = self
+        self.daily_limit = daily_limit
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.used = 0.0
+        self.requests = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        templates = recipes or load_fixtures()
+        self.recipes = {}
+        for i in range(max(catalogue_size, len(templates))):
+            template = templates[i % len(templates)]
+            recipe_id = template["id"] if i < len(templates) else i
+            self.recipes[recipe_id] = dict(template, id=recipe_id)
+
+    @property
+    def base_url(self):
+        """The api_root to hand to a Spoonacular client."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Fake Spoonacular listening at %s", self.base_url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *unused_exc_info):
+        self.stop()
+
+    def handle(self, path, params):
+        """Answers an API call.
+
+        Args:
+            path: str, the endpoint path, e.g. "recipes/random".
+            params: dictionary of the query parameters.
+        Returns:
+            A (status code, JSON serializable body, headers) tuple.
+        """
+        with self._lock:
+            self.requests.append((path, params))
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            roll = self._random.random()
+        if delay:
+            time.sleep(delay)
+
+        if roll < self.error_rate:
+            return 500, SERVER_ERROR, {}
+        if roll < self.error_rate + self.quota_error_rate:
+            return 402, QUOTA_ERROR, self._quota_headers(0)
+
+        handler = getattr(
+            self, "_api_" + path.replace("/", "_"), None)
+        if handler is None:
+            return 404, {"status": "failure", "code": 404}, {}
+        result, cost = handler(params)
+        with self._lock:
+            if self.used + cost > self.daily_limit:
+                return 402, QUOTA_ERROR, self._quota_headers(0)
+            self.used += cost
+            return 200, result, self._quota_headers(cost)
+
+    def _quota_headers(self, cost):
+        headers = {
+            "X-API-Quota-Request": cost,
+            "X-API-Quota-Used": self.used,
+        }
+        if self.daily_limit != float("inf"):
+            headers["X-API-Quota-Left"] = max(
+                self.daily_limit - self.used, 0)
+        return headers
+
+    def _sample(self, recipes, number):
+        with self._lock:
+            return self._random.sample(recipes, min(number, len(recipes)))
+
+    def _api_recipes_findByIngredients(self, params):
+        wanted = [
+            ingredient.strip().lower()
+            for ingredient in params.get("ingredients", "").split(",")
+            if ingredient.strip()
+        ]
+        number = int(params.get("number", 10))
+        results = []
+        for recipe in self.recipes.values():
+            names = [i["name"] for i in recipe["extendedIngredients"]]
+            used = sum(
+                any(ingredient in name for name in names)
+                for ingredient in wanted)
+            if used:
+                results.append({
+                    "id": recipe["id"],
+                    "title": recipe["title"],
+                    "usedIngredientCount": used,
+                    "missedIngredientCount": len(names) - used,
+                })
+        results.sort(key=lambda r: (
+            -r["usedIngredientCount"], r["missedIngredientCount"], r["id"]))
+        results = results[:number]
+        return results, 1 + 0.01 * len(results)
+
+    def _api_recipes_random(self, params):
+        tags = {
+            tag.strip() for tag in params.get("tags", "").split(",")
+            if tag.strip()
+        }
+        matching = [
+            recipe for recipe in self.recipes.values()
+            if tags <= set(
+                recipe["dishTypes"] + recipe["diets"] + recipe["cuisines"])
+        ]
+        recipes = self._sample(matching, int(params.get("number", 1)))
+        return {"recipes": recipes}, 1 + 0.01 * len(recipes)
+
+    def _api_recipes_complexSearch(self, params):
+        recipes = list(self.recipes.values())
+        if params.get("type"):
+            recipes = [r for r in recipes if params["type"] in r["dishTypes"]]
+        results = [
+            {"id": recipe["id"], "title": recipe["title"]}
+            for recipe in self._sample(recipes, int(params.get("number", 10)))
+        ]
+        return {
+            "results": results,
+            "offset": 0,
+            "number": len(results),
+            "totalResults": len(recipes),
+        }, 1 + 0.01 * len(results)
+
+    def _api_recipes_mealplans_generate(self, params):
+        diet = params.get("diet")
+        excluded = [
+            ingredient.strip().lower()
+            for ingredient in params.get("exclude", "").split(",")
+            if ingredient.strip()
+        ]
+        recipes = [
+            recipe for recipe in self.recipes.values()
+            if (not diet or diet in recipe["diets"]) and not any(
+                ingredient in i["name"]
+                for ingredient in excluded
+                for i in recipe["extendedIngredients"])
+        ]
+        week = {}
+        for day in DAYS:
+            meals = self._sample(recipes, 3)
+            week[day] = {
+                "meals": [{
+                    "id": recipe["id"],
+                    "title": recipe["title"],
+                    "readyInMinutes": recipe["readyInMinutes"],
+                    "sourceUrl": recipe["sourceUrl"],
+                } for recipe in meals],
+                "nutrients": {"calories": float(params.get(
+                    "targetCalories") or 2000)},
+            }
+        return {"week": week}, 1
+
+    def _api_recipes_informationBulk(self, params):
+        ids = [int(_id) for _id in params.get("ids", "").split(",") if _id]
+        recipes = [self.recipes[_id] for _id in ids if _id in self.recipes]
+        return recipes, 1 + 0.5 * max(len(recipes) - 1, 0)
@@ -0,0 +1,246 @@
+"""A local fake of the Telegram Bot API.
+
+Point an Updater at FakeTelegramServer.base_url and the bot will talk to this
+server instead of api.telegram.org. Updates pushed with push_update are
+delivered to the registered webhook, or handed out through getUpdates when no
+webhook is set. Everything the bot sends is recorded in sent.
+"""
+
+import json
+import logging
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+logger = logging.getLogger(__name__)
+
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "remy",
+    "username": "remybot",
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        self._dispatch({})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        try:
+            params = json.loads(body) if body else {}
+        except ValueError:
+            params = {}
+        self._dispatch(params)
+
+    def _dispatch(self, params):
+        # Paths look like /bot<token>/<method>
+        method = self.path.rsplit("/", 1)[-1].split("?")[0]
+        result = self.server.fake.handle(method, params)
+        payload = json.dumps({"ok": True, "result": result}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *unused_args):
+        pass
+
+
+class FakeTelegramServer(object):
+
+    def __init__(self, host="127.0.0.1", port=0):
+        """Constructs a FakeTelegramServer object. Call start to serve.
+
+        Args:
+            host: str, address to listen on.
+            port: int, port to listen on, 0 picks a free one.
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.fake = self
+        self.webhook_url = None
+        self.webhook_settings = {}
+        self.sent = []
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._lock = threading.Condition()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        """The base_url to hand to telegram.ext.Updater."""
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info("Fake Telegram listening at %s", self.base_url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *unused_exc_info):
+        self.stop()
+
+    def handle(self, method, params):
+        """Answers a Bot API method call.
+
+        The bot sends every parameter as a string, so numbers arrive as e.g.
+        "42" rather than 42.
+
+        Args:
+            method: str, the Bot API method name.
+            params: dictionary of the call's parameters.
+        Returns:
+            The JSON serializable result for the call.
+        """
+        handler = getattr(self, f"_api_{method}", None)
+        if handler is None:
+            return True
+        return handler(params)
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_setWebhook(self, params):
+        with self._lock:
+            self.webhook_url = params.get("url") or None
+            self.webhook_settings = params
+        return True
+
+    def _api_deleteWebhook(self, params):
+        with self._lock:
+            self.webhook_url = None
+            self.webhook_settings = {}
+        return True
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        deadline = time.monotonic() + min(float(params.get("timeout") or 0), 1)
+        with self._lock:
+            self._updates = [
+                u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates and time.monotonic() < deadline:
+                self._lock.wait(deadline - time.monotonic())
+            return list(self._updates)
+
+    def _record(self, kind, params):
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+            self.sent.append(dict(params, method=kind, sent_at=time.time()))
+            self._lock.notify_all()
+        return message_id
+
+    def _api_sendMessage(self, params):
+        message_id = self._record("sendMessage", params)
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id")), "type": "private"},
+            "text": params.get("text"),
+        }
+
+    def _api_answerInlineQuery(self, params):
+        self._record("answerInlineQuery", params)
+        return True
+
+    def push_update(self, update):
+        """Delivers an update to the bot like Telegram would.
+
+        Args:
+            update: dictionary of the update, update_id is filled in.
+        Returns:
+            The update_id assigned to the update.
+        """
+        with self._lock:
+            update = dict(update, update_id=self._next_update_id)
+            self._next_update_id += 1
+            webhook_url = self.webhook_url
+            if webhook_url is None:
+                self._updates.append(update)
+                self._lock.notify_all()
+
+        if webhook_url is not None:
+            request = urllib.request.Request(
+                webhook_url,
+                data=json.dumps(update).encode(),
+                headers={"Content-Type": "application/json"}
+            )
+            urllib.request.urlopen(request, timeout=5).read()
+        return update["update_id"]
+
+    def wait_for_sent(self, count, timeout=5):
+        """Blocks until at least count messages were sent, or timeout.
+
+        Returns:
+            The list of sent messages.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while len(self.sent) < count and time.monotonic() < deadline:
+                self._lock.wait(deadline - time.monotonic())
+            return list(self.sent)
+
+
+def command_update(text, chat_id=1, user_id=1):
+    """Builds the update dictionary for a user sending a command.
+
+    Args:
+        text: str, the message text, e.g. "/recipe eggs".
+        chat_id: int, the chat the message was sent in.
+        user_id: int, the sender.
+    Returns:
+        A dictionary in the Bot API update format, without an update_id.
+    """
+    command = text.split()[0]
+    return {
+        "message": {
+            "message_id": 1,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "text": text,
+            "entities": [{
+                "type": "bot_command",
+                "offset": 0,
+                "length": len(command),
+            }],
+        }
+    }
+
+
+def inline_query_update(query, query_id="1", offset="", user_id=1):
+    """Builds the update dictionary for a user typing an inline query.
+
+    Args:
+        query: str, the text typed after the bot's username.
+        query_id: str, the inline query's id.
+        offset: str, the next_offset of the page being asked for.
+        user_id: int, the user typing.
+    Returns:
+        A dictionary in the Bot API update format, without an update_id.
+    """
+    return {
+        "inline_query": {
+            "id": query_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": "user"},
+            "query": query,
+            "offset": offset,
+        }
+    }
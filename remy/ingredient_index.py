@@ -0,0 +1,180 @@
+"""Module to hold a local inverted index from ingredients to recipes.
+
+Every recipe we fetch lists its ingredients, so over time we learn enough to
+answer many /recipe searches ourselves. Recipes are ranked like Spoonacular's
+"maximize used ingredients": most query ingredients used first, then fewest
+extra ingredients needed.
+
+The index holds at most max_recipes recipes. Past that, the ones indexed
+first are dropped, from memory by every process and from the database by the
+process that indexed the newer ones.
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from remy import cache
+from remy import config
+from remy import spoonacular_helper as sp
+
+
+logger = logging.getLogger(__name__)
+
+
+# Recipes without ingredients get a row with this key, so every process knows
+# they're indexed.
+NO_INGREDIENTS = ""
+
+
+def ingredient_keys(name):
+    """Returns the index keys for an ingredient name.
+
+    An ingredient is indexed under its full canonical name and its last word,
+    so "parmesan cheese" is found by both "parmesan cheese" and "cheese".
+
+    Args:
+        name: str, an ingredient name from extendedIngredients.
+    Returns:
+        A set of index keys.
+    """
+    canonical = sp.canonicalize_ingredients(name.replace(",", " "))
+    if not canonical:
+        return set()
+    return {canonical, canonical.split()[-1]}
+
+
+class IngredientIndex(object):
+
+    def __init__(self, path=config.CACHE_DB_PATH,
+                 max_recipes=config.INGREDIENT_INDEX_MAX_RECIPES):
+        """Constructs an IngredientIndex object, loading it from disk.
+
+        Args:
+            path: str, path to the SQLite database file.
+            max_recipes: int, max recipes indexed, oldest dropped first.
+        """
+        self.max_recipes = max_recipes
+        self._lock = threading.Lock()
+        self._postings = collections.defaultdict(set)
+        self._sizes = {}
+        # recipe id -> its index keys, oldest recipe first.
+        self._keys = collections.OrderedDict()
+        self._rowid = 0
+        self._db = cache.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ingredient_index ("
+                "recipe_id INTEGER, ingredient TEXT, size INTEGER, "
+                "PRIMARY KEY (recipe_id, ingredient))")
+
+        start = time.perf_counter()
+        self._load_new_rows()
+        self._prune()
+        logger.info("Loaded %d recipes into the ingredient index in %.3fs.",
+                    len(self._sizes), time.perf_counter() - start)
+
+    def _load_new_rows(self):
+        """Loads rows added since the last load, e.g. by another process."""
+        for rowid, recipe_id, ingredient, size in self._db.execute(
+                "SELECT rowid, recipe_id, ingredient, size "
+                "FROM ingredient_index WHERE rowid > ? ORDER BY rowid",
+                (self._rowid,)):
+            self._index(recipe_id, ingredient, size)
+            self._rowid = rowid
+
+    def _index(self, recipe_id, key, size):
+        self._sizes[recipe_id] = size
+        keys = self._keys.setdefault(recipe_id, set())
+        if key != NO_INGREDIENTS:
+            self._postings[key].add(recipe_id)
+            keys.add(key)
+
+    def _prune(self):
+        """Drops the oldest recipes over max_recipes from memory.
+
+        Returns:
+            The ids of the recipes dropped.
+        """
+        dropped = []
+        while len(self._keys) > self.max_recipes:
+            recipe_id, keys = self._keys.popitem(last=False)
+            del self._sizes[recipe_id]
+            for key in keys:
+                postings = self._postings[key]
+                postings.discard(recipe_id)
+                if not postings:
+                    del self._postings[key]
+            dropped.append(recipe_id)
+        return dropped
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, recipe_id):
+        return recipe_id in self._sizes
+
+    def add_recipes(self, recipes):
+        """Indexes recipes we haven't seen before.
+
+        Args:
+            recipes: list of Recipe objects.
+        """
+        rows = []
+        with self._lock:
+            # Skip recipes another process indexed since we last looked.
+            self._load_new_rows()
+            for recipe in recipes:
+                recipe_id = recipe.id
+                if recipe_id in self._sizes:
+                    continue
+                ingredients = recipe.ingredients
+                keys = set()
+                for ingredient in ingredients:
+                    keys |= ingredient_keys(ingredient.name or "")
+                for key in keys or [NO_INGREDIENTS]:
+                    self._index(recipe_id, key, len(ingredients))
+                    rows.append((recipe_id, key, len(ingredients)))
+            dropped = self._prune()
+
+            if rows:
+                with self._db:
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO ingredient_index "
+                        "(recipe_id, ingredient, size) VALUES (?, ?, ?)",
+                        rows
+                    )
+                    self._db.executemany(
+                        "DELETE FROM ingredient_index WHERE recipe_id = ?",
+                        [(recipe_id,) for recipe_id in dropped]
+                    )
+        if rows:
+            logger.info("Ingredient index now holds %d recipes.", len(self))
+
+    def search(self, ingredients, limit=config.RECIPE_LIMIT):
+        """Finds the indexed recipes that use the most of the ingredients.
+
+        Args:
+            ingredients: str, a comma separated list of ingredient strings.
+            limit: int, max results to return.
+        Returns:
+            A list of (recipe id, number of query ingredients used) tuples,
+            best first.
+        """
+        query = sp.canonicalize_ingredients(ingredients)
+        used = collections.Counter()
+        with self._lock:
+            self._load_new_rows()
+            self._prune()
+            for ingredient in filter(None, query.split(",")):
+                matches = self._postings.get(ingredient)
+                if not matches:
+                    matches = self._postings.get(ingredient.split()[-1], ())
+                used.update(matches)
+            ranked = sorted(
+                used.items(),
+                key=lambda item: (
+                    -item[1], self._sizes[item[0]] - item[1], item[0])
+            )
+        return ranked[:limit]
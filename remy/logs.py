@@ -0,0 +1,228 @@
+"""Module to set up remy's logging.
+
+Handlers never touch the disk themselves. Records go onto a bounded queue and
+a background listener thread formats and writes them, so a slow disk can't
+stall a handler thread. Messages are formatted in the listener as well, so
+callers should pass arguments lazily:
+
+    logger.info("Retrieved %d recipes.", len(recipes))
+
+If the queue is full the record is dropped and counted rather than blocking
+the caller.
+
+Busy INFO lines can be sampled per logger, e.g. with a rate of 0.1 only one
+in ten INFO (or DEBUG) records from that logger is kept. Warnings and errors
+are always kept.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+
+TEXT_FORMAT = "%(asctime)s %(levelname)-8s %(name)s %(message)s"
+TEXT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener = None
+_handler = None
+
+
+def parse_spec(spec):
+    """Parses a "name=value,name=value" string into a dictionary.
+
+    Args:
+        spec: str, e.g. "remy.cache=WARNING,telegram=ERROR". May be empty.
+    Returns:
+        A dictionary of logger names to (unconverted) string values.
+    Raises:
+        ValueError if an entry has no "=".
+    """
+    entries = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        name, separator, value = entry.partition("=")
+        if not separator:
+            raise ValueError(f"Expected name=value, got: {entry}")
+        entries[name.strip()] = value.strip()
+    return entries
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single line JSON object."""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(
+                    timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.processName,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        if record.stack_info:
+            data["stack_info"] = self.formatStack(record.stack_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a fraction of the INFO and DEBUG records from some loggers."""
+
+    def __init__(self, rates):
+        """Constructs a SamplingFilter object.
+
+        Args:
+            rates: dictionary of logger names to the fraction (0 to 1) of
+                their INFO and DEBUG records to keep. A name also covers its
+                child loggers.
+        """
+        super().__init__()
+        self.rates = {name: float(rate) for name, rate in rates.items()}
+        self._credit = {}
+        self._lock = threading.Lock()
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition(".")[0]
+        return None, 1.0
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        name, rate = self._rate(record.name)
+        if rate >= 1:
+            return True
+        # Keep every 1/rate-th record rather than rolling dice, so the
+        # sampled output is even and repeatable.
+        with self._lock:
+            credit = self._credit.get(name, 1 - rate) + rate
+            keep = credit >= 1
+            self._credit[name] = credit - 1 if keep else credit
+        return keep
+
+
+# Log arguments that are safe to format later, on the listener's thread.
+_PLAIN_TYPES = (str, bytes, int, float, type(None))
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Puts records on a bounded queue without blocking or formatting."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener's handler formats the record, so leave msg and args
+        # alone while they're plain values. Anything else (a list of ids, a
+        # Recipe) could change or be kept alive until the listener gets to
+        # it, so those records are formatted now. Likewise the exception is
+        # rendered now, so the queue doesn't keep its traceback and frames
+        # alive.
+        args = record.args
+        if isinstance(args, dict):
+            args = args.values()
+        if args and not all(isinstance(arg, _PLAIN_TYPES) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure(filename, level="INFO", fmt="json", levels="",
+              sample_rates="", queue_size=10000):
+    """Sends all logging through a queue to a background file writer.
+
+    Replaces any handlers already on the root logger and stops the listener
+    from a previous call.
+
+    Args:
+        filename: str, path of the log file.
+        level: str, level of the root logger.
+        fmt: str, either "json" or "text".
+        levels: str, per-logger levels, e.g. "remy.cache=WARNING".
+        sample_rates: str, per-logger INFO sampling rates, e.g.
+            "remy.spoonacular_helper=0.1".
+        queue_size: int, max records waiting to be written.
+    Returns:
+        The QueueHandler installed on the root logger.
+    Raises:
+        ValueError if fmt is unknown or a spec is malformed.
+    """
+    global _listener, _handler
+
+    if fmt == "json":
+        formatter = JsonFormatter()
+    elif fmt == "text":
+        formatter = logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT)
+    else:
+        raise ValueError(f"Unknown LOG_FORMAT: {fmt}")
+
+    shutdown()
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(formatter)
+
+    handler = QueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(SamplingFilter(parse_spec(sample_rates)))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+        existing.close()
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+    for name, logger_level in parse_spec(levels).items():
+        logging.getLogger(name).setLevel(logger_level.upper())
+
+    _listener = logging.handlers.QueueListener(
+        handler.queue, file_handler, respect_handler_level=True)
+    _listener.start()
+    _handler = handler
+    return handler
+
+
+def shutdown():
+    """Writes out queued records and stops the listener, if running."""
+    global _listener, _handler
+    if _listener is None:
+        return
+    logging.getLogger().removeHandler(_handler)
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _handler = None
+
+
+def queue_depth():
+    """Returns the number of records waiting to be written."""
+    return _handler.queue.qsize() if _handler else 0
+
+
+def dropped():
+    """Returns the number of records dropped because the queue was full."""
+    return _handler.dropped if _handler else 0
+
+
+atexit.register(shutdown)
@@ -0,0 +1,306 @@
+"""Module to send weekly meal plans to subscribed chats.
+
+Plans are generated per distinct set of plan parameters (diet, daily
+calories and excluded ingredients) rather than per subscriber. Every chat
+asking for the same thing gets the same plan, so a week costs one meal plan
+call per distinct set, plus a single bulk lookup of every recipe in every
+plan, however many chats subscribe.
+
+Subscriptions live in the SQLite database at CACHE_DB_PATH. Every process
+checks whether it's time to send, and the first to claim the week in the
+database sends it, so worker processes never send a week twice and a week
+that fails (e.g. out of quota) is tried again at the next check.
+"""
+
+import datetime
+import html
+import logging
+import re
+import threading
+import time
+
+import telegram
+
+from remy import cache
+from remy import config
+from remy import exceptions
+from remy import spoonacular_helper as sp
+
+
+logger = logging.getLogger(__name__)
+
+
+DAYS = (
+    "monday", "tuesday", "wednesday", "thursday", "friday", "saturday",
+    "sunday")
+
+
+def plan_key(diet=None, calories=None, exclude=None):
+    """Returns the normalized (diet, calories, exclude) a plan is keyed by.
+
+    Args:
+        diet: optional str, one of config.ALLOWED_DIETS.
+        calories: optional int, calories to aim for each day.
+        exclude: optional str, comma separated ingredients to leave out.
+    Returns:
+        A (str, int or None, str) tuple. Equivalent parameters, like
+        exclusions in another order, give the same key.
+    Raises:
+        ValueError if the diet isn't allowed or calories isn't positive.
+    """
+    diet = (diet or "").strip().lower()
+    if diet and diet not in config.ALLOWED_DIETS:
+        raise ValueError(f"Unknown diet: {diet}")
+    if calories is not None:
+        calories = int(calories)
+        if calories <= 0:
+            raise ValueError(f"Calories must be positive, got: {calories}")
+    return diet, calories, sp.canonicalize_ingredients(exclude or "")
+
+
+def parse_plan(text):
+    """Parses "diet=vegan calories=1800 exclude=olives,peanuts" into a key.
+
+    Every setting is optional.
+
+    Returns:
+        The plan_key for the settings.
+    Raises:
+        ValueError if the text isn't in that form or a value isn't allowed.
+    """
+    parts = re.split(r"\s*\b(diet|calories|exclude)=", text.strip())
+    if parts[0].strip():
+        raise ValueError(f"Unexpected meal plan setting: {parts[0]}")
+    settings = {
+        name: value.strip() or None
+        for name, value in zip(parts[1::2], parts[2::2])
+    }
+    return plan_key(**settings)
+
+
+def describe_plan(key):
+    """Returns a short description of a plan's settings, e.g. for replies."""
+    diet, calories, exclude = key
+    details = [diet or "any diet"]
+    if calories:
+        details.append(f"about {calories} calories a day")
+    if exclude:
+        details.append(f"no {exclude.replace(',', ', ')}")
+    return ", ".join(details)
+
+
+def format_meal_plan(key, plan, recipes):
+    """Formats a week's plan as an HTML message.
+
+    Args:
+        key: the plan_key the plan was generated for.
+        plan: dictionary of day names to lists of recipe ids.
+        recipes: dictionary of recipe ids to Recipe objects. Meals whose
+            recipe is missing are listed by id.
+    Returns:
+        The message string.
+    """
+    lines = [
+        "<b>Your meal plan for the week</b>",
+        f"<i>{html.escape(describe_plan(key))}</i>",
+    ]
+    for day in DAYS:
+        if day not in plan:
+            continue
+        lines.append(f"\n<b>{day.capitalize()}</b>")
+        for recipe_id in plan[day]:
+            recipe = recipes.get(recipe_id)
+            if recipe is None:
+                lines.append(f"Recipe {recipe_id}")
+                continue
+            title = html.escape(recipe.title or f"Recipe {recipe_id}")
+            if recipe.source_url:
+                url = html.escape(recipe.source_url, quote=True)
+                title = f'<a href="{url}">{title}</a>'
+            if recipe.ready_in_minutes:
+                title += f" ({recipe.ready_in_minutes} min)"
+            lines.append(title)
+    return "\n".join(lines)
+
+
+def this_week(now=None):
+    """Returns the ISO week we're in, e.g. "2024-W07", in UTC."""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    year, week, _ = now.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+class SubscriptionStore(object):
+    """Meal plan subscriptions and the weeks already sent, in SQLite."""
+
+    def __init__(self, path=config.CACHE_DB_PATH):
+        """Constructs a SubscriptionStore object.
+
+        Args:
+            path: str, path to the SQLite database file.
+        """
+        self._lock = threading.Lock()
+        self._db = cache.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meal_plan_subscriptions ("
+                "chat_id INTEGER PRIMARY KEY, diet TEXT, calories INTEGER, "
+                "exclude TEXT, subscribed_at REAL)")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS meal_plan_weeks ("
+                "week TEXT PRIMARY KEY, claimed_at REAL)")
+
+    def subscribe(self, chat_id, key):
+        """Subscribes a chat to the plan for key, replacing any other."""
+        diet, calories, exclude = key
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meal_plan_subscriptions "
+                "(chat_id, diet, calories, exclude, subscribed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (chat_id, diet, calories, exclude, time.time())
+            )
+
+    def unsubscribe(self, chat_id):
+        """Returns True if the chat was subscribed."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "DELETE FROM meal_plan_subscriptions WHERE chat_id = ?",
+                (chat_id,))
+        return cursor.rowcount > 0
+
+    def groups(self):
+        """Returns {plan_key: [chat ids]} for every subscription."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT diet, calories, exclude, chat_id "
+                "FROM meal_plan_subscriptions ORDER BY subscribed_at"
+            ).fetchall()
+        groups = {}
+        for diet, calories, exclude, chat_id in rows:
+            groups.setdefault((diet, calories, exclude), []).append(chat_id)
+        return groups
+
+    def claim_week(self, week):
+        """Returns True if week wasn't claimed yet and now is ours."""
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO meal_plan_weeks (week, claimed_at) "
+                "VALUES (?, ?)", (week, time.time()))
+        return cursor.rowcount > 0
+
+    def release_week(self, week):
+        """Gives up a claim so the week is tried again."""
+        with self._lock, self._db:
+            self._db.execute(
+                "DELETE FROM meal_plan_weeks WHERE week = ?", (week,))
+
+
+class MealPlanScheduler(object):
+
+    def __init__(self, spoon, sender, store,
+                 day=config.MEAL_PLAN_DAY, hour=config.MEAL_PLAN_HOUR,
+                 batch_size=config.MEAL_PLAN_BATCH_SIZE,
+                 batch_interval=config.MEAL_PLAN_BATCH_INTERVAL):
+        """Constructs a MealPlanScheduler object.
+
+        Args:
+            spoon: the SpoonacularFacade to generate plans with.
+            sender: the sender.MessageSender to deliver them with.
+            store: the SubscriptionStore.
+            day: int, day of the week to send on, 0 is Monday.
+            hour: int, UTC hour on that day from which to send.
+            batch_size: int, plans handed to the sender at a time.
+            batch_interval: float, seconds between batches.
+        """
+        self.spoon = spoon
+        self.sender = sender
+        self.store = store
+        self.day = day
+        self.hour = hour
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+
+    def build_messages(self):
+        """Generates this week's plans and formats them.
+
+        Returns:
+            A list of (message, chat ids) tuples, one per distinct plan.
+        Raises:
+            QuotaError or UpstreamError if a plan couldn't be generated.
+        """
+        groups = self.store.groups()
+        plans = {key: self.spoon.get_meal_plan(*key) for key in groups}
+        recipe_ids = list(dict.fromkeys(
+            recipe_id
+            for plan in plans.values()
+            for day in plan.values()
+            for recipe_id in day
+        ))
+        recipes = {}
+        if recipe_ids:
+            recipes = {
+                recipe.id: recipe
+                for recipe in self.spoon.get_recipes_for_ids(recipe_ids)
+            }
+        logger.info(
+            "Generated %d meal plans with %d recipes for %d chats.",
+            len(plans), len(recipes),
+            sum(len(chats) for chats in groups.values()))
+        return [
+            (format_meal_plan(key, plans[key], recipes), chats)
+            for key, chats in groups.items()
+        ]
+
+    def send_weekly(self, context):
+        """Sends this week's plans if it's time and nobody else has.
+
+        Has the signature of a telegram JobQueue callback so it can be
+        scheduled directly. Deliveries are handed to the sender in batches,
+        as further jobs.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if now.weekday() != self.day or now.hour < self.hour:
+            return
+        week = this_week(now)
+        if not self.store.claim_week(week):
+            return
+        try:
+            messages = self.build_messages()
+        except (exceptions.QuotaError, exceptions.UpstreamError):
+            logger.exception("Failed to build meal plans, trying later.")
+            self.store.release_week(week)
+            return
+        except Exception:
+            # E.g. an unexpected response body or a database error. Give the
+            # week back so it isn't lost, and let the job's error handler
+            # see what went wrong.
+            logger.exception("Unexpected error building meal plans.")
+            self.store.release_week(week)
+            raise
+
+        deliveries = [
+            (chat_id, message)
+            for message, chats in messages
+            for chat_id in chats
+        ]
+        for index, start in enumerate(
+                range(0, len(deliveries), self.batch_size)):
+            context.job_queue.run_once(
+                self.deliver,
+                index * self.batch_interval,
+                context=deliveries[start:start + self.batch_size]
+            )
+        logger.info("Sending meal plans for %s to %d chats.",
+                    week, len(deliveries))
+
+    def deliver(self, context):
+        """Queues one batch of (chat id, message) on the sender."""
+        for chat_id, message in context.job.context:
+            self.sender.send_message(
+                context.bot,
+                chat_id=chat_id,
+                text=message,
+                parse_mode=telegram.ParseMode.HTML,
+                disable_web_page_preview=True
+            )
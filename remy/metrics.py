@@ -0,0 +1,348 @@
+"""Module to hold remy's metrics and serve them to Prometheus.
+
+Histograms and counters are updated on the hot path, so they do as little as
+possible: a bucket lookup and a few additions under a lock. Gauges read their
+value from a function when the endpoint is scraped, so things like cache hit
+rates and queue depths cost nothing between scrapes.
+
+The endpoint speaks the Prometheus text format:
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+"""
+
+import bisect
+import functools
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from remy import config
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace(
+            "\n", "\\n")
+        for _, value in pairs
+    )
+    return "{" + ",".join(
+        f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric(object):
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. the number of errors."""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def _samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} "
+            f"{_format_value(value)}"
+            for labels, value in values
+        ]
+
+
+class Gauge(_Metric):
+    """A value read from a function each time the metrics are rendered."""
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def set_function(self, fn, *labels):
+        """Reports the value returned by fn for these label values.
+
+        Args:
+            fn: callable taking no arguments and returning a number.
+            *labels: one value for each of the gauge's label names.
+        """
+        with self._lock:
+            self._functions[labels] = fn
+
+    def _samples(self):
+        with self._lock:
+            functions = sorted(self._functions.items(), key=lambda i: i[0])
+        samples = []
+        for labels, fn in functions:
+            try:
+                value = fn()
+            except Exception:
+                logger.exception("Failed to read gauge %s.", self.name)
+                continue
+            samples.append(
+                f"{self.name}{_format_labels(self.labelnames, labels)} "
+                f"{_format_value(value)}")
+        return samples
+
+
+class Histogram(_Metric):
+    """Counts observations, e.g. latencies, into cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (the last is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [
+                    [0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def _samples(self):
+        with self._lock:
+            series = sorted(
+                (labels, list(counts), total)
+                for labels, (counts, total) in self._series.items())
+        samples = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                label_text = _format_labels(
+                    self.labelnames, labels, [("le", _format_value(bound))])
+                samples.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            samples.append(
+                f"{self.name}_sum{label_text} {_format_value(total)}")
+            samples.append(f"{self.name}_count{label_text} {cumulative}")
+        return samples
+
+
+class Registry(object):
+    """The set of metrics served on the endpoint."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self):
+        """Returns every metric in the Prometheus text format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    "remy_handler_seconds",
+    "Time spent running a command handler.",
+    ["handler"]
+)
+SPOONACULAR_SECONDS = REGISTRY.histogram(
+    "remy_spoonacular_seconds",
+    "Time spent in a SpoonacularFacade call to the API.",
+    ["method"]
+)
+SPOONACULAR_RETRIES = REGISTRY.counter(
+    "remy_spoonacular_retries_total",
+    "Spoonacular calls retried after a failure or timeout.",
+    ["method"]
+)
+SPOONACULAR_HEDGES = REGISTRY.counter(
+    "remy_spoonacular_hedges_total",
+    "Hedged second requests sent for slow Spoonacular calls.",
+    ["method"]
+)
+SPOONACULAR_FAILURES = REGISTRY.counter(
+    "remy_spoonacular_failures_total",
+    "Failed Spoonacular attempts, by reason (error or timeout).",
+    ["method", "reason"]
+)
+CIRCUIT_STATE = REGISTRY.gauge(
+    "remy_circuit_state",
+    "Circuit breaker state: 0 closed, 1 half open, 2 open.",
+    ["circuit"]
+)
+CIRCUIT_REJECTIONS = REGISTRY.counter(
+    "remy_circuit_rejections_total",
+    "Calls refused because their circuit breaker was open.",
+    ["circuit"]
+)
+TELEGRAM_SEND_SECONDS = REGISTRY.histogram(
+    "remy_telegram_send_seconds",
+    "Time spent sending one message to Telegram."
+)
+ERRORS = REGISTRY.counter(
+    "remy_errors_total",
+    "Errors handled by error_handler, by exception type.",
+    ["type"]
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "remy_cache_hit_ratio",
+    "Fraction of cache lookups that were hits.",
+    ["cache"]
+)
+QUOTA_POINTS = REGISTRY.gauge(
+    "remy_quota_points",
+    "Spoonacular points used today and the daily limit.",
+    ["kind"]
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "remy_queue_depth",
+    "Work waiting in one of the bot's queues.",
+    ["queue"]
+)
+UPDATES_DROPPED = REGISTRY.counter(
+    "remy_updates_dropped_total",
+    "Updates dropped instead of handled, by reason.",
+    ["reason"]
+)
+LOG_RECORDS_DROPPED = REGISTRY.gauge(
+    "remy_log_records_dropped",
+    "Log records dropped because the log queue was full."
+)
+
+
+def timed(histogram, label=None):
+    """Decorates a function to observe how long each call takes.
+
+    Args:
+        histogram: the Histogram to observe into, with one label.
+        label: str, the label value. Defaults to the function's name without
+            leading underscores.
+    """
+    def decorator(fn):
+        value = label or fn.__name__.lstrip("_")
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, value)
+        return wrapper
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        payload = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *unused_args):
+        pass
+
+
+class MetricsServer(object):
+
+    def __init__(self, registry=REGISTRY, host=config.METRICS_LISTEN,
+                 port=config.METRICS_PORT):
+        """Constructs a MetricsServer object. Call start to serve.
+
+        Args:
+            registry: the Registry to serve.
+            host: str, address to listen on.
+            port: int, port to listen on, 0 picks a free one.
+        """
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, name="remy-metrics", daemon=True)
+        self._thread.start()
+        logger.info("Serving metrics at %s", self.url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
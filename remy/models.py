@@ -0,0 +1,135 @@
+"""Module to hold the recipe types the bot works with.
+
+Spoonacular recipes carry nutrition, wine pairings, analyzed instructions and
+more, but the bot only ever looks at a handful of fields. Recipe keeps just
+those, and converts to and from the Spoonacular JSON shape without losing any
+of them.
+
+Recipes sit in in-memory caches by the thousand, so both types use __slots__
+and intern their short strings: every recipe with "salt" in it shares one
+"salt".
+"""
+
+import sys
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Ingredient(object):
+
+    __slots__ = ("name", "original_string")
+
+    def __init__(self, name, original_string):
+        """Constructs an Ingredient object.
+
+        Args:
+            name: str, the bare ingredient name, e.g. "egg".
+            original_string: str, the ingredient line as written in the
+                recipe, e.g. "2 large eggs, beaten".
+        """
+        self.name = _intern(name)
+        self.original_string = _intern(original_string)
+
+    def __eq__(self, other):
+        return (isinstance(other, Ingredient)
+                and self.name == other.name
+                and self.original_string == other.original_string)
+
+    def __repr__(self):
+        return f"Ingredient({self.name!r}, {self.original_string!r})"
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get("name"), data.get("originalString"))
+
+    def to_json(self):
+        return {"name": self.name, "originalString": self.original_string}
+
+
+class Recipe(object):
+
+    __slots__ = (
+        "id",
+        "title",
+        "source_url",
+        "ready_in_minutes",
+        "instructions",
+        "ingredients",
+    )
+
+    def __init__(self, id, title=None, source_url=None, ready_in_minutes=None,
+                 instructions=None, ingredients=()):
+        """Constructs a Recipe object.
+
+        Args:
+            id: int, the Spoonacular recipe id.
+            title: str, may contain HTML.
+            source_url: str, link to the original recipe.
+            ready_in_minutes: int, total cook time.
+            instructions: str or None, may contain HTML.
+            ingredients: list of Ingredient objects.
+        """
+        self.id = id
+        self.title = _intern(title)
+        self.source_url = _intern(source_url)
+        self.ready_in_minutes = ready_in_minutes
+        self.instructions = instructions
+        self.ingredients = tuple(ingredients)
+
+    def __eq__(self, other):
+        return isinstance(other, Recipe) and self.to_json() == other.to_json()
+
+    def __repr__(self):
+        return f"Recipe({self.id!r}, {self.title!r})"
+
+    @classmethod
+    def from_json(cls, data):
+        """Builds a Recipe from a Spoonacular recipe dictionary.
+
+        Args:
+            data: dict of recipe data from the Spoonacular API.
+        Returns:
+            A Recipe object.
+        """
+        return cls(
+            data.get("id"),
+            title=data.get("title"),
+            source_url=data.get("sourceUrl"),
+            ready_in_minutes=data.get("readyInMinutes"),
+            instructions=data.get("instructions"),
+            ingredients=tuple(
+                Ingredient.from_json(ingredient)
+                for ingredient in data.get("extendedIngredients") or ()
+            )
+        )
+
+    def to_json(self):
+        """Returns the recipe as a Spoonacular shaped dictionary.
+
+        Only the fields Recipe keeps are included, so from_json(to_json())
+        gives back an equal Recipe.
+        """
+        return {
+            "id": self.id,
+            "title": self.title,
+            "sourceUrl": self.source_url,
+            "readyInMinutes": self.ready_in_minutes,
+            "instructions": self.instructions,
+            "extendedIngredients": [
+                ingredient.to_json() for ingredient in self.ingredients],
+        }
+
+
+def as_recipe(recipe):
+    """Returns recipe as a Recipe, converting it if it's a dictionary.
+
+    Args:
+        recipe: a Recipe, or a dict of recipe data from the Spoonacular API.
+    Returns:
+        A Recipe object.
+    """
+    if isinstance(recipe, Recipe):
+        return recipe
+    return Recipe.from_json(recipe)
@@ -0,0 +1,264 @@
+"""Module to hold pools of pre-fetched, pre-formatted random recipes.
+
+/random and /happyhour don't care which recipe they get, so instead of calling
+Spoonacular while the user waits we fetch recipes in large batches ahead of
+time and answer straight from memory.
+"""
+
+import collections
+import logging
+import threading
+
+from remy import config
+from remy import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_tags(tags):
+    """Normalizes a comma separated tag string so equivalent sets match.
+
+    Args:
+        tags: str or None, a comma separated list of tags.
+    Returns:
+        The lowercased, deduplicated and sorted tags joined by commas.
+    """
+    if not tags:
+        return ""
+    return ",".join(sorted(
+        {tag.strip().lower() for tag in tags.split(",") if tag.strip()}))
+
+
+class RecipePool(object):
+    """A bounded pool of pre-formatted recipes for one kind of request."""
+
+    def __init__(self, name, fetch, size, low_water, batch):
+        """Constructs a RecipePool object.
+
+        Args:
+            name: str, used in log lines.
+            fetch: callable taking a count and returning up to that many
+                pool items.
+            size: int, max items held.
+            low_water: int, refill once we hold fewer items than this.
+            batch: int, max items fetched per upstream call.
+        """
+        self.name = name
+        self.fetch = fetch
+        self.size = size
+        self.low_water = low_water
+        self.batch = batch
+        self.items = collections.deque()
+        self._refill_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.items)
+
+    def pop(self):
+        """Returns the next item, or None if the pool is empty."""
+        try:
+            return self.items.popleft()
+        except IndexError:
+            return None
+
+    def needs_refill(self):
+        return len(self.items) < self.low_water
+
+    def refill(self):
+        """Tops the pool up to its size, one batch at a time.
+
+        Returns:
+            The number of items added.
+        """
+        if not self._refill_lock.acquire(blocking=False):
+            # Someone else is already refilling this pool.
+            return 0
+        try:
+            added = 0
+            while len(self.items) < self.size:
+                count = min(self.batch, self.size - len(self.items))
+                items = self.fetch(count)
+                if not items:
+                    break
+                items = items[:self.size - len(self.items)]
+                self.items.extend(items)
+                added += len(items)
+            logger.info("Pool '%s' refilled with %d items.", self.name, added)
+            return added
+        finally:
+            self._refill_lock.release()
+
+
+class PoolManager(object):
+    """Keeps a RecipePool per tag set for /random and one for /happyhour."""
+
+    def __init__(self, spoon, render,
+                 prewarm_tags=config.RANDOM_POOL_PREWARM_TAGS,
+                 max_tag_sets=config.RANDOM_POOL_MAX_TAG_SETS,
+                 random_size=config.RANDOM_POOL_SIZE,
+                 random_low_water=config.RANDOM_POOL_LOW_WATER,
+                 random_batch=config.RANDOM_POOL_BATCH,
+                 cocktail_size=config.COCKTAIL_POOL_SIZE,
+                 cocktail_low_water=config.COCKTAIL_POOL_LOW_WATER,
+                 cocktail_batch=config.COCKTAIL_POOL_BATCH,
+                 max_quota_ratio=config.POOL_REFILL_MAX_QUOTA_RATIO):
+        """Constructs a PoolManager object.
+
+        Args:
+            spoon: the SpoonacularFacade used to fetch recipes.
+            render: callable turning a recipe into a (message, parse_mode)
+                tuple.
+            prewarm_tags: list of tag strings whose pools are filled before
+                anyone asks for them. Their pools are never evicted.
+            max_tag_sets: int, max number of other tag set pools we keep
+                around, least recently used first out.
+            random_size, random_low_water, random_batch: int, the size,
+                low-water mark and batch of each random recipe pool.
+            cocktail_size, cocktail_low_water, cocktail_batch: int, the
+                same for the cocktail pool.
+            max_quota_ratio: float, refills stop once this share of the
+                daily quota is used.
+        """
+        self.spoon = spoon
+        self.render = render
+        self.max_tag_sets = max_tag_sets
+        self.random_size = random_size
+        self.random_low_water = random_low_water
+        self.random_batch = random_batch
+        self.max_quota_ratio = max_quota_ratio
+        self.random_pools = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.pinned_tags = {normalize_tags(tags) for tags in prewarm_tags}
+        for tags in prewarm_tags:
+            self._random_pool(normalize_tags(tags))
+        self.cocktail_pool = RecipePool(
+            "cocktails",
+            self._fetch_cocktails,
+            cocktail_size,
+            cocktail_low_water,
+            cocktail_batch
+        )
+
+    def _prepare(self, recipes):
+        items = []
+        for recipe in recipes:
+            message, parse_mode = self.render(recipe)
+            items.append((recipe.id, message, parse_mode))
+        return items
+
+    def _random_pool(self, tags):
+        with self._lock:
+            pool = self.random_pools.get(tags)
+            if pool is None:
+                pool = self.random_pools[tags] = RecipePool(
+                    f"random:{tags}",
+                    lambda count: self._prepare(
+                        self.spoon.get_random_recipes(tags=tags or None,
+                                                      number=count)),
+                    self.random_size,
+                    self.random_low_water,
+                    self.random_batch
+                )
+                self._evict()
+            self.random_pools.move_to_end(tags)
+            return pool
+
+    def _evict(self):
+        """Drops the least recently used unpinned pools over max_tag_sets."""
+        unpinned = [tags for tags in self.random_pools
+                    if tags not in self.pinned_tags]
+        for tags in unpinned[:max(0, len(unpinned) - self.max_tag_sets)]:
+            del self.random_pools[tags]
+
+    def _fetch_cocktails(self, count):
+        ids = self.spoon.get_random_alcoholic_beverage_recipe_ids(count)
+        return self._prepare(self.spoon.get_recipes_for_ids(ids))
+
+    def pop_random(self, tags=None):
+        """Returns a pre-formatted random recipe for the tags, if we have one.
+
+        Args:
+            tags: str or None, a comma separated list of tags.
+        Returns:
+            A (recipe id, message, parse mode) tuple, or None if the pool for
+            these tags is empty.
+        """
+        return self._random_pool(normalize_tags(tags)).pop()
+
+    def pop_cocktail(self):
+        """Returns a pre-formatted random cocktail, or None if we're out."""
+        return self.cocktail_pool.pop()
+
+    def pools(self):
+        with self._lock:
+            return list(self.random_pools.values()) + [self.cocktail_pool]
+
+    def needs_refill(self):
+        return any(pool.needs_refill() for pool in self.pools())
+
+    def snapshot(self):
+        """Returns the pooled items in a JSON serializable dictionary."""
+        with self._lock:
+            random_pools = list(self.random_pools.items())
+        return {
+            "random": {tags: list(pool.items) for tags, pool in random_pools},
+            "cocktails": list(self.cocktail_pool.items),
+        }
+
+    def restore(self, data):
+        """Refills the pools from a snapshot, up to their sizes.
+
+        Args:
+            data: dictionary returned by snapshot.
+        Returns:
+            The number of items restored.
+        """
+        restored = 0
+        pools = [
+            (self._random_pool(tags), items)
+            for tags, items in data.get("random", {}).items()
+        ]
+        pools.append((self.cocktail_pool, data.get("cocktails", [])))
+        for pool, items in pools:
+            items = [tuple(item) for item in items]
+            items = items[:pool.size - len(pool.items)]
+            pool.items.extend(items)
+            restored += len(items)
+        return restored
+
+    def quota_allows_refill(self):
+        """Refills only spend points while we have plenty left for users.
+
+        That is, until max_quota_ratio of the day's points is used, or
+        earlier if we're on pace to run out before midnight.
+        """
+        quota = self.spoon.quota
+        return (quota is None or (
+            quota.usage_ratio() < self.max_quota_ratio and quota.on_pace()))
+
+    def refill(self, context=None):
+        """Refills every pool that has dropped below its low-water mark.
+
+        Has the signature of a telegram JobQueue callback so it can be
+        scheduled directly.
+
+        Args:
+            context: unused telegram CallbackContext.
+        """
+        for pool in self.pools():
+            if not pool.needs_refill():
+                continue
+            if not self.quota_allows_refill():
+                logger.info("Skipping pool refills to save quota.")
+                return
+            try:
+                pool.refill()
+            except exceptions.QuotaError:
+                logger.info("Ran out of quota while refilling pools.")
+                return
+            except exceptions.UpstreamError:
+                logger.info("Spoonacular is unavailable, refilling later.")
+                return
+            except Exception:
+                logger.exception("Failed to refill pool '%s'.", pool.name)
@@ -0,0 +1,198 @@
+"""Module to keep track of how many Spoonacular points we've spent today."""
+
+import datetime
+import logging
+import threading
+import time
+
+from remy import cache
+from remy import config
+
+
+logger = logging.getLogger(__name__)
+
+
+# Spoonacular reports the cost of each request and the running daily totals
+# in these headers: https://spoonacular.com/food-api/docs#Quotas
+REQUEST_HEADER = "X-API-Quota-Request"
+USED_HEADER = "X-API-Quota-Used"
+LEFT_HEADER = "X-API-Quota-Left"
+
+
+def now():
+    """Returns the current time in UTC."""
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def today():
+    """Returns the current quota day. Spoonacular resets at midnight UTC."""
+    return now().date().isoformat()
+
+
+def day_elapsed(at=None):
+    """Returns the fraction of the quota day gone by at a time, 0 to 1."""
+    at = at or now()
+    midnight = at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return (at - midnight).total_seconds() / (60 * 60 * 24)
+
+
+def default_policy(accountant):
+    """Rations upstream calls so the daily points last until midnight.
+
+    While the projected usage for the day stays within the limit, calls are
+    allowed until we've used the degrade ratio of the points. Once we're on
+    pace to run out early, calls are only allowed while we haven't spent
+    more than an even share of the day so far plus the pace burst, so the
+    rest of the day still gets some.
+
+    Args:
+        accountant: the QuotaAccountant asking for a decision.
+    Returns:
+        True if we should call Spoonacular, False if we should serve from
+        local caches or refuse instead.
+    """
+    ratio = accountant.usage_ratio()
+    if ratio >= accountant.degrade_ratio:
+        return False
+    if accountant.on_pace():
+        return True
+    return ratio < day_elapsed() + accountant.pace_burst
+
+
+class QuotaAccountant(object):
+    """Tracks our daily point usage from the Spoonacular quota headers.
+
+    The totals are stored in SQLite so a restart late in the day still knows
+    how close we are to the limit, and so worker processes sharing the
+    database see each other's spending.
+    """
+
+    def __init__(self, path=config.CACHE_DB_PATH,
+                 daily_limit=config.QUOTA_DAILY_LIMIT,
+                 degrade_ratio=config.QUOTA_DEGRADE_RATIO,
+                 pace_burst=config.QUOTA_PACE_BURST,
+                 policy=default_policy):
+        """Constructs a QuotaAccountant object.
+
+        Args:
+            path: str, path to the SQLite database file.
+            daily_limit: float, points we can spend per day. This is replaced
+                by used + left as soon as we see the quota headers.
+            degrade_ratio: float, share of the daily points after which the
+                default policy stops calling Spoonacular.
+            pace_burst: float, share of the daily points the default policy
+                lets us spend ahead of an even pace once we're on course to
+                run out before midnight.
+            policy: callable taking this accountant and returning whether
+                we should make an upstream call.
+        """
+        self.policy = policy
+        self.degrade_ratio = degrade_ratio
+        self.pace_burst = pace_burst
+        self.default_limit = daily_limit
+        self._lock = threading.Lock()
+        self._db = cache.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS quota ("
+                "day TEXT PRIMARY KEY, used REAL, daily_limit REAL, "
+                "updated_at REAL)")
+
+        self.day = today()
+        row = self._db.execute(
+            "SELECT used, daily_limit FROM quota WHERE day = ?", (self.day,)
+        ).fetchone()
+        self.used, self.limit = row if row else (0.0, float(daily_limit))
+        logger.info(
+            "Quota loaded: %s/%s points used.", self.used, self.limit)
+
+    def _roll_over(self):
+        """Resets the totals if the quota day has changed."""
+        current = today()
+        if current != self.day:
+            logger.info("New quota day, resetting points.")
+            self.day = current
+            self.used, self.limit = 0.0, float(self.default_limit)
+
+    def _sync(self):
+        """Catches up with points spent by other processes."""
+        row = self._db.execute(
+            "SELECT used, daily_limit FROM quota WHERE day = ?", (self.day,)
+        ).fetchone()
+        if row:
+            self.used = max(self.used, row[0])
+            self.limit = row[1]
+
+    def _save(self):
+        # Usage only grows during a day, so never overwrite a higher total
+        # saved by another process with our older one.
+        with self._db:
+            self._db.execute(
+                "INSERT INTO quota (day, used, daily_limit, updated_at) "
+                "VALUES (?, ?, ?, ?) ON CONFLICT (day) DO UPDATE SET "
+                "used = MAX(used, excluded.used), "
+                "daily_limit = excluded.daily_limit, "
+                "updated_at = excluded.updated_at",
+                (self.day, self.used, self.limit, time.time())
+            )
+
+    def record(self, response):
+        """Updates our totals from a Spoonacular response's headers.
+
+        Args:
+            response: A Spoonacular response object.
+        """
+        headers = getattr(response, "headers", None) or {}
+        used = headers.get(USED_HEADER)
+        left = headers.get(LEFT_HEADER)
+        if used is None:
+            return
+
+        with self._lock:
+            self._roll_over()
+            self.used = float(used)
+            if left is not None:
+                self.limit = self.used + float(left)
+            self._save()
+        logger.info("Request cost %s points, %s/%s used today.",
+                    headers.get(REQUEST_HEADER), self.used, self.limit)
+
+    def record_exhausted(self):
+        """Marks the whole quota as spent, e.g. after a 402 response."""
+        with self._lock:
+            self._roll_over()
+            self.used = self.limit
+            self._save()
+
+    def usage_ratio(self):
+        """Returns the fraction of today's points already spent."""
+        with self._lock:
+            self._roll_over()
+            self._sync()
+            return self.used / self.limit if self.limit else 1.0
+
+    def projected_usage(self, at=None):
+        """Projects today's total usage from the pace so far.
+
+        Args:
+            at: optional timezone aware datetime, defaults to the current
+                time in UTC.
+        Returns:
+            The number of points we'll have used by midnight UTC at the
+            current rate.
+        """
+        elapsed = day_elapsed(at)
+        with self._lock:
+            self._roll_over()
+            self._sync()
+            return self.used / max(elapsed, 1 / (60 * 60 * 24))
+
+    def on_pace(self, at=None):
+        """Whether the projected usage for today stays within the limit."""
+        projected = self.projected_usage(at)
+        with self._lock:
+            return projected <= self.limit
+
+    def allow_request(self):
+        """Asks the policy whether we should make an upstream call."""
+        return self.policy(self)
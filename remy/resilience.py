@@ -0,0 +1,247 @@
+"""Module to keep a slow or failing Spoonacular from stalling the bot.
+
+Every call the facade makes to the API can go through a Resilience object,
+which:
+
+ - stops waiting on an attempt once the method's timeout has passed,
+ - retries failed and timed out attempts a few times, after a random wait
+   that doubles each time (so retries from many threads don't line up),
+ - optionally sends a second, hedged copy of a slow attempt and takes
+   whichever answers first, and
+ - stops calling the API altogether for a while once too many calls in a row
+   have failed (the circuit breaker), so handlers fail fast and the facade
+   answers from its caches instead of every thread queueing up behind a dead
+   upstream.
+
+Only UpstreamErrors (the API failing, timing out or being unreachable) are
+retried and count against the circuit. Anything else, like a QuotaError,
+means Spoonacular answered and is raised straight away.
+
+Attempts run on a small thread pool so the caller can stop waiting on one.
+An abandoned attempt finishes in the background, bounded by the HTTP
+client's own timeout. Slow attempts aren't hedged once a call has failed
+recently, so a dead upstream can't fill the pool with abandoned attempts
+before the circuit opens.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import random
+import threading
+import time
+
+from remy import config
+from remy import exceptions
+from remy import logs
+from remy import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Circuit states, as reported by the remy_circuit_state gauge.
+CLOSED = 0
+HALF_OPEN = 1
+OPEN = 2
+
+
+def parse_durations(spec):
+    """Parses a "method=seconds,..." string into a dictionary of floats."""
+    return {
+        name: float(value) for name, value in logs.parse_spec(spec).items()
+    }
+
+
+class CircuitBreaker(object):
+
+    def __init__(self, name,
+                 failure_threshold=config.CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout=config.CIRCUIT_RESET_TIMEOUT,
+                 clock=time.monotonic):
+        """Constructs a CircuitBreaker object.
+
+        The circuit opens after failure_threshold failures in a row. Once
+        reset_timeout has passed it is half open and lets a single probe
+        call through: if that succeeds the circuit closes, otherwise it opens
+        again.
+
+        Args:
+            name: str, what the circuit protects, used in logs and metrics.
+            failure_threshold: int, consecutive failures that open it.
+            reset_timeout: float, seconds to stay open.
+            clock: callable returning the current time in seconds.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        """One of CLOSED, HALF_OPEN or OPEN."""
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return CLOSED
+        if self.clock() - self._opened_at >= self.reset_timeout:
+            return HALF_OPEN
+        return OPEN
+
+    @property
+    def failing(self):
+        """Whether the last call failed, or the circuit isn't closed."""
+        with self._lock:
+            return self._failures > 0 or self._opened_at is not None
+
+    def allow(self):
+        """Whether a call may go ahead right now.
+
+        Every allowed call must be followed by record_success or
+        record_failure.
+        """
+        with self._lock:
+            state = self._state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("Circuit %s closed.", self.name)
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        "Circuit %s opened after %d failures.",
+                        self.name, self._failures)
+                self._opened_at = self.clock()
+            self._probing = False
+
+
+class Resilience(object):
+
+    def __init__(self, timeouts=None,
+                 default_timeout=config.SPOONACULAR_TIMEOUT,
+                 retries=config.SPOONACULAR_RETRIES,
+                 backoff=config.SPOONACULAR_RETRY_BACKOFF, hedge_after=None,
+                 breaker=None, workers=config.SPOONACULAR_CALL_WORKERS,
+                 seed=None):
+        """Constructs a Resilience object.
+
+        Args:
+            timeouts: optional dictionary of method names to seconds.
+            default_timeout: float, seconds for methods not in timeouts.
+            retries: int, extra attempts after a failed one.
+            backoff: float, max seconds to wait before the first retry. The
+                max doubles for each retry after that.
+            hedge_after: optional dictionary of method names to seconds after
+                which a second attempt is sent. Other methods aren't hedged.
+            breaker: optional CircuitBreaker, defaults to one named
+                "spoonacular".
+            workers: int, threads to make attempts on.
+            seed: optional seed for the backoff jitter.
+        """
+        self.timeouts = timeouts or {}
+        self.default_timeout = default_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after or {}
+        self.breaker = breaker or CircuitBreaker("spoonacular")
+        self._random = random.Random(seed)
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="remy-upstream")
+
+    def call(self, method, fn, *args, **kwargs):
+        """Calls fn under method's timeout, retry and hedging policy.
+
+        Args:
+            method: str, the name the policy and metrics are keyed by.
+            fn: callable making the request. It should raise UpstreamError
+                when the API fails.
+            *args, **kwargs: passed to fn.
+        Returns:
+            Whatever fn returned.
+        Raises:
+            CircuitOpenError if the circuit is open, UpstreamError if the
+            last attempt failed, or whatever else fn raised.
+        """
+        timeout = self.timeouts.get(method, self.default_timeout)
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                metrics.CIRCUIT_REJECTIONS.inc(self.breaker.name)
+                raise exceptions.CircuitOpenError(
+                    f"Not calling {method}, circuit {self.breaker.name} "
+                    f"is open.")
+            if attempt:
+                metrics.SPOONACULAR_RETRIES.inc(method)
+            try:
+                result = self._attempt(method, timeout, fn, args, kwargs)
+            except exceptions.UpstreamError as e:
+                self.breaker.record_failure()
+                reason = (
+                    "timeout"
+                    if isinstance(e, exceptions.UpstreamTimeoutError)
+                    else "error")
+                metrics.SPOONACULAR_FAILURES.inc(method, reason)
+                logger.info(
+                    "Attempt %d at %s failed: %s", attempt + 1, method, e)
+                if attempt == self.retries:
+                    raise
+                time.sleep(self._random.uniform(
+                    0, self.backoff * 2 ** attempt))
+            except Exception:
+                # Spoonacular answered, just not with what we wanted.
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def _attempt(self, method, timeout, fn, args, kwargs):
+        """Makes one attempt, plus a hedged copy if it's slow."""
+        deadline = time.monotonic() + timeout
+        pending = {self._pool.submit(fn, *args, **kwargs)}
+        hedge_after = self.hedge_after.get(method)
+        # A hedge is only worth it against a slow attempt, not a failing API.
+        if (hedge_after is not None and hedge_after < timeout
+                and not self.breaker.failing):
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done:
+                metrics.SPOONACULAR_HEDGES.inc(method)
+                pending.add(self._pool.submit(fn, *args, **kwargs))
+
+        error = None
+        while pending:
+            done, pending = wait(
+                pending,
+                timeout=max(deadline - time.monotonic(), 0),
+                return_when=FIRST_COMPLETED
+            )
+            if not done:
+                raise exceptions.UpstreamTimeoutError(
+                    f"{method} took longer than {timeout}s.")
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def shutdown(self):
+        """Stops the attempt threads without waiting on abandoned calls."""
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -2,23 +2,133 @@ import logging
 
 import telegram
 
-from remy import telegram_helper
+from remy import app
+from remy import config
+from remy import metrics
+from remy import supervisor
 
 
-def main():
-    """Runs our bot."""
-    updater = telegram_helper.UPDATER
+logger = logging.getLogger(__name__)
 
-    logging.info("Starting the bot!")
+
+def start_polling(updater):
+    """Starts fetching updates by long polling Telegram."""
+    logger.info("Starting in polling mode.")
+    updater.start_polling()
+
+
+def start_webhook(updater, webhook_url, secret, listen, port,
+                  max_connections):
+    """Starts a local HTTP server and registers it as our webhook.
+
+    Args:
+        updater: the telegram Updater to start.
+        webhook_url: str, public base URL Telegram should post updates to.
+            The secret path is appended.
+        secret: str, path the server accepts updates on.
+        listen: str, address for the local server to listen on.
+        port: int, port for the local server to listen on.
+        max_connections: int, max simultaneous connections from Telegram.
+    """
+    webhook_url = f"{webhook_url.rstrip('/')}/{secret}"
+    logger.info("Starting in webhook mode on %s:%s.", listen, port)
+    updater.start_webhook(
+        listen=listen,
+        port=port,
+        url_path=secret,
+        webhook_url=webhook_url
+    )
+    # start_webhook registers the webhook without max_connections, so set it
+    # again with the limit we want.
+    updater.bot.set_webhook(
+        url=webhook_url,
+        max_connections=max_connections
+    )
+
+
+def check_mode(settings):
+    """Checks that we have what BOT_MODE needs to start.
+
+    Args:
+        settings: the config.Settings to run with.
+    Raises:
+        ValueError if the mode is unknown, or webhook mode has no WEBHOOK_URL
+        to give Telegram.
+    """
+    if settings.BOT_MODE not in ("polling", "webhook"):
+        raise ValueError(f"Unknown BOT_MODE: {settings.BOT_MODE}")
+    if settings.BOT_MODE == "webhook" and not settings.WEBHOOK_URL:
+        raise ValueError(
+            "BOT_MODE is webhook but WEBHOOK_URL isn't set. Set it to the "
+            "public https:// URL Telegram should post updates to.")
+
+
+def start(updater, settings=None):
+    """Starts receiving updates in the configured mode.
+
+    Args:
+        updater: the telegram Updater to start.
+        settings: the config.Settings to run with, defaults to the
+            environment's.
+    Raises:
+        ValueError if the settings can't start BOT_MODE, see check_mode.
+    """
+    settings = settings or config.Settings()
+    check_mode(settings)
+    if settings.BOT_MODE == "polling":
+        start_polling(updater)
+    else:
+        # Default to the bot token so the path can't be guessed.
+        start_webhook(
+            updater,
+            webhook_url=settings.WEBHOOK_URL,
+            secret=settings.WEBHOOK_SECRET or settings.TELEGRAM_TOKEN,
+            listen=settings.WEBHOOK_LISTEN,
+            port=settings.WEBHOOK_PORT,
+            max_connections=settings.WEBHOOK_MAX_CONNECTIONS
+        )
+
+
+def main(settings=None):
+    """Runs our bot.
+
+    Args:
+        settings: the config.Settings to run with, defaults to the
+            environment's.
+    """
+    settings = settings or config.Settings()
+    check_mode(settings)
+    app.configure_logging(settings)
+    if settings.WORKERS > 1:
+        application = supervisor.Supervisor(settings).start()
+    else:
+        application = app.create_app(settings)
+        application.load_snapshot()
+        application.register_gauges()
+    updater = application.updater
+
+    logger.info("Starting the bot!")
+
+    metrics_server = None
+    if settings.METRICS_ENABLED:
+        metrics_server = metrics.MetricsServer(
+            host=settings.METRICS_LISTEN, port=settings.METRICS_PORT).start()
 
     try:
-        updater.start_polling()
+        start(updater, settings)
         updater.idle()
     except telegram.error.TelegramError as e:
-        logging.error(f"Something went wrong! {e}")
+        logger.error("Something went wrong! %s", e)
         raise e
 
-    logging.info("Bot shutting down. See ya next time!")
+    if settings.WORKERS > 1:
+        application.stop()
+    else:
+        application.shutdown()
+        application.save_snapshot()
+    if metrics_server is not None:
+        metrics_server.stop()
+    logger.info("Bot shutting down. See ya next time!")
 
 if __name__ == "__main__":
     main()
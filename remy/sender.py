@@ -0,0 +1,239 @@
+"""Module to send outgoing Telegram messages at the platform's rate limits.
+
+Telegram allows roughly 30 messages a second overall, about one a second per
+chat and 20 a minute per group. Going over earns a RetryAfter error. Handlers
+hand their messages to a MessageSender, which returns immediately and sends
+them from background threads, throttled by token buckets and paused whenever
+Telegram asks us to retry later. Messages to the same chat keep their order.
+The flood limit is per bot, so a RetryAfter for one chat pauses every chat.
+"""
+
+import collections
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import telegram
+
+from remy import config
+from remy import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """Allows rate events a second on average, with bursts up to capacity."""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now):
+        """Returns the time at which a token will be available."""
+        self._refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class _Message(object):
+
+    def __init__(self, bot, kwargs):
+        self.bot = bot
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+class MessageSender(object):
+
+    def __init__(self, global_rate=config.TELEGRAM_GLOBAL_RATE,
+                 chat_rate=config.TELEGRAM_CHAT_RATE,
+                 group_rate=config.TELEGRAM_GROUP_RATE,
+                 chat_burst=config.TELEGRAM_CHAT_BURST,
+                 workers=config.TELEGRAM_SENDER_WORKERS,
+                 max_retries=config.TELEGRAM_SEND_RETRIES,
+                 max_chats=config.TELEGRAM_SENDER_MAX_CHATS):
+        """Constructs a MessageSender object and starts its workers.
+
+        Args:
+            global_rate: float, messages per second across all chats.
+            chat_rate: float, messages per second to a single private chat.
+            group_rate: float, messages per second to a single group chat.
+            chat_burst: int, messages a chat can receive back to back before
+                its rate kicks in.
+            workers: int, threads sending messages.
+            max_retries: int, retries for network errors and RetryAfter
+                answers before giving up on a message.
+            max_chats: int, chats whose rate limits we remember.
+        """
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._cond = threading.Condition()
+        self._global = TokenBucket(global_rate, global_rate, time.monotonic())
+        # chat id -> deque of pending messages, in round robin order.
+        self._chats = collections.OrderedDict()
+        self._buckets = collections.OrderedDict()
+        self._not_before = {}
+        # Nothing goes out before this monotonic time, see RetryAfter.
+        self._paused_until = 0
+        self._busy = set()
+        self._stopping = False
+        self._workers = [
+            threading.Thread(
+                target=self._work, name=f"remy-sender-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def send_message(self, bot, chat_id, **kwargs):
+        """Queues a message without waiting for it to be sent.
+
+        Args:
+            bot: the telegram.Bot to send with.
+            chat_id: the chat to send to.
+            **kwargs: passed to bot.send_message.
+        Returns:
+            A concurrent.futures.Future resolving to the sent telegram.Message.
+        """
+        message = _Message(bot, dict(kwargs, chat_id=chat_id))
+        with self._cond:
+            self._chats.setdefault(chat_id, collections.deque()).append(
+                message)
+            self._cond.notify()
+        return message.future
+
+    def queue_depth(self):
+        """Returns the number of messages waiting to be sent."""
+        with self._cond:
+            return sum(len(queue) for queue in self._chats.values())
+
+    def _bucket(self, chat_id, now):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(
+                rate, self.chat_burst, now)
+            # Chats we haven't heard from in a while get a fresh bucket.
+            while len(self._buckets) > self.max_chats:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(chat_id)
+        return bucket
+
+    def _next_message(self):
+        """Waits for a message that's allowed to go out now and claims it."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for chat_id, queue in self._chats.items():
+                    if chat_id in self._busy:
+                        continue
+                    bucket = self._bucket(chat_id, now)
+                    ready_at = max(
+                        self._paused_until,
+                        self._not_before.get(chat_id, now),
+                        bucket.ready_at(now),
+                        self._global.ready_at(now)
+                    )
+                    if ready_at <= now:
+                        bucket.take(now)
+                        self._global.take(now)
+                        self._busy.add(chat_id)
+                        self._not_before.pop(chat_id, None)
+                        message = queue.popleft()
+                        # Move the chat to the back so chats take turns.
+                        del self._chats[chat_id]
+                        if queue:
+                            self._chats[chat_id] = queue
+                        return chat_id, message
+                    wait = ready_at - now if wait is None else min(
+                        wait, ready_at - now)
+
+                if self._stopping and not self._chats:
+                    return None, None
+                self._cond.wait(wait)
+
+    def _work(self):
+        while True:
+            chat_id, message = self._next_message()
+            if message is None:
+                return
+            retry_at = self._send(chat_id, message)
+            with self._cond:
+                self._busy.discard(chat_id)
+                if retry_at is not None:
+                    self._not_before[chat_id] = retry_at
+                    queue = self._chats.setdefault(
+                        chat_id, collections.deque())
+                    queue.appendleft(message)
+                self._cond.notify_all()
+
+    def _send(self, chat_id, message):
+        """Sends one message.
+
+        Returns:
+            None if we're done with the message, or the monotonic time at
+            which it should be retried.
+        """
+        start = time.perf_counter()
+        try:
+            result = message.bot.send_message(**message.kwargs)
+        except telegram.error.RetryAfter as e:
+            message.attempts += 1
+            logger.info(
+                "Telegram asked us to wait %ss after messaging chat %s.",
+                e.retry_after, chat_id)
+            retry_at = time.monotonic() + e.retry_after
+            with self._cond:
+                self._paused_until = max(self._paused_until, retry_at)
+            if message.attempts > self.max_retries:
+                logger.error("Giving up sending to chat %s: %s", chat_id, e)
+                message.future.set_exception(e)
+                return None
+            return retry_at
+        except (telegram.error.TimedOut, telegram.error.NetworkError) as e:
+            message.attempts += 1
+            if (isinstance(e, telegram.error.BadRequest)
+                    or message.attempts > self.max_retries):
+                logger.error("Giving up sending to chat %s: %s", chat_id, e)
+                message.future.set_exception(e)
+                return None
+            return time.monotonic() + 0.5 * 2 ** message.attempts
+        except Exception as e:
+            logger.error("Failed to send to chat %s: %s", chat_id, e)
+            message.future.set_exception(e)
+            return None
+        finally:
+            metrics.TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - start)
+        message.future.set_result(result)
+        return None
+
+    def stop(self, timeout=None):
+        """Sends whatever is still queued, then stops the workers.
+
+        Args:
+            timeout: optional float, max seconds to wait per worker.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
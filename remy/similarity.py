@@ -0,0 +1,181 @@
+"""Module to find recipes similar to a given one, without calling the API.
+
+Every recipe in the ingredient index is a binary vector over the ingredient
+keys it uses, and two recipes are as similar as the cosine of their vectors:
+the ingredients they share over the square root of the product of their
+ingredient counts. The vectors are stored as a sparse matrix, one growable
+array of recipe rows per ingredient, so scoring every recipe against a query
+is a single pass over the query ingredients' columns: count the rows they
+hit, divide by the norms, take the top k.
+
+The index follows the ingredient_index table in SQLite, loading the rows
+added since it last looked before each query, so recipes fetched by this or
+any other worker process become searchable right away.
+
+Scoring uses NumPy when it's installed, and plain Python otherwise.
+"""
+
+import array
+import collections
+import heapq
+import logging
+import math
+import threading
+import time
+
+from remy import cache
+from remy import config
+from remy import ingredient_index
+
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class SimilarityIndex(object):
+
+    def __init__(self, path=config.CACHE_DB_PATH):
+        """Constructs a SimilarityIndex object, loading it from disk.
+
+        Args:
+            path: str, path to the SQLite database holding the ingredient
+                index, or None to only use add.
+        """
+        self._lock = threading.Lock()
+        # Ingredient key -> column, and each column's recipe rows.
+        self._columns = {}
+        self._postings = []
+        # Row -> recipe id, number of ingredient keys and its columns.
+        self._ids = array.array("q")
+        self._sizes = array.array("f")
+        self._row_columns = []
+        self._rows = {}
+        self._rowid = 0
+        self._db = None
+        if path is None:
+            return
+
+        self._db = cache.connect(path)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ingredient_index ("
+                "recipe_id INTEGER, ingredient TEXT, size INTEGER, "
+                "PRIMARY KEY (recipe_id, ingredient))")
+        start = time.perf_counter()
+        with self._lock:
+            self._load_new_rows()
+        logger.info("Loaded %d recipes into the similarity index in %.3fs.",
+                    len(self), time.perf_counter() - start)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, recipe_id):
+        return recipe_id in self._rows
+
+    def _load_new_rows(self):
+        """Adds rows written to the ingredient index since the last load."""
+        if self._db is None:
+            return
+        for rowid, recipe_id, ingredient in self._db.execute(
+                "SELECT rowid, recipe_id, ingredient FROM ingredient_index "
+                "WHERE rowid > ? ORDER BY rowid", (self._rowid,)):
+            if ingredient != ingredient_index.NO_INGREDIENTS:
+                self._add(recipe_id, ingredient)
+            self._rowid = rowid
+
+    def _add(self, recipe_id, key):
+        row = self._rows.get(recipe_id)
+        if row is None:
+            row = self._rows[recipe_id] = len(self._ids)
+            self._ids.append(recipe_id)
+            self._sizes.append(0)
+            self._row_columns.append(array.array("i"))
+        column = self._columns.get(key)
+        if column is None:
+            column = self._columns[key] = len(self._postings)
+            self._postings.append(array.array("i"))
+        # Rows can be written twice, e.g. by two processes.
+        if column in self._row_columns[row]:
+            return
+        self._row_columns[row].append(column)
+        self._postings[column].append(row)
+        self._sizes[row] += 1
+
+    def add(self, recipe_id, keys):
+        """Adds a recipe's ingredient keys to the in-memory index.
+
+        Recipes in the ingredient index are added automatically, this is for
+        building an index without a database.
+
+        Args:
+            recipe_id: int, the recipe's id.
+            keys: iterable of ingredient key strings, see
+                ingredient_index.ingredient_keys.
+        """
+        with self._lock:
+            for key in keys:
+                self._add(recipe_id, key)
+
+    def similar(self, recipe_id, limit=config.SIMILAR_LIMIT):
+        """Returns the recipes most similar to recipe_id, best first.
+
+        Args:
+            recipe_id: int, the recipe to compare against.
+            limit: int, max results to return.
+        Returns:
+            A list of (recipe id, cosine similarity) tuples, not including
+            recipe_id itself or recipes sharing no ingredient with it. Empty
+            if we don't know the recipe.
+        """
+        with self._lock:
+            self._load_new_rows()
+            row = self._rows.get(recipe_id)
+            if row is None:
+                return []
+            columns = self._row_columns[row]
+            if np is None:
+                return self._similar_python(row, columns, limit)
+            return self._similar_numpy(row, columns, limit)
+
+    def _similar_numpy(self, row, columns, limit):
+        # Views share the arrays' memory. They must be gone before the
+        # arrays grow again, which the lock guarantees.
+        hits = np.concatenate([
+            np.frombuffer(self._postings[column], dtype=np.int32)
+            for column in columns
+        ])
+        sizes = np.frombuffer(self._sizes, dtype=np.float32)
+        shared = np.bincount(hits, minlength=len(sizes))
+        scores = shared / np.sqrt(sizes * len(columns))
+        scores[row] = 0
+        limit = min(limit, len(scores) - 1)
+        if limit <= 0:
+            return []
+        top = np.argpartition(scores, -limit)[-limit:]
+        # Best score first, ties to the recipe indexed first.
+        top = top[np.lexsort((top, -scores[top]))]
+        return [
+            (self._ids[i], float(scores[i])) for i in top.tolist()
+            if scores[i] > 0
+        ]
+
+    def _similar_python(self, row, columns, limit):
+        shared = collections.Counter()
+        for column in columns:
+            shared.update(self._postings[column])
+        del shared[row]
+        norm = len(columns)
+        best = heapq.nlargest(
+            limit, shared.items(),
+            key=lambda item: (
+                item[1] / math.sqrt(self._sizes[item[0]] * norm), -item[0]))
+        return [
+            (self._ids[i], count / math.sqrt(self._sizes[i] * norm))
+            for i, count in best
+        ]
@@ -0,0 +1,100 @@
+"""Module to coalesce concurrent identical calls into one.
+
+When many users ask for the same thing at the same moment, only the first
+caller does the work. Everyone else waits for it and gets the same result, or
+the same exception.
+"""
+
+import asyncio
+import functools
+import threading
+
+
+class _Call(object):
+    """A call in flight that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    def __init__(self):
+        """Constructs a SingleFlight object."""
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Calls fn, unless a call with the same key is already in flight.
+
+        Args:
+            key: hashable key identifying the call.
+            fn: callable doing the actual work.
+            *args, **kwargs: passed to fn.
+        Returns:
+            The result of fn, possibly from another thread's call.
+        Raises:
+            Whatever fn raised, in every caller that waited on it.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Awaits fn, unless a call with the same key is already in flight.
+
+        The asyncio counterpart of do, for coroutine functions. The call runs
+        as its own task, so a caller that is cancelled or times out stops
+        waiting without cancelling it for the others. Calls are only shared
+        between tasks on the same event loop.
+
+        Args:
+            key: hashable key identifying the call.
+            fn: coroutine function doing the actual work.
+            *args, **kwargs: passed to fn.
+        Returns:
+            The result of fn, possibly from another task's call.
+        Raises:
+            Whatever fn raised, in every caller that waited on it.
+        """
+        loop = asyncio.get_running_loop()
+        loop_key = (loop, key)
+        task = self._async_calls.get(loop_key)
+        if task is None:
+            task = loop.create_task(fn(*args, **kwargs))
+            self._async_calls[loop_key] = task
+            task.add_done_callback(
+                functools.partial(self._async_call_done, loop_key))
+        return await asyncio.shield(task)
+
+    def _async_call_done(self, loop_key, task):
+        del self._async_calls[loop_key]
+        # Mark the exception as retrieved in case every caller gave up.
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self):
+        """Returns the number of distinct calls currently running."""
+        return len(self._calls) + len(self._async_calls)
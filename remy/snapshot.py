@@ -0,0 +1,108 @@
+"""Module to save and load warm-start snapshots.
+
+A snapshot holds whatever an Application had hot in memory (recent recipes
+and searches, rendered messages and the random recipe pools) so a restart
+doesn't have to fetch it all from Spoonacular again.
+
+The file is a fixed header followed by zlib compressed JSON:
+
+    magic (8 bytes) | version (uint16) | crc32 (uint32) | length (uint32)
+
+where crc32 and length describe the compressed payload. Snapshots are
+written to a temporary file and renamed into place, so a crash never leaves
+half a snapshot behind. A snapshot that is truncated, corrupt or from
+another version is deleted and we start cold.
+"""
+
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from remy import spoonacular_helper as sp
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = b"REMYSNAP"
+VERSION = 1
+HEADER = struct.Struct("<8sHII")
+
+
+class SnapshotError(Exception):
+    """The snapshot can't be used."""
+
+
+def encode(data):
+    """Returns the bytes of a snapshot holding data."""
+    payload = zlib.compress(
+        json.dumps(data, separators=(",", ":")).encode(), 6)
+    return HEADER.pack(
+        MAGIC, VERSION, zlib.crc32(payload), len(payload)) + payload
+
+
+def decode(buffer):
+    """Returns the data held in a snapshot's bytes.
+
+    Args:
+        buffer: bytes-like snapshot contents.
+    Raises:
+        SnapshotError if the snapshot is truncated, corrupt or from another
+        version.
+    """
+    if len(buffer) < HEADER.size:
+        raise SnapshotError("Snapshot is truncated.")
+    magic, version, checksum, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise SnapshotError("Not a snapshot.")
+    if version != VERSION:
+        raise SnapshotError(f"Snapshot version {version} isn't {VERSION}.")
+    # Views into an mmap must be released before it can be closed.
+    with memoryview(buffer) as view, view[HEADER.size:] as payload:
+        if len(payload) != length or zlib.crc32(payload) != checksum:
+            raise SnapshotError("Snapshot checksum doesn't match.")
+        try:
+            return sp.loads(zlib.decompress(payload))
+        except (zlib.error, ValueError) as e:
+            raise SnapshotError(f"Snapshot can't be decoded: {e}")
+
+
+def write(path, data):
+    """Atomically replaces the snapshot at path with one holding data.
+
+    Returns:
+        The snapshot's size in bytes.
+    """
+    contents = encode(data)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(contents)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+    logger.info("Saved a %d byte snapshot to %s.", len(contents), path)
+    return len(contents)
+
+
+def read(path):
+    """Returns the data in the snapshot at path, or None if there isn't one.
+
+    Unusable snapshots are deleted so we don't trip over them again.
+    """
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                return decode(m)
+    except FileNotFoundError:
+        return None
+    except (SnapshotError, ValueError, OSError) as e:
+        # mmap raises ValueError for an empty file.
+        logger.warning("Discarding snapshot %s: %s", path, e)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
@@ -1,13 +1,30 @@
+from concurrent.futures import ThreadPoolExecutor
 from io import StringIO
+from html import unescape
 from html.parser import HTMLParser
+import json
 import logging
 import re
+import threading
 
+import requests
 from spoonacular import API
 from telegram.utils.helpers import escape_markdown
 
 from remy import config
 from remy import exceptions
+from remy import metrics
+from remy import models
+from remy import singleflight
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
 
 
 class HTMLStripper(HTMLParser):
@@ -26,10 +43,48 @@ class HTMLStripper(HTMLParser):
     def get_data(self):
         return self.text.getvalue()
 
+    def strip(self, html):
+        """Strips html, resetting the parser first so it can be reused."""
+        self.reset()
+        self.text = StringIO()
+        self.feed(html)
+        return self.get_data()
+
+
+# Well formed start and end tags. Anything else the parser might read
+# differently, so strings with other markup fall back to HTMLStripper.
+_TAG_RE = re.compile(
+    r"<[a-zA-Z][a-zA-Z0-9]*"
+    r"(?:\s+[a-zA-Z_:][-a-zA-Z0-9_:.]*"
+    r"(?:\s*=\s*(?:\"[^\"]*\"|'[^']*'|[^\s\"'=<>`]+))?)*"
+    r"\s*/?>"
+    r"|</[a-zA-Z][a-zA-Z0-9]*\s*>"
+)
+# Elements whose content the parser treats as raw text rather than markup.
+_RAW_TEXT_RE = re.compile(
+    r"<(?:script|style|textarea|title|xmp|iframe|noembed|noframes|"
+    r"noscript|plaintext)", re.IGNORECASE)
+# HTMLParser holds back trailing text with an unfinished "&" until more input
+# arrives, which never happens here.
+_PARTIAL_CHARREF_RE = re.compile(r"&[^\s;]*$")
+
+_parsers = threading.local()
+
+
+def _strip_tags_with_parser(html):
+    stripper = getattr(_parsers, "stripper", None)
+    if stripper is None:
+        stripper = _parsers.stripper = HTMLStripper()
+    return stripper.strip(html)
+
 
 def strip_tags(html):
     """Strips text of HTML tags to avoid telegram errors.
 
+    Plain text and simple markup are handled with a single regex pass. Other
+    markup goes through a per-thread HTMLStripper, so the output always
+    matches what HTMLStripper would produce.
+
     Args:
         html: string, representing recipe data.
     Returns:
@@ -37,36 +92,363 @@ def strip_tags(html):
     """
     if not html:
         return
-    stripper = HTMLStripper()
-    stripper.feed(html)
-    return stripper.get_data()
+    if "<" not in html and "&" not in html:
+        return html
+
+    parts = _TAG_RE.split(html)
+    last = parts[-1]
+    if (any("<" in part for part in parts)
+            or _RAW_TEXT_RE.search(html)
+            or _PARTIAL_CHARREF_RE.search(last, max(0, len(last) - 34))):
+        return _strip_tags_with_parser(html)
+    return "".join([unescape(part) if "&" in part else part for part in parts])
+
+
+def strip_tags_many(htmls):
+    """Strips a list of strings at once.
+
+    Args:
+        htmls: iterable of strings, representing recipe data.
+    Returns:
+        List of cleaned strings, in the same order.
+    """
+    return [strip_tags(html) for html in htmls]
+
+
+# Words that end in "s" but aren't plurals we should fold.
+SINGULAR_EXCEPTIONS = {
+    "asparagus",
+    "brussels",
+    "couscous",
+    "grits",
+    "hummus",
+    "molasses",
+    "swiss",
+}
+
+# Words whose singular ends in "ie", so "cookies" folds to "cookie" rather
+# than "cooky".
+IE_SINGULARS = {
+    "brownie",
+    "calorie",
+    "cookie",
+    "hoagie",
+    "pie",
+    "smoothie",
+    "veggie",
+}
+
+
+def singularize(word):
+    """Folds a simple English plural into its singular form.
+
+    This only needs to be good enough that "eggs" and "egg" end up as the
+    same query, so it sticks to the common suffix rules.
+
+    Args:
+        word: str, a single lowercase word.
+    Returns:
+        The singular form of the word.
+    """
+    if word in SINGULAR_EXCEPTIONS or len(word) < 4:
+        return word
+    if word.endswith("ies"):
+        stem = word[:-3]
+        # "pies" isn't "py", and "cookies" isn't "cooky".
+        if len(stem) <= 2 or stem + "ie" in IE_SINGULARS:
+            return word[:-1]
+        return stem + "y"
+    if word.endswith(("oes", "ches", "shes", "sses", "xes", "zes")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        return word[:-1]
+    return word
+
+
+def canonicalize_ingredients(ingredients):
+    """Normalizes an ingredient string so equivalent searches match.
+
+    Ingredients are trimmed, lowercased, folded to their singular form,
+    deduplicated and sorted, so "Eggs, ribeye" and "ribeye,egg" both become
+    "egg,ribeye".
+
+    Args:
+        ingredients: str, a comma separated list of ingredient strings.
+    Returns:
+        The canonical comma separated ingredient string.
+    """
+    canonical = set()
+    for ingredient in ingredients.lower().split(","):
+        words = ingredient.split()
+        if not words:
+            continue
+        words[-1] = singularize(words[-1])
+        canonical.add(" ".join(words))
+    return ",".join(sorted(canonical))
+
+
+def clean_ingredients(ingredients):
+    """Tidies an ingredient string to search Spoonacular with.
+
+    Unlike canonicalize_ingredients, which makes the key searches are cached
+    under, this keeps the user's words and order: ingredients are only
+    trimmed, lowercased and deduplicated, so "Eggs, ribeye, egg" becomes
+    "eggs,ribeye".
+
+    Args:
+        ingredients: str, a comma separated list of ingredient strings.
+    Returns:
+        The cleaned comma separated ingredient string.
+    """
+    cleaned = {}
+    for ingredient in ingredients.lower().split(","):
+        words = ingredient.split()
+        if not words:
+            continue
+        key = canonicalize_ingredients(ingredient)
+        cleaned.setdefault(key, " ".join(words))
+    return ",".join(cleaned.values())
+
+
+def split_ingredient_sets(text, limit=config.MAX_INGREDIENT_SETS):
+    """Splits ";" separated ingredient sets into separate searches.
+
+    Each set is cleaned with clean_ingredients. Empty sets and sets
+    equivalent to an earlier one are dropped, so "eggs; ; egg" is a single
+    search.
+
+    Args:
+        text: str, e.g. "chicken,rice; tofu,broccoli; eggs".
+        limit: int, max queries to return.
+    Returns:
+        A list of ingredient strings, in the order given.
+    """
+    queries = {}
+    for ingredients in text.split(";"):
+        query = canonicalize_ingredients(ingredients)
+        if query:
+            queries.setdefault(query, clean_ingredients(ingredients))
+    return list(queries.values())[:limit]
+
+
+# Parameters for search_recipes_complex that find a single random cocktail.
+COCKTAIL_SEARCH_PARAMS = {
+    "type": "drink",
+    "minAlcohol": 7,
+    "sort": "random",
+    "number": 1,
+}
+
+
+def loads(body):
+    """Decodes a JSON response body, with orjson when it's installed.
+
+    Args:
+        body: bytes or str, the raw response body.
+    Returns:
+        The decoded JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def raise_for_quota_error(content, quota=None):
+    """Raises a QuotaError if decoded response content is a 402 failure.
+
+    The primary purpose of this function is to raise a custom status that we
+    can handle so our bot doesn't crash.
+
+    An error status would look something like this: {
+        'status': 'failure',
+        'code': 402,
+        'message': 'Your daily points limit of 150 has been reached...'
+    }
+
+    Any other format (e.g. a list) indicates that we did not get a quota
+    error.
+
+    Args:
+        content: the decoded JSON body of a Spoonacular response.
+        quota: optional quota.QuotaAccountant to mark as exhausted.
+    Raises:
+        QuotaError if we have exceeded our quota.
+    """
+    if isinstance(content, list):
+        return
+
+    status = content.get("status")
+    code = content.get("code")
+    message = content.get("message")
+
+    if status == "failure" and code == 402:
+        if quota is not None:
+            quota.record_exhausted()
+        raise exceptions.QuotaError(message)
+
+
+def recipe_ids_from_search(recipe_data, limit):
+    """Returns the first limit recipe ids from an ingredient search result."""
+    logger.info("Retrieved %d recipes. Limit of %d will be enforced.",
+                len(recipe_data), limit)
+    return [recipe["id"] for recipe in recipe_data[:limit]]
+
+
+def search_results_to_cache(recipe_data):
+    """Trims an ingredient search result down to what we read back out.
+
+    Search results list used and missed ingredients, images and more for each
+    recipe, but recipe_ids_from_search only needs the ids.
+    """
+    return [{"id": recipe["id"]} for recipe in recipe_data]
+
+
+def recipe_from_random(content):
+    """Returns the Recipe from a get_random_recipes response body."""
+    return models.Recipe.from_json(content["recipes"][0])
+
+
+def recipes_from_random(content):
+    """Returns every Recipe from a get_random_recipes response body."""
+    return [models.Recipe.from_json(recipe) for recipe in content["recipes"]]
+
+
+def recipes_from_bulk(content):
+    """Returns every Recipe from a get_recipe_information_bulk body."""
+    return [models.Recipe.from_json(recipe) for recipe in content]
+
+
+def recipe_id_from_complex_search(content):
+    """Returns the first recipe id from a search_recipes_complex body."""
+    return content["results"][0]["id"]
+
+
+def recipe_ids_from_complex_search(content):
+    """Returns every recipe id from a search_recipes_complex body."""
+    return [result["id"] for result in content["results"]]
+
+
+def meal_plan_from_week(content):
+    """Returns {day: [recipe ids]} from a weekly generate_meal_plan body."""
+    return {
+        day: [meal["id"] for meal in plan["meals"]]
+        for day, plan in content["week"].items()
+    }
+
+
+def ids_param(ids):
+    """Formats recipe ids as the comma separated string the API expects."""
+    return ','.join([str(_id) for _id in ids])
+
+
+def merge_in_order(ids, recipes):
+    """Orders recipes keyed by id to match ids, skipping any we don't have.
+
+    Args:
+        ids: list of Spoonacular recipe ids.
+        recipes: dictionary of recipe id -> Recipe.
+    Returns:
+        A list of recipes in the order of ids.
+    """
+    return [recipes[_id] for _id in ids if _id in recipes]
+
+
+# Bump this whenever the formatters below change their output, so cached
+# rendered messages from the old format are no longer used.
+FORMAT_VERSION = 1
 
 
 class SpoonacularFacade(object):
 
-    def __init__(self, api_key=config.SPOONACULAR_KEY):
+    def __init__(self, api_key=config.SPOONACULAR_KEY, recipe_cache=None,
+                 query_cache=None, quota=None, ingredient_index=None,
+                 api_root=config.SPOONACULAR_API_ROOT,
+                 sleep_time=config.SPOONACULAR_SLEEP_TIME,
+                 timeout=config.SPOONACULAR_TIMEOUT, resilience=None,
+                 min_coverage=config.INGREDIENT_INDEX_MIN_COVERAGE):
         """Constructs a SpoonacularFacade object.
 
         Args:
             api_key: str, the API key to authorize the connection.
+            recipe_cache: optional cache.RecipeCache. When given,
+                get_recipes_for_ids only asks the API for the recipes it
+                doesn't already have.
+            query_cache: optional cache.PersistentCache keyed by canonical
+                ingredient query, holding the ids of the search results.
+            quota: optional quota.QuotaAccountant. When given, every response
+                updates our point totals and calls are refused up front once
+                its policy says we're too close to the daily limit.
+            ingredient_index: optional ingredient_index.IngredientIndex.
+                When given, every recipe returned by get_recipes_for_ids is
+                indexed, and ingredient searches are answered from the index
+                when it covers them well or when we're out of quota.
+            api_root: str, base URL of the Spoonacular API.
+            sleep_time: float, seconds the client waits after each request.
+            timeout: float, seconds the client waits on a connection or a
+                read before giving up.
+            resilience: optional resilience.Resilience. When given, API calls
+                get its timeouts, retries, hedging and circuit breaker, and
+                searches and lookups fall back to the caches when Spoonacular
+                is down.
+            min_coverage: float, share of a search's ingredients every
+                indexed result must use for the index to answer it alone.
         """
         self.client = API(api_key)
-        logging.info("Spoonacular client created.")
+        self.client.api_root = api_root
+        # The client won't take less than a second in its constructor.
+        self.client.sleep_time = sleep_time
+        self.client.timeout = timeout
+        self.resilience = resilience
+        self.recipe_cache = recipe_cache
+        self.query_cache = query_cache
+        self.quota = quota
+        self.ingredient_index = ingredient_index
+        self.min_coverage = min_coverage
+        # Concurrent identical searches and bulk lookups share one request.
+        self.flight = singleflight.SingleFlight()
+        self.recipe_listeners = []
+        logger.info("Spoonacular client created.")
+
+    def add_recipe_listener(self, listener):
+        """Registers a callable to be given every recipe fetched from the API.
+
+        Listeners are called with a list of Recipe objects each time fresh
+        recipe data comes back, so they can keep derived data (like rendered
+        messages) up to date.
+
+        Args:
+            listener: callable taking a list of Recipe objects.
+        """
+        self.recipe_listeners.append(listener)
+
+    def _notify_recipe_listeners(self, recipes):
+        for listener in self.recipe_listeners:
+            try:
+                listener(recipes)
+            except Exception:
+                logger.exception("Recipe listener failed.")
+
+    def decode_response(self, response):
+        """Decodes a response body once and checks it for a quota error.
+
+        Also records the response's quota headers if we're tracking points.
+        See raise_for_quota_error for the shape of an error response.
+
+        Args:
+            response: A Spoonacular response object.
+        Returns:
+            The decoded JSON body.
+        Raises:
+            QuotaError if we have exceeded our quota.
+        """
+        if self.quota is not None:
+            self.quota.record(response)
+        content = loads(response.content)
+        raise_for_quota_error(content, self.quota)
+        return content
 
     def check_status_and_raise(self, response):
         """Checks to see if we've hit our points quota for the day.
-        
-        The primary purpose of this method is to raise a custom status that we
-        can handle so our bot doesn't crash.
-
-        An error status would look something like this: {
-            'status': 'failure',
-            'code': 402,
-            'message': 'Your daily points limit of 150 has been reached...'
-        }
-        
-        Any other format (e.g. a list) indicates that we did not get a quota
-        error.
 
         Args:
             response: A Spoonacular response object.
@@ -75,16 +457,51 @@ class SpoonacularFacade(object):
         Raises:
             QuotaError if we have exceeded our quota.
         """
-        content = response.json()
-        if isinstance(content, list):
-            return
+        self.decode_response(response)
 
-        status = content.get("status")
-        code = content.get("code")
-        message = content.get("message")
+    def _request(self, method, fn, *args, **kwargs):
+        """Calls a client method, under the resilience policy if we have one.
 
-        if status == "failure" and code == 402:
-            raise exceptions.QuotaError(message)
+        Args:
+            method: str, the policy to use: "search", "bulk", "random",
+                "cocktails" or "mealplan".
+            fn: the client method.
+            *args, **kwargs: passed to fn.
+        Returns:
+            The client's response.
+        """
+        if self.resilience is None:
+            return fn(*args, **kwargs)
+        return self.resilience.call(
+            method, self._checked_request, fn, *args, **kwargs)
+
+    @staticmethod
+    def _checked_request(fn, *args, **kwargs):
+        """Calls a client method, raising UpstreamError if the API failed."""
+        try:
+            response = fn(*args, **kwargs)
+        except requests.RequestException as e:
+            raise exceptions.UpstreamError(f"Spoonacular request failed: {e}")
+        # The client swallows socket timeouts and returns None.
+        if response is None:
+            raise exceptions.UpstreamTimeoutError("Spoonacular timed out.")
+        if response.status_code >= 500:
+            raise exceptions.UpstreamError(
+                f"Spoonacular answered {response.status_code}.")
+        return response
+
+    def check_quota_and_raise(self):
+        """Refuses to make a call when the quota policy says we shouldn't.
+
+        This lets us fail before the user waits on a request that would only
+        come back with a 402.
+
+        Raises:
+            QuotaError if the quota accountant won't allow more calls.
+        """
+        if self.quota is not None and not self.quota.allow_request():
+            logger.info("Quota policy refused an upstream call.")
+            raise exceptions.QuotaError("Daily points limit nearly reached.")
 
     def get_recipe_ids_for_ingredients(self, ingredients,
                                        limit=config.RECIPE_LIMIT):
@@ -93,21 +510,116 @@ class SpoonacularFacade(object):
         Enforces the RECIPE_LIMIT parameter in the config file. Or the one
         passed to the limit argument here.
 
+        The ingredients are canonicalized first, and if we have a query cache
+        the search result ids are cached under that key so reordered or
+        repeated searches don't call the API again. Failing that, searches
+        the local ingredient index covers well are answered from it, and so
+        is any search made once we're out of quota or Spoonacular is down.
+
         Args:
             ingredients: str, a comma separated list of ingredient strings.
             limit: int, max recipe ids to return.
         Returns:
             A list of Spoonacular recipe ids.
         """
-        logging.info(
-            f"Calling Spoonacular to search by ingredients: {ingredients}")
-        response = self.client.search_recipes_by_ingredients(ingredients)
-        self.check_status_and_raise(response)
-        recipe_data = response.json()
-        logging.info(f"Retrieved {len(recipe_data)} recipes."
-                     f" Limit of {limit} will be enforced.")
-        return [recipe["id"] for recipe in recipe_data[:limit]]
+        query = canonicalize_ingredients(ingredients)
+        recipe_data = None
+        if self.query_cache is not None:
+            recipe_data = self.query_cache.get(query)
+
+        if recipe_data is not None:
+            logger.info("Using cached search results for: %s", query)
+            return recipe_ids_from_search(recipe_data, limit)
+
+        indexed = self._search_index(query, limit)
+        if indexed and self._index_covers(query, indexed, limit):
+            logger.info("Using indexed recipes for: %s", query)
+            return [recipe_id for recipe_id, _ in indexed]
+
+        try:
+            recipe_data = self.flight.do(
+                ("search", query), self._search_by_ingredients, query,
+                clean_ingredients(ingredients))
+        except (exceptions.QuotaError, exceptions.UpstreamError) as e:
+            if not indexed:
+                raise
+            logger.info("%s, using indexed recipes for: %s",
+                        type(e).__name__, query)
+            return [recipe_id for recipe_id, _ in indexed]
+        return recipe_ids_from_search(recipe_data, limit)
+
+    def get_recipe_ids_for_ingredient_sets(self, queries,
+                                           limit=config.RECIPE_LIMIT):
+        """Searches several ingredient sets at once and merges the results.
+
+        Each set is searched as by get_recipe_ids_for_ingredients, on its own
+        thread, so the wait is the slowest search rather than their sum.
+        Recipes found by more than one set are only returned once, so the
+        caller can fetch them all with a single get_recipes_for_ids call.
 
+        Args:
+            queries: list of comma separated ingredient strings.
+            limit: int, max recipe ids per set.
+        Returns:
+            A list of Spoonacular recipe ids, in the order of the sets.
+        Raises:
+            QuotaError or UpstreamError if no set found anything and one
+            of them failed.
+        """
+        if len(queries) == 1:
+            return self.get_recipe_ids_for_ingredients(queries[0], limit)
+
+        with ThreadPoolExecutor(
+                max_workers=len(queries),
+                thread_name_prefix="remy-search") as pool:
+            futures = [
+                pool.submit(self.get_recipe_ids_for_ingredients, query, limit)
+                for query in queries
+            ]
+        recipe_ids = {}
+        error = None
+        for query, future in zip(queries, futures):
+            try:
+                recipe_ids.update(dict.fromkeys(future.result()))
+            except (exceptions.QuotaError, exceptions.UpstreamError) as e:
+                logger.info("%s searching for: %s", type(e).__name__, query)
+                error = e
+        if not recipe_ids and error is not None:
+            raise error
+        return list(recipe_ids)
+
+    def _search_index(self, query, limit):
+        if self.ingredient_index is None:
+            return []
+        return self.ingredient_index.search(query, limit)
+
+    def _index_covers(self, query, indexed, limit):
+        """Whether indexed results are good enough to skip the API."""
+        wanted = len(query.split(","))
+        return len(indexed) >= limit and all(
+            used / wanted >= self.min_coverage for _, used in indexed)
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
+    def _search_by_ingredients(self, query, ingredients):
+        """Searches the API by ingredients and caches the result ids.
+
+        Args:
+            query: str, the canonical ingredient string to cache under.
+            ingredients: str, the cleaned ingredient string to search for.
+        Returns:
+            The list of search results from the API.
+        """
+        self.check_quota_and_raise()
+        logger.info(
+            "Calling Spoonacular to search by ingredients: %s", ingredients)
+        response = self._request(
+            "search", self.client.search_recipes_by_ingredients, ingredients)
+        recipe_data = self.decode_response(response)
+        if self.query_cache is not None:
+            self.query_cache.put(query, search_results_to_cache(recipe_data))
+        return recipe_data
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
     def get_random_recipe(self, tags=None):
         """Returns a random recipe from the Spoonacular API.
 
@@ -120,83 +632,199 @@ class SpoonacularFacade(object):
                     - Intolerances: https://spoonacular.com/food-api/docs#Intolerances
 
         Returns:
-            A dictionary (json-like) containing the data for the random recipe.
+            A Recipe object for the random recipe.
         """
-        logging.info(f"Calling Spoonacular to get a random recipe with tags"
-                     f" {tags}")
-        response = self.client.get_random_recipes(tags=tags)
-        self.check_status_and_raise(response)
-        return response.json()["recipes"][0]
+        self.check_quota_and_raise()
+        logger.info(
+            "Calling Spoonacular to get a random recipe with tags %s", tags)
+        response = self._request(
+            "random", self.client.get_random_recipes, tags=tags)
+        recipe = recipe_from_random(self.decode_response(response))
+        self._notify_recipe_listeners([recipe])
+        return recipe
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
+    def get_random_recipes(self, tags=None, number=1):
+        """Returns several random recipes from the API in one call.
 
+        Args:
+            tags: str, a comma separated list of tags. See get_random_recipe.
+            number: int, how many recipes to return (Spoonacular caps this
+                at 100).
+        Returns:
+            A list of Recipe objects.
+        """
+        self.check_quota_and_raise()
+        logger.info(
+            "Calling Spoonacular to get %d random recipes with tags %s",
+            number, tags)
+        response = self._request(
+            "random", self.client.get_random_recipes, tags=tags,
+            number=number)
+        recipes = recipes_from_random(self.decode_response(response))
+        self._notify_recipe_listeners(recipes)
+        return recipes
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
+    def get_random_alcoholic_beverage_recipe_ids(self, number=1):
+        """Returns several random alcoholic beverage recipe ids in one call.
+
+        Args:
+            number: int, how many ids to return.
+        Returns:
+            A list of int Spoonacular recipe ids.
+        """
+        self.check_quota_and_raise()
+        logger.info("Calling Spoonacular to get %d random cocktails.", number)
+        response = self._request(
+            "cocktails", self.client.search_recipes_complex, "",
+            **dict(COCKTAIL_SEARCH_PARAMS, number=number))
+        return recipe_ids_from_complex_search(self.decode_response(response))
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
     def get_random_alcoholic_beverage_recipe_id(self):
         """Returns a single random alcoholic beverage recipe id from the API.
 
         Returns:
             A single int Spoonacular recipe id.
         """
-        logging.info(f"Calling Spoonacular to get a random cocktail.")
-        response = self.client.search_recipes_complex(
-            "",
-            type="drink",
-            minAlcohol=7,
-            sort="random",
-            number=1
-        )
-        self.check_status_and_raise(response)
-        return response.json()["results"][0]["id"]
+        self.check_quota_and_raise()
+        logger.info("Calling Spoonacular to get a random cocktail.")
+        response = self._request(
+            "cocktails", self.client.search_recipes_complex, "",
+            **COCKTAIL_SEARCH_PARAMS)
+        return recipe_id_from_complex_search(self.decode_response(response))
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
+    def get_meal_plan(self, diet=None, calories=None, exclude=None):
+        """Generates a week of meals (breakfast, lunch and dinner) in one call.
+
+        Args:
+            diet: optional str, one of config.ALLOWED_DIETS.
+            calories: optional int, calories to aim for each day.
+            exclude: optional str, comma separated ingredients to leave out.
+        Returns:
+            A dictionary of lowercase day names to lists of recipe ids.
+        """
+        self.check_quota_and_raise()
+        logger.info(
+            "Calling Spoonacular for a meal plan: diet %s, %s calories, "
+            "excluding %s", diet, calories, exclude)
+        response = self._request(
+            "mealplan", self.client.generate_meal_plan, diet=diet,
+            exclude=exclude, targetCalories=calories, timeFrame="week")
+        return meal_plan_from_week(self.decode_response(response))
 
     def get_recipes_for_ids(self, ids):
+        """Gets recipes for a set of ids, serving cached ones when possible.
+
+        Only the ids missing from the cache are sent to the API. The results
+        are returned in the same order as the ids that were passed in. If the
+        quota runs out or Spoonacular is down we return whatever was cached.
+
+        Args:
+            ids: list of one or more Spoonacular recipe ids.
+        Returns:
+            A list of Recipe objects.
+        """
+        if self.recipe_cache is None:
+            recipes = self.flight.do(
+                ("bulk", tuple(ids)), self._fetch_recipes_for_ids, ids)
+            self._index_recipes(recipes)
+            return recipes
+
+        ids = [int(_id) for _id in ids]
+        recipes = self.recipe_cache.get_many(ids)
+        missing = [_id for _id in dict.fromkeys(ids) if _id not in recipes]
+        logger.info("Found %d cached recipes, %d left to fetch.",
+                    len(recipes), len(missing))
+
+        if missing:
+            try:
+                fetched = {
+                    recipe.id: recipe
+                    for recipe in self.flight.do(
+                        ("bulk", tuple(missing)),
+                        self._fetch_recipes_for_ids,
+                        missing
+                    )
+                }
+            except (exceptions.QuotaError, exceptions.UpstreamError) as e:
+                if not recipes:
+                    raise
+                logger.info("%s, serving cached recipes only.",
+                            type(e).__name__)
+                fetched = {}
+            self.recipe_cache.put_many(fetched)
+            recipes.update(fetched)
+
+        recipes = merge_in_order(ids, recipes)
+        self._index_recipes(recipes)
+        return recipes
+
+    def _index_recipes(self, recipes):
+        if self.ingredient_index is None:
+            return
+        try:
+            self.ingredient_index.add_recipes(recipes)
+        except Exception:
+            logger.exception("Failed to index recipes.")
+
+    @metrics.timed(metrics.SPOONACULAR_SECONDS)
+    def _fetch_recipes_for_ids(self, ids):
         """Gets recipes from the API given a set of ids.
 
         Args:
             ids: list of one or more Spoonacular recipe ids.
         Returns:
-            A list of dictionaries (json-like) containing the data for
-            each recipe.
-        """
-        logging.info(f"Getting recipes for the following ids: {ids}")
-        ids_param = ','.join([str(_id) for _id in ids])
-        response = self.client.get_recipe_information_bulk(ids_param)
-        self.check_status_and_raise(response)
-        recipes = response.json()
-        logging.info(f"Retrieved data for {len(recipes)} recipes.")
+            A list of Recipe objects.
+        """
+        self.check_quota_and_raise()
+        logger.info("Getting %d recipes from Spoonacular.", len(ids))
+        logger.debug("Recipe ids: %s", ids)
+        response = self._request(
+            "bulk", self.client.get_recipe_information_bulk, ids_param(ids))
+        recipes = recipes_from_bulk(self.decode_response(response))
+        logger.info("Retrieved data for %d recipes.", len(recipes))
+        self._notify_recipe_listeners(recipes)
         return recipes
 
     @classmethod
     def format_recipe_title_link_as_markdown(cls, recipe_data):
-        """Formats a json-like dictionary of recipe data as a markdown link.
+        """Formats a recipe as a markdown link.
 
-        Expects that recipe data matches the Spoonacular JSON response
+        Dictionaries are expected to match the Spoonacular JSON response
         structure as seen here:
             https://spoonacular.com/food-api/docs#Search-Recipes-by-Ingredients
 
         Args:
-            recipe_data: dict of recipe data from the Spoonacular API.
+            recipe_data: a Recipe, or dict of recipe data from the API.
         Returns:
             String representation of the recipe markdown link.
         """
-        title = escape_markdown(strip_tags(recipe_data["title"]).strip(), 2)
-        return f"**[{title}]({recipe_data['sourceUrl']})**"
+        recipe = models.as_recipe(recipe_data)
+        title = escape_markdown(strip_tags(recipe.title).strip(), 2)
+        return f"**[{title}]({recipe.source_url})**"
 
     @classmethod
     def format_recipe_data_as_html(cls, recipe_data):
-        """Formats a json-like dictionary of recipe data as HTML.
+        """Formats a recipe as HTML.
 
-        Expects that recipe data matches the Spoonacular JSON response
+        Dictionaries are expected to match the Spoonacular JSON response
         structure as seen here:
             https://spoonacular.com/food-api/docs#Search-Recipes-by-Ingredients
 
         Args:
-            recipe_data: dict of recipe data from the Spoonacular API.
+            recipe_data: a Recipe, or dict of recipe data from the API.
         Returns:
             String representation of the recipe formatted as an HTML object.
         """
-        ingredients = "\n".join([
-            strip_tags(ingredient["originalString"]) for ingredient
-            in recipe_data["extendedIngredients"]
-        ])
+        recipe = models.as_recipe(recipe_data)
+        ingredients = "\n".join(strip_tags_many([
+            ingredient.original_string for ingredient in recipe.ingredients
+        ]))
 
-        raw_instructions = recipe_data['instructions']
+        raw_instructions = recipe.instructions
         if not raw_instructions:
             instructions = "This recipe didn't have instructions! =O"
         else:
@@ -206,8 +834,8 @@ class SpoonacularFacade(object):
                 strip_tags(raw_instructions)).strip()
 
         formatted = (
-            f"<b>{strip_tags(recipe_data['title'])}</b>\n"
-            f"Cooktime: {recipe_data['readyInMinutes']} minutes\n\n"
+            f"<b>{strip_tags(recipe.title)}</b>\n"
+            f"Cooktime: {recipe.ready_in_minutes} minutes\n\n"
             f"<u>Ingredients</u>\n"
             f"{ingredients}\n\n"
             f"<u>Instructions</u>\n"
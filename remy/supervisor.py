@@ -0,0 +1,241 @@
+"""Module to run the bot as several worker processes.
+
+The supervisor is the only process talking to Telegram for updates, through
+polling or the webhook as usual. It forwards each update to one of N worker
+processes picked by chat id, so one chat's updates always land on the same
+worker and keep their order. Each worker builds its own Application and
+replies to Telegram directly.
+
+Workers share the recipe and query caches, the ingredient index and the quota
+totals through the SQLite database at CACHE_DB_PATH, so a recipe fetched by
+one worker is served from the cache by the others. The random recipe pools
+are kept per worker, each a WORKERS-th of the configured size so prewarming
+and refills fetch as many recipes as a single process would.
+
+A worker that dies is replaced the next time an update is sent its way, and
+updates for a worker whose queue is full are dropped right away, so neither
+can stall the supervisor and with it every other chat.
+"""
+
+import copy
+import functools
+import logging
+import math
+import multiprocessing
+import queue
+import threading
+
+import telegram
+from telegram.ext import TypeHandler, Updater
+
+from remy import app
+from remy import config
+from remy import logs
+from remy import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+# Pool settings split between the workers, see Supervisor.
+POOL_SETTINGS = [
+    "RANDOM_POOL_SIZE",
+    "RANDOM_POOL_LOW_WATER",
+    "RANDOM_POOL_BATCH",
+    "COCKTAIL_POOL_SIZE",
+    "COCKTAIL_POOL_LOW_WATER",
+    "COCKTAIL_POOL_BATCH",
+]
+
+
+def shard_for(update, workers):
+    """Returns the index of the worker that should handle an update.
+
+    Args:
+        update: the telegram Update.
+        workers: int, number of workers.
+    """
+    if update.effective_chat:
+        key = update.effective_chat.id
+    elif update.effective_user:
+        key = update.effective_user.id
+    else:
+        key = update.update_id
+    return key % workers
+
+
+def run_worker(settings, index, updates, ready=None):
+    """Handles the updates the supervisor sends us until it sends None.
+
+    Args:
+        settings: the config.Settings to build the Application from.
+        index: int, this worker's number, from 0.
+        updates: multiprocessing Queue of update dictionaries.
+        ready: optional multiprocessing Event, set once our pools are
+            filled and we're handling updates.
+    """
+    if settings.SNAPSHOT_PATH:
+        # Every worker has its own caches and pools to snapshot.
+        settings.SNAPSHOT_PATH = f"{settings.SNAPSHOT_PATH}.{index}"
+    app.configure_logging(settings)
+    application = app.create_app(settings)
+    application.load_snapshot()
+    updater = application.updater
+    application.register_gauges()
+    metrics_server = None
+    if settings.METRICS_ENABLED:
+        # The supervisor serves on METRICS_PORT, workers on the ports after.
+        metrics_server = metrics.MetricsServer(
+            host=settings.METRICS_LISTEN,
+            port=settings.METRICS_PORT + index + 1
+        ).start()
+    updater.job_queue.start()
+    application.pools.refill()
+    if ready is not None:
+        ready.set()
+    logger.info("Worker %d started.", index)
+
+    while True:
+        data = updates.get()
+        if data is None:
+            break
+        application.dispatcher.process_update(
+            telegram.Update.de_json(data, updater.bot))
+
+    updater.job_queue.stop()
+    application.shutdown()
+    application.save_snapshot()
+    if metrics_server is not None:
+        metrics_server.stop()
+    logger.info("Worker %d stopped.", index)
+    logs.shutdown()
+
+
+class Supervisor(object):
+
+    def __init__(self, settings=None, workers=None):
+        """Constructs a Supervisor object. Call start to run the workers.
+
+        Args:
+            settings: the config.Settings to run with, defaults to the
+                environment's.
+            workers: int, number of worker processes, defaults to WORKERS.
+        """
+        self.settings = settings or config.Settings()
+        self.workers = workers or self.settings.WORKERS
+
+        # Each worker sends on its own, so split the global send rate.
+        self.worker_settings = copy.copy(self.settings)
+        self.worker_settings.TELEGRAM_GLOBAL_RATE = (
+            self.settings.TELEGRAM_GLOBAL_RATE / self.workers)
+        # Every worker fills its own pools, so split them too, or we'd spend
+        # WORKERS times the points prewarming and refilling.
+        for name in POOL_SETTINGS:
+            setattr(self.worker_settings, name, max(
+                1, math.ceil(getattr(self.settings, name) / self.workers)))
+
+        # Workers are spawned rather than forked so they don't inherit our
+        # threads, e.g. the log writer.
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._started = False
+        self.queues = [None] * self.workers
+        self.ready = [None] * self.workers
+        self.processes = [None] * self.workers
+        for index in range(self.workers):
+            self._create_worker(index)
+
+    def _create_worker(self, index):
+        """Creates worker index with a fresh queue, without starting it."""
+        self.queues[index] = self._context.Queue(
+            maxsize=self.settings.HANDLER_MAX_PENDING)
+        self.ready[index] = self._context.Event()
+        self.processes[index] = self._context.Process(
+            target=run_worker,
+            args=(self.worker_settings, index, self.queues[index],
+                  self.ready[index]),
+            name=f"remy-worker-{index}",
+            daemon=True
+        )
+        return self.processes[index]
+
+    @functools.cached_property
+    def updater(self):
+        """An Updater whose only handler forwards updates to the workers."""
+        updater = Updater(
+            token=self.settings.TELEGRAM_TOKEN,
+            base_url=self.settings.TELEGRAM_BASE_URL
+        )
+        updater.dispatcher.add_handler(
+            TypeHandler(telegram.Update, self._forward))
+        return updater
+
+    def _forward(self, update, unused_context):
+        self.dispatch(update)
+
+    def dispatch(self, update):
+        """Sends an update to its worker.
+
+        Drops the update if that worker's queue is full rather than waiting,
+        which would hold up every other chat. A dead worker is restarted
+        first; whatever was still queued for it is lost.
+
+        Returns:
+            True if the update was queued.
+        """
+        index = shard_for(update, self.workers)
+        with self._lock:
+            if self._started and not self.processes[index].is_alive():
+                logger.error(
+                    "Worker %d died with exit code %s, restarting it.",
+                    index, self.processes[index].exitcode)
+                self._create_worker(index).start()
+            updates = self.queues[index]
+        try:
+            updates.put_nowait(update.to_dict())
+        except queue.Full:
+            logger.warning(
+                "Worker %d is too busy, dropping update %s.",
+                index, update.update_id)
+            metrics.UPDATES_DROPPED.inc("worker_busy")
+            return False
+        return True
+
+    def start(self):
+        with self._lock:
+            for process in self.processes:
+                process.start()
+            self._started = True
+        logger.info("Started %d workers.", self.workers)
+        return self
+
+    def wait_ready(self, timeout=None):
+        """Waits for every worker to start handling updates.
+
+        Returns:
+            True if they all did within timeout seconds.
+        """
+        return all(ready.wait(timeout) for ready in self.ready)
+
+    def stop(self, timeout=None):
+        """Lets the workers finish what they were sent, then stops them.
+
+        A worker that can't take the stop signal or doesn't exit within
+        timeout seconds, WORKER_STOP_TIMEOUT by default, is terminated.
+        """
+        if timeout is None:
+            timeout = self.settings.WORKER_STOP_TIMEOUT
+        with self._lock:
+            self._started = False
+        for index, updates in enumerate(self.queues):
+            try:
+                updates.put(None, timeout=timeout)
+            except queue.Full:
+                logger.warning("Worker %d is too busy to stop.", index)
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning("Worker %d didn't stop, terminating it.", index)
+                process.terminate()
+                process.join()
+        logger.info("Workers stopped.")
@@ -1,44 +1,114 @@
+import functools
 import logging
+import time
 
 import telegram
 from telegram.ext import (
-    CommandHandler,
-    Filters,
-    MessageHandler,
-    Updater
-)
+    CommandHandler, Filters, InlineQueryHandler, MessageHandler)
 
 from remy import config
 from remy import exceptions
+from remy import meal_plans
+from remy import metrics
+from remy import models
 from remy import spoonacular_helper as sp
 
 
-spoon = sp.SpoonacularFacade()
+logger = logging.getLogger(__name__)
 
-logging.info("Creating updaters and dispatchers...")
 
-UPDATER = Updater(token=config.TELEGRAM_TOKEN)
-DISPATCHER = UPDATER.dispatcher
+def get_app(context):
+    """Returns the app.Application handling this update."""
+    return context.bot_data["app"]
 
-logging.info("Updater and Dispatcher created.")
+
+def run_in_chat_order(callback):
+    """Wraps a handler callback to run on the app's executor.
+
+    The dispatcher thread only queues the update, so one slow chat can't hold
+    up the others.
+
+    Errors are handed back to the dispatcher so error_handler still sees them.
+    """
+    @functools.wraps(callback)
+    def wrapper(update, context):
+        submit_in_chat_order(context, update, callback, context)
+    return wrapper
+
+
+def submit_in_chat_order(context, update, callback, handler_context):
+    """Queues callback on the app's executor, or tells the chat we're busy.
+
+    Args:
+        context: the telegram CallbackContext we're running in.
+        update: the telegram Update to handle.
+        callback: the handler callback.
+        handler_context: the CallbackContext to call callback with.
+    """
+    app = get_app(context)
+    if not app.executor.submit(
+            _order_key(update), _run_handler, callback, update,
+            handler_context):
+        reply_busy(update, context)
+
+
+def reply_busy(update, context):
+    """Tells a chat one of its updates was dropped, at most once a while.
+
+    Updates without a chat, like inline queries, have nowhere to reply.
+    """
+    chat = update.effective_chat
+    if chat is None:
+        return
+    app = get_app(context)
+    now = time.monotonic()
+    last_reply = app.busy_replies.get(chat.id)
+    if (last_reply is not None and
+            now - last_reply < app.settings.HANDLER_BUSY_REPLY_INTERVAL):
+        return
+    app.busy_replies.put(chat.id, now)
+    app.sender.send_message(
+        context.bot, chat_id=chat.id,
+        text="I'm still working on your last few requests. "
+             "Please try again in a moment.")
+
+
+def _order_key(update):
+    """Updates without a chat, like inline queries, are ordered by user."""
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+def _run_handler(callback, update, context):
+    start = time.perf_counter()
+    try:
+        callback(update, context)
+    except Exception as e:
+        context.dispatcher.dispatch_error(update, e)
+    finally:
+        metrics.HANDLER_SECONDS.observe(
+            time.perf_counter() - start, callback.__name__)
 
 
 def format_message_and_get_parse_mode(recipe):
     """Formats a message and returns the proper parse mode.
     
     Args:
-        recipe: json-like dict of recipe data.
+        recipe: a Recipe, or json-like dict of recipe data.
     Returns:
         Tuple of formatted message and parse mode
     """
-    logging.info(
-        f"Formatting the recipe: {recipe['title']} | id: {recipe['id']}")
+    recipe = models.as_recipe(recipe)
+    logger.info("Formatting the recipe: %s | id: %s", recipe.title, recipe.id)
     parse_mode = telegram.ParseMode.HTML
     message = sp.SpoonacularFacade.format_recipe_data_as_html(
         recipe)
 
     if len(message) > config.TELEGRAM_MESSAGE_CHAR_LIMIT:
-        logging.info("Recipe too long! Formatting a link instead.")
+        logger.info("Recipe too long! Formatting a link instead.")
         link = sp.SpoonacularFacade.format_recipe_title_link_as_markdown(recipe)
         message = (
             f"This recipe was too long to send here\! Here's the "
@@ -49,58 +119,182 @@ def format_message_and_get_parse_mode(recipe):
     return message, parse_mode
 
 
+def render_recipe(recipe, message_cache):
+    """Returns the (message, parse_mode) for a recipe, formatting only once.
+
+    Rendered messages are cached by recipe id and formatter version. The
+    cache is refreshed whenever the facade fetches new data for a recipe.
+
+    Args:
+        recipe: a Recipe, or json-like dict of recipe data.
+        message_cache: the application's cache.MemoryCache of rendered
+            messages.
+    Returns:
+        Tuple of formatted message and parse mode
+    """
+    recipe = models.as_recipe(recipe)
+    key = (recipe.id, sp.FORMAT_VERSION)
+    rendered = message_cache.get(key)
+    if rendered is None:
+        rendered = format_message_and_get_parse_mode(recipe)
+        message_cache.put(key, rendered)
+    return rendered
+
+
+def refresh_rendered_recipes(message_cache, recipes):
+    """Re-renders freshly fetched recipes so the cache never goes stale."""
+    for recipe in recipes:
+        message_cache.put(
+            (recipe.id, sp.FORMAT_VERSION),
+            format_message_and_get_parse_mode(recipe)
+        )
+
+
+def schedule_pool_refill(context):
+    """Queues an immediate pool refill if any pool is running low."""
+    pools = get_app(context).pools
+    if pools.needs_refill():
+        context.job_queue.run_once(pools.refill, 0)
+
+
 def start(update, context):
     """Start bot command function."""
-    context.bot.send_message(
+    get_app(context).sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=(
             "We're up! You can use the following commands to talk to me:\n"
             "/recipe [ingredients,to,search]\n"
             "/random\n"
             "/happyhour\n"
-            "/taco\nMake something delicious!"
+            "/taco\n"
+            "/similar\n"
+            "/mealplan\nMake something delicious!"
         )
     )
 
 
 def recipes_for_ingredients(update, context):
-    """Returns html formatted recipes given the input string."""
-    ingredients = ''.join(context.args).lower()
-    if not ingredients:
-        logging.info("No ingredients provided!")
+    """Returns html formatted recipes given the input string.
+
+    Several ";" separated ingredient sets are searched concurrently and
+    all of their recipes are fetched in one bulk call.
+    """
+    app = get_app(context)
+    queries = sp.split_ingredient_sets(
+        " ".join(context.args), app.settings.MAX_INGREDIENT_SETS)
+    if not queries:
+        logger.info("No ingredients provided!")
         raise exceptions.MissingIngredientError()
 
-    recipe_ids = spoon.get_recipe_ids_for_ingredients(ingredients)
+    recipe_ids = app.spoon.get_recipe_ids_for_ingredient_sets(
+        queries, app.settings.RECIPE_LIMIT)
     if not recipe_ids:
-        logging.info("No recipes found.")
+        logger.info("No recipes found.")
         raise exceptions.RecipesNotFoundError()
 
-    recipes = spoon.get_recipes_for_ids(recipe_ids)
+    recipes = app.spoon.get_recipes_for_ids(recipe_ids)
+    for recipe in recipes:
+        message, parse_mode = render_recipe(recipe, app.message_cache)
+        logger.info("Sending...")
+        app.sender.send_message(
+            context.bot,
+            chat_id=update.effective_chat.id,
+            text=message,
+            parse_mode=parse_mode
+        )
+        remember_recipe(context, recipe.id)
+        logger.info("Recipe queued!")
+
+
+def remember_recipe(context, recipe_id):
+    """Notes the last recipe sent to a chat, for /similar."""
+    context.chat_data["last_recipe"] = recipe_id
+
+
+def similar_recipes(update, context):
+    """Returns recipes similar to the last one sent, or to a given id.
+
+    Answered from the local similarity index over every recipe we've fetched,
+    so only recipes no longer cached cost an API call.
+    """
+    if context.args:
+        try:
+            recipe_id = int(context.args[0])
+        except ValueError:
+            raise exceptions.SimilarRecipesNotFoundError()
+    else:
+        recipe_id = context.chat_data.get("last_recipe")
+        if recipe_id is None:
+            raise exceptions.SimilarRecipesNotFoundError()
+
+    app = get_app(context)
+    similar = app.similarity.similar(recipe_id, app.settings.SIMILAR_LIMIT)
+    if not similar:
+        logger.info("Nothing similar to %s.", recipe_id)
+        raise exceptions.SimilarRecipesNotFoundError()
+
+    recipes = app.spoon.get_recipes_for_ids(
+        [similar_id for similar_id, _ in similar])
     for recipe in recipes:
-        message, parse_mode = format_message_and_get_parse_mode(recipe) 
-        logging.info("Sending...")
-        context.bot.send_message(
+        message, parse_mode = render_recipe(recipe, app.message_cache)
+        app.sender.send_message(
+            context.bot,
             chat_id=update.effective_chat.id,
             text=message,
             parse_mode=parse_mode
         )
-        logging.info("Recipe sent!")
+
+
+def parse_random_tags(args, allowed_tags=config.ALLOWED_TAGS):
+    """Returns the comma separated tags typed after /random.
+
+    Tags are separated by commas or spaces and matched ignoring case. Tags of
+    several words, like "main course" or "latin american", are matched before
+    their single words.
+
+    Args:
+        args: list of str, the command's arguments.
+        allowed_tags: list of allowed tag strings.
+    Returns:
+        The lowercased tags joined by commas, or "" if there were none.
+    Raises:
+        InvalidRandomTagError if a word isn't part of an allowed tag.
+    """
+    allowed = {tag.lower() for tag in allowed_tags if tag}
+    longest = max(len(tag.split()) for tag in allowed)
+    tags = []
+    for chunk in " ".join(args).lower().split(","):
+        words = chunk.split()
+        while words:
+            for length in range(min(longest, len(words)), 0, -1):
+                tag = " ".join(words[:length])
+                if tag in allowed:
+                    break
+            else:
+                raise exceptions.InvalidRandomTagError()
+            tags.append(tag)
+            words = words[length:]
+    return ",".join(tags)
 
 
 def random_recipe(update, context):
     """Returns html formatted random recipe."""
-    # Clean up arguments so we can validate tags
-    all_args = ",".join(context.args).lower().split(",")
-    for value in all_args:
-        if value not in config.ALLOWED_TAGS:
-            raise exceptions.InvalidRandomTagError()
-
-    # Consolidate valid tags into single query
-    tags = ",".join(all_args)
-    recipe = spoon.get_random_recipe(tags=tags)
-    message, parse_mode = format_message_and_get_parse_mode(recipe)
-
-    context.bot.send_message(
+    tags = parse_random_tags(context.args)
+    app = get_app(context)
+    pooled = app.pools.pop_random(tags)
+    if pooled:
+        recipe_id, message, parse_mode = pooled
+    else:
+        logger.info("Random pool empty, calling Spoonacular directly.")
+        recipe = app.spoon.get_random_recipe(tags=tags)
+        recipe_id = recipe.id
+        message, parse_mode = render_recipe(recipe, app.message_cache)
+    schedule_pool_refill(context)
+    remember_recipe(context, recipe_id)
+
+    app.sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=message,
         parse_mode=parse_mode
@@ -109,14 +303,23 @@ def random_recipe(update, context):
 
 def random_alcoholic_beverage(update, context):
     """Returns html formatted random alcoholic beverage recipe."""
-    recipe_id = spoon.get_random_alcoholic_beverage_recipe_id()
-    recipe = spoon.get_recipes_for_ids([recipe_id])
-    message, parse_mode = format_message_and_get_parse_mode(recipe[0])
-
-    context.bot.send_message(
+    app = get_app(context)
+    pooled = app.pools.pop_cocktail()
+    if pooled:
+        recipe_id, message, parse_mode = pooled
+    else:
+        logger.info("Cocktail pool empty, calling Spoonacular directly.")
+        recipe_id = app.spoon.get_random_alcoholic_beverage_recipe_id()
+        recipe = app.spoon.get_recipes_for_ids([recipe_id])
+        message, parse_mode = render_recipe(recipe[0], app.message_cache)
+    schedule_pool_refill(context)
+    remember_recipe(context, recipe_id)
+
+    app.sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=message,
-        parse_mode=telegram.ParseMode.HTML
+        parse_mode=parse_mode
     )
 
 
@@ -125,11 +328,16 @@ def _help(update, context):
     message = (
         "Commands:\n"
         "\t/recipe [ingredients,to,search] -> separted by commas, no brackets\n"
+        "\t  separate several searches with ; e.g. /recipe eggs; tofu,rice\n"
         "\t/random [optional:tags] -> returns a random recipe\n"
         "\t/happyhour -> returns a random cocktail recipe\n"
-        "\t/taco -> returns a random taco recipe"
+        "\t/taco -> returns a random taco recipe\n"
+        "\t/similar [optional:recipe id] -> recipes like the last one\n"
+        "\t/mealplan [optional:settings] -> a meal plan every week\n"
+        "\t/stopmealplan -> stops the weekly meal plan"
     )
-    context.bot.send_message(
+    get_app(context).sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=message
     )
@@ -138,7 +346,8 @@ def _help(update, context):
 def get_a_taco(update, context):
     """Returns a random taco!"""
     taco = "[Taco\!](https://taco-randomizer.herokuapp.com)"
-    context.bot.send_message(
+    get_app(context).sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=taco,
         parse_mode=telegram.ParseMode.MARKDOWN_V2
@@ -147,24 +356,182 @@ def get_a_taco(update, context):
 
 def unknown(update, context):
     """Handles unknown commands."""
-    context.bot.send_message(
+    get_app(context).sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text="I'm sorry, I don't understand. Please use /help to see commands."
     )
 
 
+def subscribe_meal_plan(update, context):
+    """Subscribes the chat to a weekly meal plan."""
+    try:
+        key = meal_plans.parse_plan(" ".join(context.args))
+    except ValueError:
+        raise exceptions.InvalidMealPlanError()
+    app = get_app(context)
+    app.meal_plans.store.subscribe(update.effective_chat.id, key)
+    app.sender.send_message(
+        context.bot,
+        chat_id=update.effective_chat.id,
+        text=(
+            f"You'll get a meal plan ({meal_plans.describe_plan(key)}) "
+            f"every {meal_plans.DAYS[app.meal_plans.day].capitalize()}. "
+            f"Use /stopmealplan to stop."
+        )
+    )
+
+
+def unsubscribe_meal_plan(update, context):
+    """Stops the chat's weekly meal plan."""
+    app = get_app(context)
+    if app.meal_plans.store.unsubscribe(update.effective_chat.id):
+        message = "No more meal plans. Enjoy cooking on your own!"
+    else:
+        message = "This chat isn't getting meal plans. Use /mealplan to start."
+    app.sender.send_message(
+        context.bot, chat_id=update.effective_chat.id, text=message)
+
+
+def inline_recipes(update, context):
+    """Answers an inline query with recipe cards from the local caches.
+
+    Only when nothing local matches do we search Spoonacular, and only once
+    the user has stopped typing for INLINE_DEBOUNCE seconds, so a query typed
+    one letter at a time doesn't cost a call per letter.
+    """
+    inline_query = update.inline_query
+    # Each keystroke replaces the last query, see search_inline_query.
+    context.user_data["inline_query"] = inline_query.id
+    query = sp.canonicalize_ingredients(inline_query.query)
+    if not query:
+        return
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    app = get_app(context)
+    recipes = local_recipes(
+        app.spoon, query, app.settings.INLINE_MAX_RESULTS)
+    if recipes or offset:
+        answer_inline_query(context, inline_query, recipes, offset)
+        return
+    context.job_queue.run_once(
+        search_inline_query, app.settings.INLINE_DEBOUNCE,
+        context=(update, context))
+
+
+def local_recipes(spoon, query, limit):
+    """Returns the cached recipes matching an ingredient query, best first.
+
+    Cached search results for the exact query come first, then the best
+    matches from the ingredient index. Nothing is fetched from the API.
+
+    Args:
+        spoon: the application's SpoonacularFacade.
+        query: str, a canonical comma separated ingredient string.
+        limit: int, max recipes to return.
+    Returns:
+        A list of at most limit Recipe objects.
+    """
+    recipe_ids = {}
+    if spoon.query_cache is not None:
+        recipe_data = spoon.query_cache.get(query)
+        if recipe_data is not None:
+            recipe_ids.update(dict.fromkeys(sp.recipe_ids_from_search(
+                recipe_data, limit)))
+    if spoon.ingredient_index is not None:
+        recipe_ids.update(dict.fromkeys(
+            recipe_id for recipe_id, _ in
+            spoon.ingredient_index.search(query, limit)))
+    if spoon.recipe_cache is None:
+        return []
+    recipe_ids = list(recipe_ids)[:limit]
+    return sp.merge_in_order(
+        recipe_ids, spoon.recipe_cache.get_many(recipe_ids))
+
+
+def search_inline_query(context):
+    """Searches Spoonacular for an inline query the user didn't type past.
+
+    A telegram JobQueue callback, run INLINE_DEBOUNCE seconds after the
+    query arrived.
+    """
+    update, handler_context = context.job.context
+    if handler_context.user_data.get("inline_query") != update.inline_query.id:
+        return
+    submit_in_chat_order(
+        context, update, answer_from_spoonacular, handler_context)
+
+
+def answer_from_spoonacular(update, context):
+    """Answers an inline query with recipes searched on Spoonacular."""
+    inline_query = update.inline_query
+    app = get_app(context)
+    recipe_ids = app.spoon.get_recipe_ids_for_ingredients(
+        inline_query.query, limit=app.settings.INLINE_PAGE_SIZE)
+    recipes = app.spoon.get_recipes_for_ids(recipe_ids) if recipe_ids else []
+    answer_inline_query(context, inline_query, recipes, 0)
+
+
+def recipe_card(recipe, message_cache):
+    """Returns a compact inline result that sends the recipe when picked."""
+    message, parse_mode = render_recipe(recipe, message_cache)
+    details = []
+    if recipe.ready_in_minutes:
+        details.append(f"Ready in {recipe.ready_in_minutes} minutes")
+    if recipe.ingredients:
+        details.append(", ".join(i.name for i in recipe.ingredients))
+    return telegram.InlineQueryResultArticle(
+        id=str(recipe.id),
+        title=recipe.title or "Recipe",
+        description=" | ".join(details)[:100],
+        url=recipe.source_url,
+        input_message_content=telegram.InputTextMessageContent(
+            message, parse_mode=parse_mode)
+    )
+
+
+def answer_inline_query(context, inline_query, recipes, offset):
+    """Answers an inline query with one page of recipe cards.
+
+    Args:
+        context: the telegram CallbackContext.
+        inline_query: the telegram InlineQuery.
+        recipes: list of every matching Recipe.
+        offset: int, index of the first recipe on this page.
+    """
+    app = get_app(context)
+    page = recipes[offset:offset + app.settings.INLINE_PAGE_SIZE]
+    end = offset + len(page)
+    context.bot.answer_inline_query(
+        inline_query.id,
+        [recipe_card(recipe, app.message_cache) for recipe in page],
+        cache_time=app.settings.INLINE_CACHE_TIME,
+        next_offset=str(end) if end < len(recipes) else ""
+    )
+
+
 def error_handler(update, context):
     """Handles errors we get while executing commands."""
-    logging.error(
+    metrics.ERRORS.inc(type(context.error).__name__)
+    logger.error(
         msg="Something went wrong when trying to handle an update.",
         exc_info=context.error
     )
+    # Inline queries and jobs have no chat to reply in.
+    if update is None or update.effective_chat is None:
+        return
 
     parse_mode = None
 
     # Handle quota error
     if isinstance(context.error, exceptions.QuotaError):
         message = "We've hit our recipe quota for today! Come back tomorrow."
+    # Spoonacular is failing or we've stopped calling it for a while
+    elif isinstance(context.error, exceptions.UpstreamError):
+        message = (
+            "I can't reach my recipe book right now. "
+            "Please try again in a minute."
+        )
     # Missing ingredient argument error
     elif isinstance(context.error, exceptions.MissingIngredientError):
         message = "I need ingredients to search!"
@@ -174,6 +541,19 @@ def error_handler(update, context):
             "Yikes! I couldn't find anything for those ingredients. "
             "Sorry about that. Please try some different ones."
         )
+    # Nothing to compare /similar against
+    elif isinstance(context.error, exceptions.SimilarRecipesNotFoundError):
+        message = (
+            "I don't know anything like that yet. Ask me for a recipe "
+            "first, then send /similar."
+        )
+    # Meal plan settings error
+    elif isinstance(context.error, exceptions.InvalidMealPlanError):
+        message = (
+            "Try /mealplan diet=vegetarian calories=2000 exclude=olives. "
+            "Every setting is optional, and the diet can be one of: "
+            + ", ".join(config.ALLOWED_DIETS)
+        )
     # Invalid random tag error
     elif isinstance(context.error, exceptions.InvalidRandomTagError):
         message = (
@@ -189,20 +569,33 @@ def error_handler(update, context):
     else:
         message = "Something went wrong with that last one! Try again or use /help"
 
-    context.bot.send_message(
+    get_app(context).sender.send_message(
+        context.bot,
         chat_id=update.effective_chat.id,
         text=message,
         parse_mode=parse_mode
     )
 
 # Handler registration
-START_HANDLER = CommandHandler('start', start)
-RECIPE_INGREDIENTS_HANDLER = CommandHandler('recipe', recipes_for_ingredients)
-RANDOM_RECIPE_HANDLER = CommandHandler('random', random_recipe)
-HAPPY_HOUR_HANDLER = CommandHandler('happyhour', random_alcoholic_beverage)
-TACO_HANDLER = CommandHandler('taco', get_a_taco)
-UNKNOWN_HANDLER = MessageHandler(Filters.command, unknown)
-HELP_HANDLER = CommandHandler('help', _help)
+# Every handler goes through run_in_chat_order, including the quick ones, so
+# replies within a chat keep the order of the commands.
+START_HANDLER = CommandHandler('start', run_in_chat_order(start))
+RECIPE_INGREDIENTS_HANDLER = CommandHandler(
+    'recipe', run_in_chat_order(recipes_for_ingredients))
+RANDOM_RECIPE_HANDLER = CommandHandler(
+    'random', run_in_chat_order(random_recipe))
+HAPPY_HOUR_HANDLER = CommandHandler(
+    'happyhour', run_in_chat_order(random_alcoholic_beverage))
+TACO_HANDLER = CommandHandler('taco', run_in_chat_order(get_a_taco))
+UNKNOWN_HANDLER = MessageHandler(Filters.command, run_in_chat_order(unknown))
+HELP_HANDLER = CommandHandler('help', run_in_chat_order(_help))
+SIMILAR_HANDLER = CommandHandler(
+    'similar', run_in_chat_order(similar_recipes))
+MEAL_PLAN_HANDLER = CommandHandler(
+    'mealplan', run_in_chat_order(subscribe_meal_plan))
+STOP_MEAL_PLAN_HANDLER = CommandHandler(
+    'stopmealplan', run_in_chat_order(unsubscribe_meal_plan))
+INLINE_HANDLER = InlineQueryHandler(run_in_chat_order(inline_recipes))
 
 handlers = [
     START_HANDLER,
@@ -211,15 +604,10 @@ handlers = [
     RANDOM_RECIPE_HANDLER,
     HAPPY_HOUR_HANDLER,
     TACO_HANDLER,
+    SIMILAR_HANDLER,
+    MEAL_PLAN_HANDLER,
+    STOP_MEAL_PLAN_HANDLER,
+    INLINE_HANDLER,
     # Unknown handler must be last
     UNKNOWN_HANDLER
 ]
-
-logging.info("Registering handlers with dispatcher...")
-
-for handler in handlers:
-    DISPATCHER.add_handler(handler)
-
-DISPATCHER.add_error_handler(error_handler)
-
-logging.info("Handlers added to dispatcher.")
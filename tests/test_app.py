@@ -0,0 +1,219 @@
+import pytest
+import telegram
+
+from remy import app
+from remy import config
+from remy import metrics
+from remy import spoonacular_helper as sp
+from remy import telegram_helper
+from remy.fakes import spoonacular as fake_spoonacular
+from remy.fakes import telegram as fake_telegram
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"),
+        SPOONACULAR_SLEEP_TIME=0
+    )
+
+
+def test_settings_default_to_config_and_take_overrides():
+    settings = config.Settings(RECIPE_LIMIT=7)
+
+    assert settings.RECIPE_LIMIT == 7
+    assert settings.CACHE_DB_PATH == config.CACHE_DB_PATH
+    with pytest.raises(AttributeError):
+        config.Settings(NOT_A_SETTING=1)
+
+
+def test_settings_reach_the_parts_they_configure(tmp_path):
+    settings = config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"),
+        RANDOM_POOL_SIZE=2,
+        COCKTAIL_POOL_SIZE=1,
+        QUOTA_DEGRADE_RATIO=0.1,
+        INGREDIENT_INDEX_MIN_COVERAGE=0.5,
+        MESSAGE_CACHE_SIZE=1,
+        TELEGRAM_SENDER_MAX_CHATS=5
+    )
+    application = app.create_app(settings)
+
+    assert application.pools.random_size == 2
+    assert application.pools.cocktail_pool.size == 1
+    assert application.spoon.quota.degrade_ratio == 0.1
+    assert application.spoon.min_coverage == 0.5
+    assert application.message_cache.max_size == 1
+    assert application.sender.max_chats == 5
+    application.shutdown()
+
+
+def test_settings_reject_overrides_that_cannot_take_effect():
+    with pytest.raises(ValueError):
+        config.Settings(SQLITE_BUSY_TIMEOUT=1)
+
+
+def test_create_app_builds_nothing_until_asked(settings):
+    application = app.create_app(settings)
+
+    assert "updater" not in application.__dict__
+    assert "spoon" not in application.__dict__
+
+    application.spoon
+    assert "updater" not in application.__dict__
+
+
+def test_updater_registers_handlers_and_the_app(settings):
+    application = app.create_app(settings)
+
+    dispatcher = application.dispatcher
+
+    assert dispatcher.bot_data["app"] is application
+    assert dispatcher.handlers[0] == telegram_helper.handlers
+    assert dispatcher.error_handlers
+
+
+def test_apps_built_from_different_settings_are_independent(tmp_path):
+    first = app.create_app(config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "first.db")))
+    second = app.create_app(config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "second.db")))
+
+    first.spoon.recipe_cache.put(1, {"id": 1, "title": "Toast"})
+
+    assert second.spoon.recipe_cache.get(1) is None
+    assert first.sender is not second.sender
+
+
+def test_app_answers_commands_through_fake_telegram(tmp_path):
+    with fake_telegram.FakeTelegramServer() as fake:
+        application = app.create_app(config.Settings(
+            CACHE_DB_PATH=str(tmp_path / "remy.db"),
+            TELEGRAM_BASE_URL=fake.base_url
+        ))
+        update = telegram.Update.de_json(
+            dict(fake_telegram.command_update("/taco", chat_id=7),
+                 update_id=1),
+            application.updater.bot)
+
+        application.dispatcher.process_update(update)
+        sent = fake.wait_for_sent(1)
+        application.shutdown()
+
+    assert int(sent[0]["chat_id"]) == 7
+    assert "Taco" in sent[0]["text"]
+
+
+def test_recipe_searches_several_sets_with_one_bulk_fetch(tmp_path):
+    with fake_spoonacular.FakeSpoonacularServer() as spoonacular, \
+            fake_telegram.FakeTelegramServer() as fake:
+        application = app.create_app(config.Settings(
+            CACHE_DB_PATH=str(tmp_path / "remy.db"),
+            TELEGRAM_BASE_URL=fake.base_url,
+            SPOONACULAR_API_ROOT=spoonacular.base_url,
+            SPOONACULAR_SLEEP_TIME=0
+        ))
+        update = telegram.Update.de_json(
+            dict(fake_telegram.command_update(
+                "/recipe egg; chicken,rice; eggs", chat_id=7), update_id=1),
+            application.updater.bot)
+
+        application.dispatcher.process_update(update)
+        application.executor.shutdown()
+        sent = fake.wait_for_sent(1)
+        application.shutdown()
+
+    paths = [path for path, _ in spoonacular.requests]
+    assert paths.count("recipes/findByIngredients") == 2
+    assert paths.count("recipes/informationBulk") == 1
+    assert int(sent[0]["chat_id"]) == 7
+
+
+def test_similar_answers_from_recipes_already_fetched(tmp_path):
+    with fake_spoonacular.FakeSpoonacularServer() as spoonacular, \
+            fake_telegram.FakeTelegramServer() as fake:
+        application = app.create_app(config.Settings(
+            CACHE_DB_PATH=str(tmp_path / "remy.db"),
+            TELEGRAM_BASE_URL=fake.base_url,
+            SPOONACULAR_API_ROOT=spoonacular.base_url,
+            SPOONACULAR_SLEEP_TIME=0
+        ))
+        for update_id, text in enumerate(["/recipe garlic", "/similar"]):
+            application.dispatcher.process_update(telegram.Update.de_json(
+                dict(fake_telegram.command_update(text, chat_id=7),
+                     update_id=update_id),
+                application.updater.bot))
+        application.executor.shutdown()
+        sent = fake.wait_for_sent(5)
+        application.shutdown()
+
+    # The three garlic recipes, then the other two, the only ones we know
+    # that are like the last of them, from the cache.
+    paths = [path for path, _ in spoonacular.requests]
+    assert paths.count("recipes/informationBulk") == 1
+    assert len(sent) == 5
+
+
+def test_register_gauges_reports_caches_quota_and_queues(settings):
+    app.create_app(settings).register_gauges()
+
+    text = metrics.REGISTRY.render()
+
+    for line in [
+            'remy_cache_hit_ratio{cache="recipes"}',
+            'remy_quota_points{kind="limit"}',
+            'remy_queue_depth{queue="sender"}']:
+        assert line in text
+
+
+def test_snapshot_warms_a_restarted_app(tmp_path):
+    settings = config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"),
+        SNAPSHOT_PATH=str(tmp_path / "remy.snapshot"),
+        RANDOM_POOL_PREWARM_TAGS=["vegan"]
+    )
+    application = app.create_app(settings)
+    application.spoon.recipe_cache.put(1, {"id": 1, "title": "Toast"})
+    application.spoon.query_cache.put("egg", [{"id": 1}])
+    application.pools.restore({"random": {"vegan": [[1, "Toast", "HTML"]]}})
+    application.save_snapshot()
+
+    # A new database too, as if the deploy wiped it.
+    restarted = app.create_app(config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "new.db"),
+        SNAPSHOT_PATH=settings.SNAPSHOT_PATH,
+        RANDOM_POOL_PREWARM_TAGS=["vegan"]
+    ))
+
+    assert restarted.load_snapshot()
+    assert restarted.spoon.recipe_cache.get(1).title == "Toast"
+    assert restarted.spoon.query_cache.get("egg") == [{"id": 1}]
+    assert restarted.pools.pop_random("vegan") == (1, "Toast", "HTML")
+
+
+def test_snapshot_drops_pools_rendered_by_an_old_formatter(
+        tmp_path, monkeypatch):
+    settings = config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"),
+        SNAPSHOT_PATH=str(tmp_path / "remy.snapshot"),
+        RANDOM_POOL_PREWARM_TAGS=["vegan"]
+    )
+    application = app.create_app(settings)
+    application.pools.restore({"random": {"vegan": [[1, "Toast", "HTML"]]}})
+    application.save_snapshot()
+
+    monkeypatch.setattr(sp, "FORMAT_VERSION", sp.FORMAT_VERSION + 1)
+    restarted = app.create_app(settings)
+
+    assert restarted.load_snapshot()
+    assert restarted.pools.pop_random("vegan") is None
+
+
+def test_load_snapshot_starts_cold_without_a_usable_snapshot(tmp_path):
+    path = tmp_path / "remy.snapshot"
+    path.write_bytes(b"garbage")
+    application = app.create_app(config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"), SNAPSHOT_PATH=str(path)))
+
+    assert not application.load_snapshot()
+    assert not path.exists()
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import time
+from unittest import mock
+
+import pytest
+
+from remy import async_spoonacular
+from remy import cache
+from remy import exceptions
+from remy import models
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+class FakeResponse:
+
+    def __init__(self, jsondict, headers=None, status=200):
+        self.jsondict = jsondict
+        self.headers = headers or {}
+        self.status = status
+
+    async def read(self):
+        return json.dumps(self.jsondict).encode()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *unused):
+        pass
+
+
+class FakeSession:
+    """Records requests and answers each path with a canned body."""
+
+    closed = False
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.requests = []
+
+    def get(self, url, params=None):
+        self.requests.append((url, params))
+        path = url[len("https://fake/"):]
+        return FakeResponse(self.bodies[path])
+
+
+def make_facade(bodies, **kwargs):
+    return async_spoonacular.AsyncSpoonacularFacade(
+        "FAKEKEY", api_root="https://fake/", session=FakeSession(bodies),
+        **kwargs)
+
+
+def test_get_recipe_ids_for_ingredients_calls_proper_endpoint():
+    """Tests the endpoint, the user's ingredients and limit."""
+    facade = make_facade({
+        "recipes/findByIngredients": [{"id": 1}, {"id": 2}, {"id": 3}]})
+    output = asyncio.run(facade.get_recipe_ids_for_ingredients("eggs,ham", 2))
+
+    assert output == [1, 2]
+    assert facade.session.requests == [(
+        "https://fake/recipes/findByIngredients",
+        {"ingredients": "eggs,ham", "apiKey": "FAKEKEY"}
+    )]
+
+
+def test_get_random_recipe_drops_empty_tags():
+    """Tests that None parameters aren't sent."""
+    facade = make_facade({"recipes/random": {"recipes": [{"id": 1}]}})
+
+    assert asyncio.run(facade.get_random_recipe()) == models.Recipe(1)
+    assert facade.session.requests[0][1] == {"apiKey": "FAKEKEY"}
+
+
+def test_get_random_alcoholic_beverage_recipe_id_returns_id():
+    """Tests that we parse the complex search result."""
+    facade = make_facade(
+        {"recipes/complexSearch": {"results": [{"id": 7}]}})
+
+    assert asyncio.run(facade.get_random_alcoholic_beverage_recipe_id()) == 7
+    assert facade.session.requests[0][1]["type"] == "drink"
+
+
+def test_get_recipes_for_ids_only_fetches_uncached_ids():
+    """Cached recipes are merged with fetched ones in the original order."""
+    recipe_cache = cache.RecipeCache(path=":memory:", table="test")
+    recipe_cache.put(1, {"id": 1})
+    facade = make_facade(
+        {"recipes/informationBulk": [{"id": 2}]}, recipe_cache=recipe_cache)
+
+    output = asyncio.run(facade.get_recipes_for_ids([2, 1]))
+
+    assert output == [models.Recipe(2), models.Recipe(1)]
+    assert facade.session.requests[0][1]["ids"] == "2"
+
+
+def test_quota_error_is_raised():
+    """Tests that a 402 body raises our QuotaError."""
+    facade = make_facade({"recipes/random": {
+        "status": "failure", "code": 402, "message": "out"}})
+
+    with pytest.raises(exceptions.QuotaError):
+        asyncio.run(facade.get_random_recipe())
+
+
+def test_server_errors_raise_upstream_error():
+    """Tests that 5xx answers aren't parsed as if they were results."""
+
+    async def calls(facade):
+        for call in [
+                facade.get_recipe_ids_for_ingredients("egg"),
+                facade.get_random_alcoholic_beverage_recipe_id(),
+                facade.get_random_recipe()]:
+            with pytest.raises(exceptions.UpstreamError):
+                await call
+        await facade.close()
+
+    with fake_spoonacular.FakeSpoonacularServer(error_rate=1) as server:
+        asyncio.run(calls(async_spoonacular.AsyncSpoonacularFacade(
+            "FAKEKEY", api_root=server.base_url)))
+
+
+def test_get_recipes_for_ids_serves_cached_when_upstream_fails():
+    facade = make_facade(
+        {}, recipe_cache=cache.RecipeCache(path=":memory:"))
+    facade.recipe_cache.put(1, {"id": 1, "title": "Toast"})
+    facade.session.get = lambda url, params=None: FakeResponse(
+        {}, status=503)
+
+    recipes = asyncio.run(facade.get_recipes_for_ids([1, 2]))
+
+    assert [recipe.id for recipe in recipes] == [1]
+
+
+def test_fetched_recipes_reach_the_index_and_listeners():
+    """Like the synchronous facade, results warm the index and renderers."""
+    index = mock.Mock()
+    facade = make_facade(
+        {"recipes/informationBulk": [{"id": 2}]},
+        recipe_cache=cache.RecipeCache(path=":memory:"),
+        ingredient_index=index)
+    facade.recipe_cache.put(1, {"id": 1})
+    listener = mock.Mock()
+    facade.add_recipe_listener(listener)
+
+    asyncio.run(facade.get_recipes_for_ids([1, 2]))
+
+    listener.assert_called_once_with([models.Recipe(2)])
+    index.add_recipes.assert_called_once_with(
+        [models.Recipe(1), models.Recipe(2)])
+
+
+def test_slow_quota_database_does_not_block_the_loop():
+    """A quota check stuck on a database lock leaves other calls running."""
+
+    def slow_allow_request():
+        time.sleep(0.2)
+        return True
+
+    facade = make_facade(
+        {"recipes/random": {"recipes": [{"id": 1}]}},
+        quota=mock.Mock(allow_request=slow_allow_request))
+    ticks = []
+
+    async def tick():
+        for _ in range(5):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def main():
+        start = time.monotonic()
+        await asyncio.gather(facade.get_random_recipe(), tick())
+        return start
+
+    start = asyncio.run(main())
+    assert ticks[-1] - start < 0.2
@@ -0,0 +1,106 @@
+from unittest import mock
+
+from remy import cache
+from remy import models
+
+
+def make_cache(**kwargs):
+    return cache.PersistentCache(path=":memory:", table="test", **kwargs)
+
+
+def test_get_many_returns_only_stored_keys():
+    """Tests that we get back what we stored and nothing else."""
+    c = make_cache()
+    c.put_many({1: {"id": 1}, 2: {"id": 2}})
+
+    assert c.get_many([1, 2, 3]) == {1: {"id": 1}, 2: {"id": 2}}
+
+
+def test_get_many_reads_from_disk_when_not_in_memory():
+    """Tests that entries pushed out of memory are still served from disk."""
+    c = make_cache(memory_size=1)
+    c.put_many({1: {"id": 1}, 2: {"id": 2}})
+
+    assert 1 not in c._memory
+    assert c.get(1) == {"id": 1}
+
+
+def test_get_many_skips_expired_entries():
+    """Tests that entries older than the ttl are treated as misses."""
+    c = make_cache(ttl=10)
+    with mock.patch.object(cache.time, "time", return_value=100):
+        c.put(1, "old")
+    with mock.patch.object(cache.time, "time", return_value=111):
+        assert c.get(1) is None
+
+
+def test_put_many_evicts_oldest_entries():
+    """Tests that we never hold more than max_size entries on disk."""
+    c = make_cache(max_size=2, memory_size=0)
+    for i in range(3):
+        with mock.patch.object(cache.time, "time", return_value=100 + i):
+            c.put(i, i)
+
+    with mock.patch.object(cache.time, "time", return_value=103):
+        assert c.get_many([0, 1, 2]) == {1: 1, 2: 2}
+
+
+def test_stats_counts_hits_and_misses():
+    """Tests that we report hit/miss counts."""
+    c = make_cache()
+    c.put(1, "one")
+    c.get_many([1, 2])
+
+    assert c.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_memory_cache_drops_least_recently_used():
+    c = cache.MemoryCache(max_size=2)
+    c.put("a", 1)
+    c.put("b", 2)
+    c.get("a")
+    c.put("c", 3)
+
+    assert c.get("b") is None
+    assert c.get("a") == 1
+    assert c.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+
+def test_recipe_cache_returns_recipes_from_memory_and_disk():
+    """Tests that recipes come back as Recipe objects either way."""
+    c = cache.RecipeCache(path=":memory:", table="test", memory_size=1)
+    c.put_many({1: {"id": 1, "title": "one"}, 2: models.Recipe(2, "two")})
+
+    assert 1 not in c._memory
+    assert c.get_many([1, 2]) == {
+        1: models.Recipe(1, "one"), 2: models.Recipe(2, "two")}
+
+
+def test_caches_sharing_a_database_see_each_others_entries(tmp_path):
+    """Worker processes each open the cache on the same WAL database."""
+    path = str(tmp_path / "shared.db")
+    first = cache.PersistentCache(path=path, table="test")
+    second = cache.PersistentCache(path=path, table="test")
+
+    first.put(1, {"id": 1})
+
+    assert second.get(1) == {"id": 1}
+    (mode,) = second._db.execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+def test_restore_loads_a_snapshot_into_memory_and_disk(tmp_path):
+    """Tests that a cache restored from a snapshot keeps the timestamps."""
+    c = cache.RecipeCache(path=":memory:", ttl=100)
+    c.put(1, {"id": 1, "title": "Toast"})
+    entries = c.snapshot()
+    entries.append([2, {"id": 2, "title": "Stale"}, 0])
+
+    restored = cache.RecipeCache(path=str(tmp_path / "new.db"), ttl=100)
+
+    assert restored.restore(entries) == 1
+    assert restored.get(1) == models.Recipe(1, title="Toast")
+    assert restored.get(2) is None
+    (stored_at,) = restored._db.execute(
+        "SELECT stored_at FROM recipes WHERE key = '1'").fetchone()
+    assert stored_at == entries[0][2]
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from remy import chat_executor
+from remy import metrics
+
+
+def test_tasks_for_one_chat_run_in_order():
+    executor = chat_executor.ChatOrderedExecutor(max_workers=4)
+    seen = []
+
+    def task(i):
+        # Earlier tasks are slower, so any reordering would show up.
+        time.sleep(0.01 * (5 - i))
+        seen.append(i)
+
+    for i in range(5):
+        executor.submit(1, task, i)
+    executor.shutdown()
+
+    assert seen == [0, 1, 2, 3, 4]
+
+
+def test_slow_chat_does_not_block_other_chats():
+    executor = chat_executor.ChatOrderedExecutor(max_workers=2)
+    release = threading.Event()
+    fast_done = threading.Event()
+
+    executor.submit(1, release.wait)
+    executor.submit(2, fast_done.set)
+
+    assert fast_done.wait(1)
+    release.set()
+    executor.shutdown()
+
+
+def test_submit_blocks_when_saturated():
+    """Tests backpressure once max_pending tasks are in flight."""
+    executor = chat_executor.ChatOrderedExecutor(
+        max_workers=1, max_pending=1)
+    release = threading.Event()
+    executor.submit(1, release.wait)
+    assert executor.queue_depth() == 1
+
+    submitted = threading.Event()
+
+    def submit_another():
+        executor.submit(2, lambda: None)
+        submitted.set()
+
+    threading.Thread(target=submit_another).start()
+    assert not submitted.wait(0.1)
+
+    release.set()
+    assert submitted.wait(1)
+    executor.shutdown()
+    assert executor.queue_depth() == 0
+
+
+def test_failing_task_does_not_stall_chat():
+    executor = chat_executor.ChatOrderedExecutor(max_workers=1)
+    done = threading.Event()
+
+    executor.submit(1, lambda: 1 / 0)
+    executor.submit(1, done.set)
+
+    assert done.wait(1)
+    executor.shutdown()
+
+
+def test_busy_chat_drops_tasks_past_its_cap():
+    """One flooding chat can't take every pending slot from the others."""
+    executor = chat_executor.ChatOrderedExecutor(
+        max_workers=2, max_pending=10, max_pending_per_chat=2)
+    release = threading.Event()
+    dropped = metrics.UPDATES_DROPPED.value("chat_busy")
+
+    assert executor.submit(1, release.wait)
+    assert executor.submit(1, lambda: None)
+    assert not executor.submit(1, lambda: None)
+    assert executor.submit(2, lambda: None)
+
+    assert metrics.UPDATES_DROPPED.value("chat_busy") == dropped + 1
+    release.set()
+    executor.shutdown()
+    assert executor.queue_depth() == 0
@@ -0,0 +1,58 @@
+import pytest
+
+from remy import exceptions
+from remy import quota
+from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fs
+
+
+@pytest.fixture
+def fake():
+    with fs.FakeSpoonacularServer(catalogue_size=20, seed=1) as server:
+        yield server
+
+
+def make_facade(fake, **kwargs):
+    return sp.SpoonacularFacade(
+        "FAKEKEY", api_root=fake.base_url, sleep_time=0, **kwargs)
+
+
+def test_facade_gets_recipes_from_the_fake(fake):
+    """Tests a search and bulk lookup end to end over HTTP."""
+    spoon = make_facade(fake)
+    ids = spoon.get_recipe_ids_for_ingredients("kale, garlic")
+    recipes = spoon.get_recipes_for_ids(ids)
+
+    assert [recipe.id for recipe in recipes] == ids
+    assert "kale" in [i.name for i in recipes[0].ingredients]
+    assert fake.requests[0] == (
+        "recipes/findByIngredients",
+        {"ingredients": "kale,garlic", "apiKey": "FAKEKEY"})
+
+
+def test_fake_serves_random_recipes_and_cocktails(fake):
+    spoon = make_facade(fake)
+
+    assert len(spoon.get_random_recipes(tags="vegan", number=3)) == 3
+    cocktail_id = spoon.get_random_alcoholic_beverage_recipe_id()
+    assert "drink" in fake.recipes[cocktail_id]["dishTypes"]
+
+
+def test_fake_reports_quota_and_runs_out(tmp_path):
+    """Tests that quota headers are recorded and a spent quota is a 402."""
+    accountant = quota.QuotaAccountant(path=str(tmp_path / "quota.db"))
+    with fs.FakeSpoonacularServer(daily_limit=2.5) as fake:
+        spoon = make_facade(fake, quota=accountant)
+        spoon.get_recipes_for_ids([715538])
+        assert accountant.used == 1
+        assert accountant.limit == 2.5
+
+        spoon.get_recipes_for_ids([716429, 644387])
+        with pytest.raises(exceptions.QuotaError):
+            spoon.get_recipes_for_ids([1096010])
+
+
+def test_fake_injects_quota_errors():
+    with fs.FakeSpoonacularServer(quota_error_rate=1) as fake:
+        with pytest.raises(exceptions.QuotaError):
+            make_facade(fake).get_random_recipe()
@@ -0,0 +1,100 @@
+
+from remy import ingredient_index
+from remy import models
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def recipe(recipe_id, *names):
+    return models.Recipe(
+        recipe_id, ingredients=[models.Ingredient(name, name) for name in names])
+
+
+def make_index(path=":memory:"):
+    return ingredient_index.IngredientIndex(path=path)
+
+
+def test_ingredient_keys_include_full_name_and_last_word():
+    assert ingredient_index.ingredient_keys("Parmesan Cheese") == {
+        "parmesan cheese", "cheese"}
+
+
+def test_search_ranks_by_used_then_missed_ingredients():
+    """Tests that we rank like Spoonacular's maximize used ingredients."""
+    index = make_index()
+    index.add_recipes([
+        recipe(1, "egg", "flour", "sugar", "butter"),
+        recipe(2, "egg", "ribeye"),
+        recipe(3, "egg", "ribeye", "potato"),
+        recipe(4, "sugar"),
+    ])
+
+    assert index.search("ribeye, eggs", limit=4) == [(2, 2), (3, 2), (1, 1)]
+
+
+def test_search_matches_plurals_and_head_nouns():
+    index = make_index()
+    index.add_recipes([recipe(1, "cherry tomatoes", "parmesan cheese")])
+
+    assert index.search("tomato,cheese") == [(1, 2)]
+
+
+def test_add_recipes_skips_known_recipes():
+    index = make_index()
+    index.add_recipes([recipe(1, "egg")])
+    index.add_recipes([recipe(1, "ribeye")])
+
+    assert index.search("ribeye") == []
+    assert len(index) == 1
+
+
+def test_index_persists_across_instances(tmp_path):
+    path = str(tmp_path / "remy.db")
+    make_index(path).add_recipes([recipe(1, "egg", "ribeye")])
+
+    index = make_index(path)
+    assert 1 in index
+    assert index.search("egg,ribeye") == [(1, 2)]
+
+
+def test_indexes_recorded_recipes():
+    recipes = fake_spoonacular.load_fixtures()
+
+    index = make_index()
+    index.add_recipes([models.Recipe.from_json(r) for r in recipes])
+
+    assert len(index) == len(recipes)
+    for r in recipes:
+        name = r["extendedIngredients"][0]["name"]
+        assert r["id"] in [i for i, _ in index.search(name, limit=100)]
+
+
+def test_search_sees_recipes_indexed_by_another_process(tmp_path):
+    path = str(tmp_path / "index.db")
+    first, second = make_index(path), make_index(path)
+
+    first.add_recipes([recipe(1, "egg", "ribeye")])
+
+    assert second.search("ribeye") == [(1, 1)]
+    assert 1 in second
+
+
+def test_recipes_without_ingredients_are_indexed_once(tmp_path):
+    path = str(tmp_path / "remy.db")
+    make_index(path).add_recipes([recipe(1)])
+
+    index = make_index(path)
+    assert 1 in index
+    assert index.search("egg") == []
+
+
+def test_index_drops_the_oldest_recipes_past_max_recipes(tmp_path):
+    path = str(tmp_path / "remy.db")
+    first = ingredient_index.IngredientIndex(path=path, max_recipes=2)
+    second = ingredient_index.IngredientIndex(path=path, max_recipes=2)
+
+    first.add_recipes([recipe(1, "egg"), recipe(2, "egg"), recipe(3, "egg")])
+
+    assert 1 not in first
+    assert first.search("egg") == [(2, 1), (3, 1)]
+    assert second.search("egg") == [(2, 1), (3, 1)]
+    assert len(ingredient_index.IngredientIndex(path=path, max_recipes=10)) == 2
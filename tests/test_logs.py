@@ -0,0 +1,122 @@
+import json
+import logging
+import queue
+
+import pytest
+
+from remy import logs
+
+
+@pytest.fixture
+def logfile(tmp_path):
+    yield tmp_path / "remy.log"
+    logs.shutdown()
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def read_records(path):
+    logs.shutdown()
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def make_record(name, level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, "msg", None, None)
+
+
+def test_parse_spec():
+    assert logs.parse_spec(" remy.cache=WARNING, telegram=ERROR,") == {
+        "remy.cache": "WARNING",
+        "telegram": "ERROR",
+    }
+    assert logs.parse_spec("") == {}
+    with pytest.raises(ValueError):
+        logs.parse_spec("remy.cache")
+
+
+def test_configure_writes_json_records_in_the_background(logfile):
+    logs.configure(str(logfile))
+    logger = logging.getLogger("remy.test")
+    logger.info("Found %d recipes for %s.", 2, ["egg"])
+    try:
+        raise KeyError("boom")
+    except KeyError:
+        logger.exception("Failed.")
+
+    first, second = read_records(logfile)
+    assert first["message"] == "Found 2 recipes for ['egg']."
+    assert first["level"] == "INFO"
+    assert first["logger"] == "remy.test"
+    assert "exc_info" not in first
+    assert second["level"] == "ERROR"
+    assert "KeyError: 'boom'" in second["exc_info"]
+
+
+def test_shutdown_removes_the_queue_handler(logfile):
+    handler = logs.configure(str(logfile))
+    logs.shutdown()
+
+    assert handler not in logging.getLogger().handlers
+    assert logs.queue_depth() == 0
+
+
+def test_configure_sets_per_logger_levels(logfile):
+    logs.configure(str(logfile), levels="remy.quiet=WARNING")
+    logging.getLogger("remy.quiet.child").info("hidden")
+    logging.getLogger("remy.quiet").warning("shown")
+    logging.getLogger("remy.loud").info("shown too")
+
+    assert [r["message"] for r in read_records(logfile)] == [
+        "shown", "shown too"]
+    logging.getLogger("remy.quiet").setLevel(logging.NOTSET)
+
+
+def test_configure_rejects_unknown_format(logfile):
+    with pytest.raises(ValueError):
+        logs.configure(str(logfile), fmt="xml")
+
+
+def test_sampling_filter_keeps_a_fraction_of_info_records():
+    sampler = logs.SamplingFilter({"remy.busy": 0.25})
+
+    kept = [sampler.filter(make_record("remy.busy.child")) for _ in range(8)]
+
+    assert kept == [True, False, False, False, True, False, False, False]
+    assert all(sampler.filter(make_record("remy.other")) for _ in range(4))
+    assert all(
+        sampler.filter(make_record("remy.busy", logging.WARNING))
+        for _ in range(4))
+
+
+def test_queue_handler_drops_records_when_full():
+    handler = logs.QueueHandler(queue.Queue(maxsize=1))
+
+    handler.handle(make_record("remy.test"))
+    handler.handle(make_record("remy.test"))
+
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
+
+
+def test_queue_handler_leaves_formatting_to_the_listener():
+    handler = logs.QueueHandler(queue.Queue())
+    record = logging.LogRecord(
+        "remy.test", logging.INFO, __file__, 1, "%d recipes", (3,), None)
+
+    handler.handle(record)
+
+    queued = handler.queue.get_nowait()
+    assert (queued.msg, queued.args) == ("%d recipes", (3,))
+
+
+def test_queue_handler_formats_records_with_mutable_args_right_away():
+    handler = logs.QueueHandler(queue.Queue())
+    ids = [1, 2]
+    record = logging.LogRecord(
+        "remy.test", logging.INFO, __file__, 1, "Recipe ids: %s", (ids,),
+        None)
+
+    handler.handle(record)
+    ids.append(3)
+
+    queued = handler.queue.get_nowait()
+    assert (queued.msg, queued.args) == ("Recipe ids: [1, 2]", None)
@@ -0,0 +1,133 @@
+import datetime
+from unittest import mock
+
+import pytest
+
+from remy import exceptions
+from remy import meal_plans
+from remy import models
+from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def test_parse_plan_normalizes_settings():
+    assert meal_plans.parse_plan(
+        "diet=Vegan calories=1800 exclude=peanuts, olives") == (
+            "vegan", 1800, "olive,peanut")
+    assert meal_plans.parse_plan("") == meal_plans.plan_key() == (
+        "", None, "")
+
+
+@pytest.mark.parametrize("text", [
+    "vegan",
+    "diet=carnivore",
+    "calories=lots",
+    "calories=-5",
+])
+def test_parse_plan_rejects_bad_settings(text):
+    with pytest.raises(ValueError):
+        meal_plans.parse_plan(text)
+
+
+def test_format_meal_plan_links_recipes_by_day():
+    message = meal_plans.format_meal_plan(
+        ("vegan", None, ""),
+        {"tuesday": [2], "monday": [1]},
+        {1: models.Recipe(1, "Toast & Jam", "http://toast", 5)})
+
+    assert message.index("Monday") < message.index("Tuesday")
+    assert '<a href="http://toast">Toast &amp; Jam</a> (5 min)' in message
+    assert "Recipe 2" in message
+
+
+def test_store_groups_subscribers_by_plan(tmp_path):
+    store = meal_plans.SubscriptionStore(path=str(tmp_path / "remy.db"))
+    store.subscribe(1, ("vegan", None, ""))
+    store.subscribe(2, ("", 2000, ""))
+    store.subscribe(3, ("vegan", None, ""))
+    store.subscribe(2, ("vegan", None, ""))
+
+    assert store.groups() == {("vegan", None, ""): [1, 3, 2]}
+    assert store.unsubscribe(3)
+    assert not store.unsubscribe(3)
+
+
+def test_only_one_process_claims_a_week(tmp_path):
+    first = meal_plans.SubscriptionStore(path=str(tmp_path / "remy.db"))
+    second = meal_plans.SubscriptionStore(path=str(tmp_path / "remy.db"))
+
+    assert first.claim_week("2024-W07")
+    assert not second.claim_week("2024-W07")
+    first.release_week("2024-W07")
+    assert second.claim_week("2024-W07")
+
+
+def test_thousands_of_subscribers_cost_one_call_per_plan(tmp_path):
+    store = meal_plans.SubscriptionStore(path=str(tmp_path / "remy.db"))
+    keys = [("", None, ""), ("vegan", None, ""), ("", 1800, "egg")]
+    for chat_id in range(3000):
+        store.subscribe(chat_id, keys[chat_id % 3])
+
+    with fake_spoonacular.FakeSpoonacularServer() as server:
+        spoon = sp.SpoonacularFacade(
+            "FAKEKEY", api_root=server.base_url, sleep_time=0)
+        scheduler = meal_plans.MealPlanScheduler(spoon, mock.Mock(), store)
+        messages = scheduler.build_messages()
+
+    assert sorted(path for path, _ in server.requests) == [
+        "recipes/informationBulk"] + ["recipes/mealplans/generate"] * 3
+    assert sum(len(chats) for _, chats in messages) == 3000
+    assert all("Monday" in message for message, _ in messages)
+
+
+def make_scheduler(tmp_path, spoon):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return meal_plans.MealPlanScheduler(
+        spoon, mock.Mock(),
+        meal_plans.SubscriptionStore(path=str(tmp_path / "remy.db")),
+        day=now.weekday(), hour=0, batch_size=2, batch_interval=5)
+
+
+def test_send_weekly_staggers_batches_once_a_week(tmp_path):
+    spoon = mock.Mock()
+    spoon.get_meal_plan.return_value = {"monday": [1]}
+    spoon.get_recipes_for_ids.return_value = [models.Recipe(1, "Toast")]
+    scheduler = make_scheduler(tmp_path, spoon)
+    for chat_id in range(5):
+        scheduler.store.subscribe(chat_id, ("", None, ""))
+    context = mock.Mock()
+
+    scheduler.send_weekly(context)
+    scheduler.send_weekly(context)
+
+    calls = context.job_queue.run_once.call_args_list
+    assert [c.args[1] for c in calls] == [0, 5, 10]
+    assert [len(c.kwargs["context"]) for c in calls] == [2, 2, 1]
+    spoon.get_meal_plan.assert_called_once()
+
+    context.job.context = calls[0].kwargs["context"]
+    scheduler.deliver(context)
+    assert scheduler.sender.send_message.call_count == 2
+
+
+def test_send_weekly_tries_again_after_running_out_of_quota(tmp_path):
+    spoon = mock.Mock()
+    spoon.get_meal_plan.side_effect = exceptions.QuotaError()
+    scheduler = make_scheduler(tmp_path, spoon)
+    scheduler.store.subscribe(1, ("", None, ""))
+
+    scheduler.send_weekly(mock.Mock())
+
+    assert scheduler.store.claim_week(meal_plans.this_week())
+
+
+def test_send_weekly_gives_the_week_back_on_unexpected_errors(tmp_path):
+    spoon = mock.Mock()
+    spoon.get_meal_plan.side_effect = KeyError("week")
+    scheduler = make_scheduler(tmp_path, spoon)
+    scheduler.store.subscribe(1, ("", None, ""))
+
+    with pytest.raises(KeyError):
+        scheduler.send_weekly(mock.Mock())
+
+    assert scheduler.store.claim_week(meal_plans.this_week())
@@ -0,0 +1,66 @@
+import urllib.request
+
+from remy import metrics
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.Histogram("t_seconds", "Test.", ["op"], buckets=[0.1, 1])
+    h.observe(0.05, "a")
+    h.observe(0.1, "a")
+    h.observe(5, "a")
+
+    assert h.render().split("\n") == [
+        "# HELP t_seconds Test.",
+        "# TYPE t_seconds histogram",
+        't_seconds_bucket{op="a",le="0.1"} 2',
+        't_seconds_bucket{op="a",le="1.0"} 2',
+        't_seconds_bucket{op="a",le="+Inf"} 3',
+        't_seconds_sum{op="a"} 5.15',
+        't_seconds_count{op="a"} 3',
+    ]
+
+
+def test_counter_escapes_label_values():
+    c = metrics.Counter("t_total", "Test.", ["type"])
+    c.inc('say "hi"\n')
+    c.inc('say "hi"\n', amount=2)
+
+    assert c.render().split("\n")[-1] == 't_total{type="say \\"hi\\"\\n"} 3.0'
+
+
+def test_gauge_reads_its_function_when_rendered():
+    values = iter([1, 2])
+    g = metrics.Gauge("t_depth", "Test.", ["queue"])
+    g.set_function(lambda: next(values), "q")
+
+    assert g.render().endswith('t_depth{queue="q"} 1.0')
+    assert g.render().endswith('t_depth{queue="q"} 2.0')
+
+
+def test_timed_observes_calls_that_raise():
+    h = metrics.Histogram("t_seconds", "Test.", ["method"])
+
+    @metrics.timed(h)
+    def _fails():
+        raise ValueError()
+
+    try:
+        _fails()
+    except ValueError:
+        pass
+    assert h.count("fails") == 1
+
+
+def test_server_serves_the_registry():
+    registry = metrics.Registry()
+    registry.counter("t_total", "Test.").inc()
+    server = metrics.MetricsServer(registry, host="127.0.0.1", port=0).start()
+    try:
+        with urllib.request.urlopen(server.url, timeout=5) as response:
+            body = response.read().decode()
+            content_type = response.headers["Content-Type"]
+    finally:
+        server.stop()
+
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert body.endswith("t_total 1.0\n")
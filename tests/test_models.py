@@ -0,0 +1,50 @@
+
+from remy import models
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+def load_fixture():
+    return fake_spoonacular.load_fixtures()
+
+
+def test_recipe_keeps_the_fields_the_bot_uses():
+    data = load_fixture()[0]
+    recipe = models.Recipe.from_json(data)
+
+    assert recipe.id == data["id"]
+    assert recipe.title == data["title"]
+    assert recipe.source_url == data["sourceUrl"]
+    assert recipe.ready_in_minutes == data["readyInMinutes"]
+    assert recipe.instructions == data["instructions"]
+    assert [i.original_string for i in recipe.ingredients] == [
+        i["originalString"] for i in data["extendedIngredients"]]
+    assert [i.name for i in recipe.ingredients] == [
+        i["name"] for i in data["extendedIngredients"]]
+
+
+def test_recipe_round_trips_through_json():
+    """Tests that to_json loses nothing from_json keeps."""
+    for data in load_fixture():
+        recipe = models.Recipe.from_json(data)
+        assert models.Recipe.from_json(recipe.to_json()) == recipe
+
+
+def test_as_recipe_converts_dicts_and_passes_recipes_through():
+    recipe = models.Recipe(1, "title")
+
+    assert models.as_recipe(recipe) is recipe
+    assert models.as_recipe({"id": 1, "title": "title"}) == recipe
+
+
+def test_recipes_are_slotted_and_share_ingredient_strings():
+    first, second = [
+        models.Recipe.from_json({
+            "id": i,
+            "extendedIngredients": [
+                {"name": "".join(["sa", "lt"]), "originalString": "salt"}],
+        })
+        for i in range(2)
+    ]
+
+    assert not hasattr(first, "__dict__")
+    assert first.ingredients[0].name is second.ingredients[0].name
@@ -0,0 +1,127 @@
+from unittest import mock
+
+from remy import config
+from remy import exceptions
+from remy import models
+from remy import pools
+
+
+def fake_render(recipe):
+    return f"<b>{recipe.title}</b>", "HTML"
+
+
+def make_spoon():
+    spoon = mock.Mock(quota=None)
+    spoon.get_random_recipes.side_effect = lambda tags, number: [
+        models.Recipe(i, f"{tags}{i}") for i in range(number)]
+    spoon.get_random_alcoholic_beverage_recipe_ids.side_effect = (
+        lambda number: list(range(number)))
+    spoon.get_recipes_for_ids.side_effect = lambda ids: [
+        models.Recipe(i, f"drink{i}") for i in ids]
+    return spoon
+
+
+def test_normalize_tags_sorts_and_dedupes():
+    """Equivalent tag strings share a pool."""
+    assert pools.normalize_tags("Vegan, breakfast,vegan,") == "breakfast,vegan"
+    assert pools.normalize_tags(None) == pools.normalize_tags("") == ""
+
+
+def test_recipe_pool_refills_in_batches_up_to_size():
+    """Tests that we fetch batch sized chunks until the pool is full."""
+    fetch = mock.Mock(side_effect=lambda count: list(range(count)))
+    pool = pools.RecipePool("test", fetch, size=5, low_water=2, batch=3)
+
+    assert pool.refill() == 5
+    assert [c.args[0] for c in fetch.call_args_list] == [3, 2]
+    assert len(pool) == 5
+
+
+def test_recipe_pool_pop_returns_none_when_empty():
+    pool = pools.RecipePool("test", mock.Mock(), size=1, low_water=1, batch=1)
+    assert pool.pop() is None
+    assert pool.needs_refill()
+
+
+def test_pool_manager_serves_prefetched_random_recipes():
+    """Refilled pools answer without another upstream call."""
+    spoon = make_spoon()
+    manager = pools.PoolManager(spoon, fake_render, prewarm_tags=["Dessert"])
+    manager.refill()
+    spoon.get_random_recipes.reset_mock()
+
+    assert manager.pop_random("dessert") == (0, "<b>dessert0</b>", "HTML")
+    spoon.get_random_recipes.assert_not_called()
+
+
+def test_pool_manager_fetches_cocktails_in_one_bulk_call():
+    """Cocktail ids come back from one search and one bulk lookup."""
+    spoon = make_spoon()
+    manager = pools.PoolManager(spoon, fake_render, prewarm_tags=[])
+    manager.refill()
+
+    spoon.get_random_alcoholic_beverage_recipe_ids.assert_called_once_with(
+        config.COCKTAIL_POOL_SIZE)
+    assert manager.pop_cocktail() == (0, "<b>drink0</b>", "HTML")
+
+
+def test_pool_manager_skips_refill_when_quota_is_low():
+    """Tests that refills don't spend the last of the daily points."""
+    spoon = make_spoon()
+    spoon.quota = mock.Mock(
+        usage_ratio=lambda: config.POOL_REFILL_MAX_QUOTA_RATIO)
+    manager = pools.PoolManager(spoon, fake_render, prewarm_tags=[""])
+    manager.refill()
+
+    spoon.get_random_recipes.assert_not_called()
+    assert manager.pop_random() is None
+
+
+def test_pool_manager_skips_refill_when_on_pace_to_run_out():
+    """Tests that refills pause while we'd spend the day's points early."""
+    spoon = make_spoon()
+    spoon.quota = mock.Mock(usage_ratio=lambda: 0.1, on_pace=lambda: False)
+    manager = pools.PoolManager(spoon, fake_render, prewarm_tags=[""])
+    manager.refill()
+
+    spoon.get_random_recipes.assert_not_called()
+
+
+def test_pool_manager_stops_refilling_on_quota_error():
+    spoon = make_spoon()
+    spoon.get_random_recipes.side_effect = exceptions.QuotaError()
+    manager = pools.PoolManager(spoon, fake_render, prewarm_tags=[""])
+    manager.refill()
+
+    spoon.get_random_alcoholic_beverage_recipe_ids.assert_not_called()
+
+
+def test_pool_manager_bounds_number_of_tag_sets():
+    manager = pools.PoolManager(
+        make_spoon(), fake_render, prewarm_tags=[], max_tag_sets=2)
+    for tags in ["a", "b", "c"]:
+        manager.pop_random(tags)
+
+    assert list(manager.random_pools) == ["b", "c"]
+
+
+def test_pool_manager_keeps_prewarmed_tag_sets():
+    """One-off tag sets don't evict the pools we paid to prewarm."""
+    manager = pools.PoolManager(
+        make_spoon(), fake_render, prewarm_tags=["", "Vegan"], max_tag_sets=2)
+    for tags in ["a", "b", "c", "d"]:
+        manager.pop_random(tags)
+
+    assert list(manager.random_pools) == ["", "vegan", "c", "d"]
+
+
+def test_restore_refills_pools_from_a_snapshot():
+    manager = pools.PoolManager(make_spoon(), fake_render, prewarm_tags=[])
+    manager.restore({
+        "random": {"vegan": [[1, "one", "HTML"], [2, "two", "HTML"]]},
+        "cocktails": [[3, "three", "HTML"]],
+    })
+
+    assert manager.pop_random("Vegan") == (1, "one", "HTML")
+    assert manager.pop_cocktail() == (3, "three", "HTML")
+    assert manager.snapshot()["random"]["vegan"] == [(2, "two", "HTML")]
@@ -0,0 +1,114 @@
+import datetime
+from unittest import mock
+
+from remy import quota
+
+
+class FakeResponse:
+
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_record_reads_quota_headers(tmp_path):
+    """Tests that we pick up used points and the limit from the headers."""
+    accountant = quota.QuotaAccountant(path=str(tmp_path / "q.db"))
+    accountant.record(FakeResponse({
+        quota.REQUEST_HEADER: "1",
+        quota.USED_HEADER: "90",
+        quota.LEFT_HEADER: "60",
+    }))
+
+    assert accountant.used == 90
+    assert accountant.limit == 150
+    assert accountant.usage_ratio() == 0.6
+
+
+def test_record_ignores_responses_without_headers(tmp_path):
+    """Tests that responses without quota headers leave totals alone."""
+    accountant = quota.QuotaAccountant(path=str(tmp_path / "q.db"))
+    accountant.record(FakeResponse({}))
+
+    assert accountant.used == 0
+
+
+def test_totals_persist_across_restarts(tmp_path):
+    """A new accountant on the same database remembers today's usage."""
+    path = str(tmp_path / "q.db")
+    quota.QuotaAccountant(path=path).record(FakeResponse({
+        quota.USED_HEADER: "142.5",
+        quota.LEFT_HEADER: "7.5",
+    }))
+
+    assert quota.QuotaAccountant(path=path).used == 142.5
+
+
+def test_totals_reset_on_a_new_day(tmp_path):
+    """Tests that yesterday's usage doesn't count against today."""
+    accountant = quota.QuotaAccountant(path=str(tmp_path / "q.db"))
+    accountant.record_exhausted()
+    with mock.patch.object(quota, "today", return_value="2999-01-01"):
+        assert accountant.usage_ratio() == 0
+
+
+def at_hour(hour):
+    """Patches the quota clock to an hour of today, UTC."""
+    return mock.patch.object(quota, "now", return_value=datetime.datetime.now(
+        datetime.timezone.utc).replace(
+            hour=hour, minute=0, second=0, microsecond=0))
+
+
+def test_default_policy_refuses_near_limit(tmp_path):
+    """Tests that we stop calling upstream at QUOTA_DEGRADE_RATIO."""
+    accountant = quota.QuotaAccountant(
+        path=str(tmp_path / "q.db"), daily_limit=100)
+    with at_hour(23):
+        accountant.used = 94
+        assert accountant.allow_request()
+        accountant.used = 95
+        assert not accountant.allow_request()
+
+
+def test_default_policy_rations_when_projected_over_limit(tmp_path):
+    """A quarter of the day gone, we may spend a quarter plus the burst."""
+    accountant = quota.QuotaAccountant(
+        path=str(tmp_path / "q.db"), daily_limit=100, pace_burst=0.1)
+    with at_hour(6):
+        accountant.used = 20
+        assert accountant.on_pace()
+        assert accountant.allow_request()
+        accountant.used = 34
+        assert not accountant.on_pace()
+        assert accountant.allow_request()
+        accountant.used = 35
+        assert not accountant.allow_request()
+
+
+def test_projected_usage_extrapolates_to_end_of_day(tmp_path):
+    """Half the day gone with 50 points spent projects 100 points."""
+    accountant = quota.QuotaAccountant(path=str(tmp_path / "q.db"))
+    accountant.used = 50
+    noon = datetime.datetime.now(datetime.timezone.utc).replace(
+        hour=12, minute=0, second=0, microsecond=0)
+
+    assert accountant.projected_usage(noon) == 100
+
+
+def test_accountants_sharing_a_database_see_each_others_usage(tmp_path):
+    """Worker processes each have an accountant on the same database."""
+    path = str(tmp_path / "q.db")
+    first = quota.QuotaAccountant(path=path)
+    second = quota.QuotaAccountant(path=path)
+
+    first.record(FakeResponse({
+        quota.USED_HEADER: "120",
+        quota.LEFT_HEADER: "30",
+    }))
+    assert second.usage_ratio() == 0.8
+
+    # A late response with an older total doesn't undo the newer one.
+    second.record(FakeResponse({
+        quota.USED_HEADER: "100",
+        quota.LEFT_HEADER: "50",
+    }))
+    assert first.usage_ratio() == 0.8
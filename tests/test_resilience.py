@@ -0,0 +1,161 @@
+import threading
+import time
+
+import pytest
+
+from remy import cache
+from remy import exceptions
+from remy import metrics
+from remy import resilience
+from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fake_spoonacular
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_facade(server, **kwargs):
+    return sp.SpoonacularFacade(
+        "FAKEKEY", api_root=server.base_url, sleep_time=0,
+        resilience=resilience.Resilience(backoff=0, **kwargs))
+
+
+def test_parse_durations():
+    assert resilience.parse_durations("search=1.5, bulk=3") == {
+        "search": 1.5, "bulk": 3.0}
+    assert resilience.parse_durations("") == {}
+
+
+def test_circuit_opens_after_failures_and_probes_once_reset():
+    clock = FakeClock()
+    breaker = resilience.CircuitBreaker(
+        "test", failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.state == resilience.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == resilience.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+
+    # A failed probe opens the circuit for another reset_timeout.
+    breaker.record_failure()
+    clock.now = 15
+    assert not breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == resilience.CLOSED
+
+
+def test_call_retries_upstream_errors():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise exceptions.UpstreamError("boom")
+        return "ok"
+
+    before = metrics.SPOONACULAR_RETRIES.value("flaky")
+    caller = resilience.Resilience(retries=2, backoff=0)
+
+    assert caller.call("flaky", flaky) == "ok"
+    assert metrics.SPOONACULAR_RETRIES.value("flaky") - before == 2
+    assert caller.breaker.state == resilience.CLOSED
+
+
+def test_call_raises_other_errors_without_retrying():
+    attempts = []
+
+    def out_of_quota():
+        attempts.append(1)
+        raise exceptions.QuotaError()
+
+    caller = resilience.Resilience(
+        retries=2, backoff=0,
+        breaker=resilience.CircuitBreaker("test", failure_threshold=1))
+
+    with pytest.raises(exceptions.QuotaError):
+        caller.call("quota", out_of_quota)
+    assert len(attempts) == 1
+    assert caller.breaker.state == resilience.CLOSED
+
+
+def test_call_takes_the_hedge_when_the_first_attempt_is_slow():
+    first = threading.Event()
+
+    def slow_once():
+        if not first.is_set():
+            first.set()
+            time.sleep(1)
+            return "slow"
+        return "fast"
+
+    caller = resilience.Resilience(
+        retries=0, hedge_after={"search": 0.05})
+    start = time.perf_counter()
+
+    assert caller.call("search", slow_once) == "fast"
+    assert time.perf_counter() - start < 0.5
+    caller.shutdown()
+
+
+def test_call_does_not_hedge_after_recent_failures():
+    """Hedges against a failing API would only pile up abandoned attempts."""
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "slow"
+
+    caller = resilience.Resilience(
+        retries=0, hedge_after={"search": 0.05})
+    caller.breaker.record_failure()
+
+    assert caller.call("search", slow) == "slow"
+    assert len(calls) == 1
+    caller.shutdown()
+
+
+def test_slow_spoonacular_times_out_then_opens_the_circuit():
+    with fake_spoonacular.FakeSpoonacularServer(latency=0.5) as server:
+        facade = make_facade(
+            server, timeouts={"search": 0.1}, retries=1,
+            breaker=resilience.CircuitBreaker("test", failure_threshold=2))
+        start = time.perf_counter()
+
+        with pytest.raises(exceptions.UpstreamTimeoutError):
+            facade.get_recipe_ids_for_ingredients("egg")
+        assert time.perf_counter() - start < 0.5
+        assert len(server.requests) == 2
+
+        with pytest.raises(exceptions.CircuitOpenError):
+            facade.get_recipe_ids_for_ingredients("ham")
+        assert len(server.requests) == 2
+        facade.resilience.shutdown()
+
+
+def test_failing_spoonacular_falls_back_to_cached_recipes(tmp_path):
+    with fake_spoonacular.FakeSpoonacularServer(error_rate=1) as server:
+        facade = make_facade(server, retries=2)
+        facade.recipe_cache = cache.RecipeCache(path=str(tmp_path / "r.db"))
+        facade.recipe_cache.put(1, {"id": 1, "title": "Toast"})
+
+        recipes = facade.get_recipes_for_ids([1, 2])
+
+        assert [recipe.id for recipe in recipes] == [1]
+        assert len(server.requests) == 3
+        with pytest.raises(exceptions.UpstreamError):
+            facade.get_recipes_for_ids([3])
@@ -0,0 +1,85 @@
+import socket
+import time
+from unittest import mock
+
+import pytest
+from telegram.ext import CommandHandler, Updater
+
+from remy import config
+from remy import runner
+from remy.fakes import telegram as fake_telegram
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_start_uses_polling_by_default():
+    updater = mock.Mock()
+    runner.start(updater, config.Settings(BOT_MODE="polling"))
+    updater.start_polling.assert_called_once_with()
+    updater.start_webhook.assert_not_called()
+
+
+def test_start_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        runner.start(mock.Mock(), config.Settings(BOT_MODE="carrier-pigeon"))
+
+
+def test_webhook_mode_requires_a_public_url():
+    """https://0.0.0.0:8443 would be rejected by Telegram, so don't guess."""
+    updater = mock.Mock()
+    with pytest.raises(ValueError, match="WEBHOOK_URL"):
+        runner.start(updater, config.Settings(
+            BOT_MODE="webhook", WEBHOOK_URL=None))
+    updater.start_webhook.assert_not_called()
+
+
+def test_start_webhook_registers_secret_path_and_max_connections():
+    updater = mock.Mock()
+    runner.start(updater, config.Settings(
+        BOT_MODE="webhook", WEBHOOK_LISTEN="0.0.0.0", WEBHOOK_PORT=8443,
+        WEBHOOK_SECRET="s3cret", WEBHOOK_URL="https://remy.example.com/",
+        WEBHOOK_MAX_CONNECTIONS=7))
+
+    updater.start_webhook.assert_called_once_with(
+        listen="0.0.0.0", port=8443, url_path="s3cret",
+        webhook_url="https://remy.example.com/s3cret")
+    updater.bot.set_webhook.assert_called_once_with(
+        url="https://remy.example.com/s3cret", max_connections=7)
+
+
+def test_webhook_mode_handles_updates_from_fake_telegram():
+    """Runs a real webhook server against the fake Telegram API."""
+    with fake_telegram.FakeTelegramServer() as fake:
+        updater = Updater(
+            token=f"{'1' * 10}:{'A' * 35}", base_url=fake.base_url)
+        updater.dispatcher.add_handler(CommandHandler(
+            "start",
+            lambda update, context: context.bot.send_message(
+                chat_id=update.effective_chat.id, text="pong")
+        ))
+        port = free_port()
+        runner.start_webhook(
+            updater, listen="127.0.0.1", port=port, secret="s3cret",
+            webhook_url=f"http://127.0.0.1:{port}", max_connections=5)
+        try:
+            assert fake.webhook_url == f"http://127.0.0.1:{port}/s3cret"
+            assert int(fake.webhook_settings["max_connections"]) == 5
+
+            # The webhook server starts on a background thread.
+            for _ in range(50):
+                try:
+                    fake.push_update(
+                        fake_telegram.command_update("/start", chat_id=42))
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            sent = fake.wait_for_sent(1)
+        finally:
+            updater.stop()
+
+    assert int(sent[0]["chat_id"]) == 42
+    assert sent[0]["text"] == "pong"
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import telegram
+
+from remy import sender
+
+
+class FakeBot:
+    """Records sends, optionally failing the first few with given errors."""
+
+    def __init__(self, errors=None):
+        self.errors = list(errors or [])
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def send_message(self, **kwargs):
+        with self.lock:
+            if self.errors:
+                raise self.errors.pop(0)
+            self.sent.append((time.monotonic(), kwargs))
+        return kwargs["text"]
+
+
+def make_sender(**kwargs):
+    defaults = {
+        "global_rate": 1000,
+        "chat_rate": 1000,
+        "group_rate": 1000,
+        "chat_burst": 1000,
+        "workers": 4,
+        "max_retries": 1,
+    }
+    defaults.update(kwargs)
+    return sender.MessageSender(**defaults)
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = sender.TokenBucket(rate=2, capacity=2, now=0)
+    bucket.take(0)
+    bucket.take(0)
+    assert bucket.ready_at(0) == 0.5
+    assert bucket.ready_at(0.5) == 0.5
+
+
+def test_send_message_returns_future_with_result():
+    s = make_sender()
+    future = s.send_message(FakeBot(), 1, text="hi")
+    assert future.result(timeout=1) == "hi"
+    s.stop()
+
+
+def test_messages_to_one_chat_keep_their_order():
+    bot = FakeBot()
+    s = make_sender(workers=8)
+    futures = [s.send_message(bot, 1, text=str(i)) for i in range(20)]
+    for future in futures:
+        future.result(timeout=1)
+    s.stop()
+
+    assert [kwargs["text"] for _, kwargs in bot.sent] == [
+        str(i) for i in range(20)]
+
+
+def test_chat_rate_is_enforced_after_burst():
+    bot = FakeBot()
+    s = make_sender(chat_rate=10, chat_burst=2)
+    futures = [s.send_message(bot, 1, text=str(i)) for i in range(4)]
+    for future in futures:
+        future.result(timeout=2)
+    s.stop()
+
+    times = [sent_at for sent_at, _ in bot.sent]
+    # Two go out together, the next two wait for the 10/s bucket.
+    assert times[3] - times[0] >= 0.15
+
+
+def test_retry_after_is_honored():
+    bot = FakeBot(errors=[telegram.error.RetryAfter(0.2)])
+    s = make_sender()
+    start = time.monotonic()
+    future = s.send_message(bot, 1, text="hi")
+
+    assert future.result(timeout=2) == "hi"
+    assert bot.sent[0][0] - start >= 0.2
+    s.stop()
+
+
+def test_retry_after_pauses_every_chat():
+    """Telegram's flood limit is per bot, not per chat."""
+    bot = FakeBot(errors=[telegram.error.RetryAfter(0.2)])
+    s = make_sender(workers=1)
+    start = time.monotonic()
+    first = s.send_message(bot, 1, text="hi")
+    second = s.send_message(bot, 2, text="there")
+
+    assert second.result(timeout=2) == "there"
+    assert first.result(timeout=2) == "hi"
+    assert all(sent_at - start >= 0.2 for sent_at, _ in bot.sent)
+    s.stop()
+
+
+def test_retry_after_gives_up_after_max_retries():
+    errors = [telegram.error.RetryAfter(0.01)] * 3
+    s = make_sender(max_retries=1)
+    future = s.send_message(FakeBot(errors=errors), 1, text="hi")
+
+    assert isinstance(future.exception(timeout=2), telegram.error.RetryAfter)
+    s.stop()
+
+
+def test_bad_request_is_not_retried():
+    bot = FakeBot(errors=[telegram.error.BadRequest("nope")])
+    s = make_sender()
+    future = s.send_message(bot, 1, text="hi")
+
+    assert isinstance(future.exception(timeout=1), telegram.error.BadRequest)
+    assert bot.sent == []
+    s.stop()
+
+
+def test_network_errors_give_up_after_max_retries():
+    errors = [telegram.error.NetworkError("down")] * 2
+    s = make_sender(max_retries=1)
+    future = s.send_message(FakeBot(errors=errors), 1, text="hi")
+
+    assert isinstance(
+        future.exception(timeout=3), telegram.error.NetworkError)
+    s.stop()
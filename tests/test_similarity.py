@@ -0,0 +1,73 @@
+import pytest
+
+from remy import ingredient_index
+from remy import models
+from remy import similarity
+
+
+def recipe(recipe_id, *names):
+    return models.Recipe(
+        recipe_id, ingredients=[models.Ingredient(name, name) for name in names])
+
+
+@pytest.fixture(params=["numpy", "python"])
+def scoring(request, monkeypatch):
+    """Runs a test with NumPy scoring (if installed) and without."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(similarity, "np", None)
+    return request.param
+
+
+def test_similar_ranks_by_cosine(scoring):
+    index = similarity.SimilarityIndex(path=None)
+    index.add(1, ["egg", "flour", "sugar", "butter"])
+    index.add(2, ["egg", "flour", "sugar", "milk"])
+    index.add(3, ["egg", "flour", "sugar", "butter", "milk", "salt", "yeast",
+                  "vanilla", "cream"])
+    index.add(4, ["egg", "ribeye"])
+    index.add(5, ["tofu"])
+
+    similar = index.similar(1, limit=5)
+
+    assert [recipe_id for recipe_id, _ in similar] == [2, 3, 4]
+    assert similar[0][1] == pytest.approx(3 / 4)
+    assert similar[1][1] == pytest.approx(4 / 6)
+    assert similar[2][1] == pytest.approx(1 / 8 ** 0.5)
+
+
+def test_similar_respects_limit_and_unknown_recipes(scoring):
+    index = similarity.SimilarityIndex(path=None)
+    for recipe_id in range(10):
+        index.add(recipe_id, ["egg", f"extra {recipe_id}"])
+
+    assert len(index.similar(0, limit=3)) == 3
+    assert index.similar(42) == []
+
+
+def test_duplicate_keys_are_counted_once(scoring):
+    index = similarity.SimilarityIndex(path=None)
+    index.add(1, ["egg", "egg", "ham"])
+    index.add(1, ["egg"])
+    index.add(2, ["egg", "ham"])
+
+    assert index.similar(1) == [(2, pytest.approx(1.0))]
+
+
+def test_index_follows_the_ingredient_index_table(tmp_path):
+    path = str(tmp_path / "remy.db")
+    ingredients = ingredient_index.IngredientIndex(path=path)
+    ingredients.add_recipes([
+        recipe(1, "egg", "ribeye"),
+        recipe(2, "egg", "ribeye", "potato"),
+    ])
+    index = similarity.SimilarityIndex(path=path)
+    assert len(index) == 2
+
+    # Recipes indexed after we loaded, e.g. by another worker, are picked up
+    # by the next query.
+    ingredients.add_recipes([recipe(3, "egg", "ribeye")])
+
+    assert [recipe_id for recipe_id, _ in index.similar(1)] == [3, 2]
+    assert 3 in index
@@ -0,0 +1,163 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from remy import singleflight
+
+
+def test_do_returns_result():
+    """Tests that a lone call just runs the function."""
+    flight = singleflight.SingleFlight()
+    assert flight.do("key", lambda x: x + 1, 1) == 2
+    assert flight.in_flight() == 0
+
+
+def test_do_coalesces_concurrent_calls():
+    """Concurrent callers with the same key share one call and its result."""
+    flight = singleflight.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "shared"
+
+    results = []
+    leader = threading.Thread(
+        target=lambda: results.append(flight.do("key", slow)))
+    leader.start()
+    started.wait()
+
+    followers = [
+        threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+        for _ in range(5)
+    ]
+    for follower in followers:
+        follower.start()
+    # Give the followers a chance to start waiting on the leader.
+    time.sleep(0.05)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert calls == [1]
+    assert results == ["shared"] * 6
+
+
+def test_do_shares_errors_with_waiters():
+    """Tests that every waiter sees the leader's exception."""
+    flight = singleflight.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        started.set()
+        release.wait()
+        raise ValueError("boom")
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(3)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.05)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 3
+    assert len({id(e) for e in errors}) == 1
+
+
+def test_do_async_coalesces_concurrent_calls():
+    """Concurrent tasks with the same key share one coroutine call."""
+    flight = singleflight.SingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "shared"
+
+    async def main():
+        return await asyncio.gather(
+            *[flight.do_async("key", slow) for _ in range(5)])
+
+    assert asyncio.run(main()) == ["shared"] * 5
+    assert calls == [1]
+
+
+def test_do_async_shares_errors():
+    """Tests that every task sees the leader's exception."""
+    flight = singleflight.SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(
+            *[flight.do_async("key", failing) for _ in range(3)],
+            return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+    with pytest.raises(KeyError):
+        flight._async_calls["key"]
+
+
+def test_do_async_caller_timeout_does_not_cancel_the_others():
+    """One caller giving up leaves the shared call running for the rest."""
+    flight = singleflight.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "shared"
+
+    async def main():
+        impatient = asyncio.wait_for(flight.do_async("key", slow), 0.01)
+        patient = flight.do_async("key", slow)
+        return await asyncio.gather(
+            impatient, patient, return_exceptions=True)
+
+    impatient, patient = asyncio.run(main())
+    assert isinstance(impatient, asyncio.TimeoutError)
+    assert patient == "shared"
+    assert flight.in_flight() == 0
+
+
+def test_do_async_does_not_share_calls_across_loops():
+    """Each event loop runs its own call, so no task awaits a foreign loop."""
+    flight = singleflight.SingleFlight()
+    calls = []
+
+    async def slow():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "done"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(
+            asyncio.run(flight.do_async("key", slow))))
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["done", "done"]
+    assert calls == [1, 1]
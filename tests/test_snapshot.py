@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+from remy import snapshot
+
+
+def test_encode_and_decode_round_trip():
+    data = {"recipes": [[1, {"id": 1, "title": "Toast"}, 2.5]]}
+
+    assert snapshot.decode(snapshot.encode(data)) == data
+
+
+def test_write_replaces_the_file_and_read_maps_it(tmp_path):
+    path = str(tmp_path / "remy.snapshot")
+    snapshot.write(path, {"version": "old"})
+    size = snapshot.write(path, {"version": "new"})
+
+    assert os.path.getsize(path) == size
+    assert snapshot.read(path) == {"version": "new"}
+    assert not os.path.exists(path + ".tmp")
+
+
+def test_read_returns_none_without_a_snapshot(tmp_path):
+    assert snapshot.read(str(tmp_path / "missing")) is None
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda contents: b"",
+    lambda contents: contents[:10],
+    lambda contents: contents[:-1],
+    lambda contents: contents[:-1] + bytes([contents[-1] ^ 0xFF]),
+    lambda contents: b"NOTASNAP" + contents[8:],
+    lambda contents: contents[:8] + b"\x02\x00" + contents[10:],
+])
+def test_read_discards_unusable_snapshots(tmp_path, corrupt):
+    path = tmp_path / "remy.snapshot"
+    path.write_bytes(corrupt(snapshot.encode({"recipes": []})))
+
+    assert snapshot.read(str(path)) is None
+    assert not path.exists()
+
+
+def test_decode_rejects_other_versions():
+    contents = snapshot.encode({})
+    contents = contents[:8] + b"\x02\x00" + contents[10:]
+
+    with pytest.raises(snapshot.SnapshotError, match="version"):
+        snapshot.decode(contents)
@@ -1,12 +1,22 @@
+import json
+import threading
 from unittest import mock
 
+import pytest
+
+from remy import cache
+from remy import exceptions
+from remy import ingredient_index
+from remy import models
 from remy import spoonacular_helper
+from remy.fakes import spoonacular as fake_spoonacular
 
 
 class FakeResponse:
 
     def __init__(self, jsondict):
         self.jsondict = jsondict
+        self.content = json.dumps(jsondict).encode()
 
     def json(self):
         return self.jsondict
@@ -19,6 +29,99 @@ def test_strip_tags_strips():
     assert stripped == "naked"
 
 
+def reference_strip_tags(html):
+    """strip_tags as originally written, with a fresh parser per call."""
+    stripper = spoonacular_helper.HTMLStripper()
+    stripper.feed(html)
+    return stripper.get_data()
+
+
+def test_strip_tags_matches_parser_on_recorded_recipes():
+    """The fast path must be output-identical on real payloads."""
+    recipes = fake_spoonacular.load_fixtures()
+
+    for recipe in recipes:
+        for html in [recipe["title"], recipe["instructions"],
+                     recipe["summary"]] + [
+                ingredient["originalString"]
+                for ingredient in recipe["extendedIngredients"]]:
+            if html:
+                assert (spoonacular_helper.strip_tags(html)
+                        == reference_strip_tags(html))
+
+
+def test_strip_tags_matches_parser_on_awkward_markup():
+    """Markup the regex can't handle falls back to the parser."""
+    for html in [
+        "a < b",
+        "<!-- note -->tomato",
+        "<script>1 < 2</script>ok",
+        "<a href='x>y'>link</a>",
+        "salt & pepper",
+        "salt &amp",
+        "fish &amp; chips &",
+        "&am<b>p;</b>",
+        "<p a='b'c>text",
+        "<b>unclosed <i",
+    ]:
+        assert (spoonacular_helper.strip_tags(html)
+                == reference_strip_tags(html)), html
+
+
+def test_strip_tags_many_strips_each_string():
+    assert spoonacular_helper.strip_tags_many(["<b>a</b>", "b &amp; c"]) == [
+        "a", "b & c"]
+
+
+def test_loads_falls_back_to_json_without_orjson(monkeypatch):
+    monkeypatch.setattr(spoonacular_helper, "orjson", None)
+
+    assert spoonacular_helper.loads(b'[{"id": 1}]') == [{"id": 1}]
+
+
+def test_decode_response_decodes_once():
+    """Tests that the body is decoded from content, never through json()."""
+    response = mock.Mock(content=b'[{"id": 1}]')
+    helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
+
+    assert helper.decode_response(response) == [{"id": 1}]
+    response.json.assert_not_called()
+
+
+def test_canonicalize_ingredients_ignores_order_spacing_and_plurals():
+    """Equivalent ingredient lists should produce the same query."""
+    assert (spoonacular_helper.canonicalize_ingredients(" Eggs, ribeye")
+            == spoonacular_helper.canonicalize_ingredients("ribeye,egg,eggs")
+            == "egg,ribeye")
+
+
+def test_canonicalize_ingredients_folds_last_word_of_each_ingredient():
+    """Tests multi-word ingredients and the common plural suffixes."""
+    output = spoonacular_helper.canonicalize_ingredients(
+        "green  onions,tomatoes,berries,peaches,asparagus,,")
+    assert output == "asparagus,berry,green onion,peach,tomato"
+
+
+def test_singularize_keeps_ie_words_and_short_stems():
+    """Tests that "pies" isn't "py" and "cookies" matches "cookie"."""
+    output = spoonacular_helper.canonicalize_ingredients(
+        "pies,apple pies,cookies,cookie,brownies,veggies,cherries")
+    assert output == "apple pie,brownie,cherry,cookie,pie,veggie"
+
+
+def test_clean_ingredients_keeps_the_users_words():
+    assert spoonacular_helper.clean_ingredients(
+        " Pies, apple  pies,pie,,eggs") == "pies,apple pies,eggs"
+
+
+def test_split_ingredient_sets_drops_empty_and_repeated_sets():
+    output = spoonacular_helper.split_ingredient_sets(
+        "Chicken, rice; tofu,broccoli;; rice,chicken ; eggs;")
+    assert output == ["chicken,rice", "tofu,broccoli", "eggs"]
+    assert spoonacular_helper.split_ingredient_sets("a; b; c", limit=2) == [
+        "a", "b"]
+
+
 class TestSpoonacularFacade:
     """General note: the spoonacular.API constructor does not call the API.
     So it doesn't need to be mocked for all test api calls. We only have to 
@@ -35,6 +138,8 @@ class TestSpoonacularFacade:
     @mock.patch.object(spoonacular_helper, "API", autospec=True)
     def test_get_recipe_ids_for_ingredients_calls_proper_api(self, mock_api):
         """Tests that we call the search_recipes_by_ingredients api."""
+        mock_api.return_value.search_recipes_by_ingredients.return_value = (
+            FakeResponse([]))
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         ingredients = "fake,list"
         _ = helper.get_recipe_ids_for_ingredients(ingredients)
@@ -82,9 +187,68 @@ class TestSpoonacularFacade:
 
         assert sorted(output) == [1, 2]
 
+    def test_get_recipe_ids_for_ingredients_uses_query_cache(self,
+                                                              monkeypatch):
+        """Reordered searches are served from the cached raw results."""
+        calls = []
+
+        def fake_search(unusedself, query):
+            calls.append(query)
+            return FakeResponse([{"id": 1}, {"id": 2}, {"id": 3}])
+
+        monkeypatch.setattr(
+            spoonacular_helper.API,
+            "search_recipes_by_ingredients",
+            fake_search)
+
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY",
+            query_cache=cache.PersistentCache(path=":memory:", table="test"))
+
+        assert helper.get_recipe_ids_for_ingredients("eggs, ribeye", 1) == [1]
+        assert helper.get_recipe_ids_for_ingredients("ribeye,egg", 3) == [
+            1, 2, 3]
+        assert calls == ["eggs,ribeye"]
+
+    def test_calls_are_refused_when_quota_policy_says_no(self):
+        """Tests that we raise before calling the API when out of points."""
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", quota=mock.Mock(allow_request=lambda: False))
+        helper.client = mock.Mock()
+
+        with pytest.raises(exceptions.QuotaError):
+            helper.get_random_recipe()
+        helper.client.get_random_recipes.assert_not_called()
+
+    def test_get_recipes_for_ids_serves_cached_when_out_of_quota(self):
+        """Tests that cached recipes are still returned without quota."""
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY",
+            recipe_cache=cache.RecipeCache(path=":memory:", table="test"),
+            quota=mock.Mock(allow_request=lambda: False))
+        helper.recipe_cache.put(1, {"id": 1})
+        helper.client = mock.Mock()
+
+        assert helper.get_recipes_for_ids([1, 2]) == [models.Recipe(1)]
+        helper.client.get_recipe_information_bulk.assert_not_called()
+
+    def test_check_status_and_raise_records_402(self):
+        """Tests that a 402 marks the quota as exhausted."""
+        accountant = mock.Mock()
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", quota=accountant)
+        response = FakeResponse({"status": "failure", "code": 402})
+
+        with pytest.raises(exceptions.QuotaError):
+            helper.check_status_and_raise(response)
+        accountant.record.assert_called_once_with(response)
+        accountant.record_exhausted.assert_called_once_with()
+
     @mock.patch.object(spoonacular_helper, "API", autospec=True)
     def test_get_random_recipe_with_tags_calls_proper_api(self, mock_api):
         """Tests that we call the proper api."""
+        mock_api.return_value.get_random_recipes.return_value = FakeResponse(
+            {"recipes": [{"id": 1}]})
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         tags = "fake,list"
         _ = helper.get_random_recipe(tags=tags)
@@ -94,6 +258,8 @@ class TestSpoonacularFacade:
     @mock.patch.object(spoonacular_helper, "API", autospec=True)
     def test_get_random_recipe_no_tags_calls_proper_api(self, mock_api):
         """Tests that we call the proper api."""
+        mock_api.return_value.get_random_recipes.return_value = FakeResponse(
+            {"recipes": [{"id": 1}]})
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         _ = helper.get_random_recipe()
 
@@ -116,12 +282,14 @@ class TestSpoonacularFacade:
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         output = helper.get_random_recipe()
 
-        assert output == FAKE_REC
+        assert output == models.Recipe.from_json(FAKE_REC)
 
     @mock.patch.object(spoonacular_helper, "API", autospec=True)
     def test_get_random_alcoholic_beverage_recipe_id_calls_proper_apis(
         self, mock_api):
         """Tests that we call the proper api."""
+        mock_api.return_value.search_recipes_complex.return_value = (
+            FakeResponse({"results": [{"id": 1}]}))
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         _kwargs = {
             "type": "drink",
@@ -164,6 +332,8 @@ class TestSpoonacularFacade:
     @mock.patch.object(spoonacular_helper, "API", autospec=True)
     def test_get_recipes_for_ids_calls_proper_api(self, mock_api):
         """Tests that we call the proper api."""
+        mock_api.return_value.get_recipe_information_bulk.return_value = (
+            FakeResponse([]))
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         fake_ids = [1, 2, 3]
         _ = helper.get_recipes_for_ids(fake_ids)
@@ -190,7 +360,8 @@ class TestSpoonacularFacade:
 
         helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
         output = helper.get_recipes_for_ids([1, 2])
-        assert output == result_data
+        assert output == [
+            models.Recipe.from_json(recipe) for recipe in result_data]
 
     def test_format_recipe_data_as_html_formats_properly(self):
         """Tests that we return properly formatted html."""
@@ -218,3 +389,163 @@ class TestSpoonacularFacade:
         )
 
         assert output == expected_output
+
+    def test_get_recipes_for_ids_only_fetches_uncached_ids(self, monkeypatch):
+        """Tests that cached recipes are merged back in the original order."""
+        requested = []
+
+        def fake_get_bulk(unusedself, ids):
+            requested.append(ids)
+            return FakeResponse([{"id": 3, "title": "fresh"}])
+
+        monkeypatch.setattr(
+            spoonacular_helper.API,
+            "get_recipe_information_bulk",
+            fake_get_bulk
+        )
+
+        recipe_cache = cache.RecipeCache(path=":memory:", table="test")
+        recipe_cache.put_many({
+            1: {"id": 1, "title": "cached1"},
+            2: {"id": 2, "title": "cached2"},
+        })
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", recipe_cache=recipe_cache)
+        output = helper.get_recipes_for_ids([2, 3, 1])
+
+        assert requested == ["3"]
+        assert [recipe.id for recipe in output] == [2, 3, 1]
+        assert recipe_cache.get(3) == models.Recipe(3, "fresh")
+
+    def test_get_recipes_for_ids_skips_api_when_all_cached(self, monkeypatch):
+        """Tests that we don't call the API at all on a full cache hit."""
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY",
+            recipe_cache=cache.RecipeCache(path=":memory:", table="test"))
+        helper.recipe_cache.put(1, {"id": 1})
+        helper.client = mock.Mock()
+
+        assert helper.get_recipes_for_ids([1]) == [models.Recipe(1)]
+        helper.client.get_recipe_information_bulk.assert_not_called()
+
+    @mock.patch.object(spoonacular_helper, "API", autospec=True)
+    def test_get_random_recipes_requests_a_batch(self, mock_api):
+        """Tests that we ask for several random recipes in one call."""
+        mock_api.return_value.get_random_recipes.return_value = FakeResponse(
+            {"recipes": []})
+        helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
+        _ = helper.get_random_recipes(tags="vegan", number=20)
+
+        helper.client.get_random_recipes.assert_called_once_with(
+            tags="vegan", number=20)
+
+    @mock.patch.object(spoonacular_helper, "API", autospec=True)
+    def test_get_random_alcoholic_beverage_recipe_ids_requests_a_batch(
+        self, mock_api):
+        """Tests that we ask for several cocktails in one call."""
+        mock_api.return_value.search_recipes_complex.return_value = (
+            FakeResponse({"results": []}))
+        helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
+        _ = helper.get_random_alcoholic_beverage_recipe_ids(10)
+
+        helper.client.search_recipes_complex.assert_called_once_with(
+            "", type="drink", minAlcohol=7, sort="random", number=10)
+
+    def test_fetched_recipes_are_passed_to_listeners(self, monkeypatch):
+        """Tests that listeners see every freshly fetched recipe."""
+        def fake_get_bulk(unusedself, ids):
+            return FakeResponse([{"id": 1}])
+
+        monkeypatch.setattr(
+            spoonacular_helper.API,
+            "get_recipe_information_bulk",
+            fake_get_bulk
+        )
+
+        seen = []
+        helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
+        helper.add_recipe_listener(seen.extend)
+        helper.get_recipes_for_ids([1])
+
+        assert seen == [models.Recipe(1)]
+
+    def test_get_recipe_ids_for_ingredients_uses_covering_index(self):
+        """Tests that a well covered search never calls the API."""
+        index = ingredient_index.IngredientIndex(path=":memory:")
+        index.add_recipes([models.Recipe(1, ingredients=[
+            models.Ingredient("egg", "2 eggs"),
+            models.Ingredient("ribeye", "1 ribeye"),
+        ])])
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", ingredient_index=index)
+        helper.client = mock.Mock()
+
+        assert helper.get_recipe_ids_for_ingredients("ribeye,eggs", 1) == [1]
+        helper.client.search_recipes_by_ingredients.assert_not_called()
+
+    def test_get_recipe_ids_for_ingredients_uses_index_without_quota(self):
+        """Tests that partial index matches are used once out of quota."""
+        index = ingredient_index.IngredientIndex(path=":memory:")
+        index.add_recipes([models.Recipe(1, ingredients=[
+            models.Ingredient("egg", "2 eggs"),
+        ])])
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY",
+            quota=mock.Mock(allow_request=lambda: False),
+            ingredient_index=index)
+        helper.client = mock.Mock()
+
+        assert helper.get_recipe_ids_for_ingredients("ribeye,eggs") == [1]
+        with pytest.raises(exceptions.QuotaError):
+            helper.get_recipe_ids_for_ingredients("kale")
+
+    def test_get_recipes_for_ids_indexes_recipes(self, monkeypatch):
+        """Tests that recipes we look up end up in the ingredient index."""
+        def fake_get_bulk(unusedself, ids):
+            return FakeResponse([
+                {"id": 1, "extendedIngredients": [{"name": "egg"}]}])
+
+        monkeypatch.setattr(
+            spoonacular_helper.API,
+            "get_recipe_information_bulk",
+            fake_get_bulk
+        )
+
+        index = ingredient_index.IngredientIndex(path=":memory:")
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", ingredient_index=index)
+        helper.get_recipes_for_ids([1])
+
+        assert index.search("eggs") == [(1, 1)]
+
+    def test_get_recipe_ids_for_ingredient_sets_searches_concurrently(self):
+        """Every search is in flight at once and shared ids come back once."""
+        started = threading.Barrier(3, timeout=5)
+        results = {"a": [{"id": 1}, {"id": 2}], "b": [{"id": 2}],
+                   "c": [{"id": 3}]}
+
+        def search(query):
+            started.wait()
+            return FakeResponse(results[query])
+
+        helper = spoonacular_helper.SpoonacularFacade("FAKEKEY")
+        helper.client = mock.Mock()
+        helper.client.search_recipes_by_ingredients.side_effect = search
+
+        output = helper.get_recipe_ids_for_ingredient_sets(["a", "b", "c"])
+
+        assert output == [1, 2, 3]
+
+    def test_get_recipe_ids_for_ingredient_sets_keeps_sets_found(self):
+        """Tests that one set running out of quota doesn't lose the rest."""
+        query_cache = cache.PersistentCache(path=":memory:", table="queries")
+        query_cache.put("egg", [{"id": 1}])
+        helper = spoonacular_helper.SpoonacularFacade(
+            "FAKEKEY", query_cache=query_cache,
+            quota=mock.Mock(allow_request=lambda: False))
+        helper.client = mock.Mock()
+
+        assert helper.get_recipe_ids_for_ingredient_sets(
+            ["egg", "kale"]) == [1]
+        with pytest.raises(exceptions.QuotaError):
+            helper.get_recipe_ids_for_ingredient_sets(["kale", "ham"])
@@ -0,0 +1,116 @@
+from unittest import mock
+
+import telegram
+
+from remy import config
+from remy import metrics
+from remy import supervisor
+from remy.fakes import spoonacular as fake_spoonacular
+from remy.fakes import telegram as fake_telegram
+
+
+def make_update(text, chat_id, update_id=1):
+    return telegram.Update.de_json(
+        dict(fake_telegram.command_update(text, chat_id=chat_id),
+             update_id=update_id),
+        None)
+
+
+def test_shard_for_keeps_a_chat_on_one_worker():
+    assert supervisor.shard_for(make_update("/help", 7), 3) == 1
+    assert supervisor.shard_for(make_update("/taco", 7, 2), 3) == 1
+    assert supervisor.shard_for(make_update("/help", -100123), 4) == 1
+
+
+def test_shard_for_falls_back_to_the_update_id():
+    assert supervisor.shard_for(telegram.Update(5), 3) == 2
+
+
+def test_workers_answer_updates_for_their_chats(tmp_path):
+    with fake_spoonacular.FakeSpoonacularServer() as spoonacular, \
+            fake_telegram.FakeTelegramServer() as fake:
+        settings = config.Settings(
+            TELEGRAM_BASE_URL=fake.base_url,
+            SPOONACULAR_API_ROOT=spoonacular.base_url,
+            SPOONACULAR_SLEEP_TIME=0,
+            CACHE_DB_PATH=str(tmp_path / "remy.db"),
+            LOGFILE=str(tmp_path / "remy.log"),
+            SNAPSHOT_PATH=str(tmp_path / "remy.snapshot"),
+            METRICS_ENABLED=False,
+            RANDOM_POOL_PREWARM_TAGS=[]
+        )
+        workers = supervisor.Supervisor(settings, workers=2).start()
+        try:
+            for chat_id in range(1, 5):
+                workers.dispatch(make_update("/taco", chat_id, chat_id))
+            sent = fake.wait_for_sent(4, timeout=30)
+        finally:
+            workers.stop(timeout=10)
+
+    assert sorted(int(m["chat_id"]) for m in sent) == [1, 2, 3, 4]
+    assert all(not p.is_alive() for p in workers.processes)
+    # Each worker saved its own snapshot on the way out.
+    assert (tmp_path / "remy.snapshot.0").exists()
+    assert (tmp_path / "remy.snapshot.1").exists()
+
+
+def test_dispatch_drops_updates_for_a_busy_worker():
+    settings = config.Settings(HANDLER_MAX_PENDING=1)
+    workers = supervisor.Supervisor(settings, workers=1)
+    before = metrics.UPDATES_DROPPED.value("worker_busy")
+
+    assert workers.dispatch(make_update("/help", 1, 1))
+    assert not workers.dispatch(make_update("/help", 1, 2))
+    assert metrics.UPDATES_DROPPED.value("worker_busy") - before == 1
+
+
+def test_dispatch_restarts_a_dead_worker(tmp_path):
+    with fake_spoonacular.FakeSpoonacularServer() as spoonacular, \
+            fake_telegram.FakeTelegramServer() as fake:
+        settings = config.Settings(
+            TELEGRAM_BASE_URL=fake.base_url,
+            SPOONACULAR_API_ROOT=spoonacular.base_url,
+            SPOONACULAR_SLEEP_TIME=0,
+            CACHE_DB_PATH=str(tmp_path / "remy.db"),
+            LOGFILE=str(tmp_path / "remy.log"),
+            SNAPSHOT_PATH="",
+            METRICS_ENABLED=False,
+            RANDOM_POOL_PREWARM_TAGS=[]
+        )
+        workers = supervisor.Supervisor(settings, workers=1).start()
+        try:
+            assert workers.wait_ready(timeout=30)
+            dead = workers.processes[0]
+            dead.kill()
+            dead.join()
+
+            workers.dispatch(make_update("/taco", 1))
+            sent = fake.wait_for_sent(1, timeout=30)
+        finally:
+            workers.stop(timeout=10)
+
+    assert workers.processes[0] is not dead
+    assert [int(m["chat_id"]) for m in sent] == [1]
+
+
+def test_workers_split_the_pools():
+    """Prewarming spends about what a single process would."""
+    settings = config.Settings(
+        RANDOM_POOL_SIZE=20, RANDOM_POOL_LOW_WATER=5, COCKTAIL_POOL_SIZE=1)
+    workers = supervisor.Supervisor(settings, workers=2)
+
+    assert workers.worker_settings.RANDOM_POOL_SIZE == 10
+    assert workers.worker_settings.RANDOM_POOL_LOW_WATER == 3
+    assert workers.worker_settings.COCKTAIL_POOL_SIZE == 1
+    assert settings.RANDOM_POOL_SIZE == 20
+
+
+def test_stop_terminates_workers_that_wont_take_the_signal():
+    settings = config.Settings(HANDLER_MAX_PENDING=1)
+    workers = supervisor.Supervisor(settings, workers=1)
+    workers.processes[0] = mock.Mock(**{"is_alive.return_value": True})
+    workers.dispatch(make_update("/help", 1))
+
+    workers.stop(timeout=0.05)
+
+    workers.processes[0].terminate.assert_called_once_with()
@@ -1,8 +1,20 @@
+import json
+import time
+from unittest import mock
+
+import pytest
 import telegram
 
+from remy import app
+from remy import cache
 from remy import config
+from remy import exceptions
+from remy import models
+from remy import pools
 from remy import telegram_helper
 from remy import spoonacular_helper as sp
+from remy.fakes import spoonacular as fake_spoonacular
+from remy.fakes import telegram as fake_telegram
 
 
 FAKE_RECIPE = {
@@ -18,6 +30,28 @@ FAKE_RECIPE = {
 }
 
 
+@pytest.mark.parametrize("args, tags", [
+    ([], ""),
+    (["vegan", "breakfast"], "vegan,breakfast"),
+    (["Main", "course,", "vegan"], "main course,vegan"),
+    (["latin", "american,tree", "nut"], "latin american,tree nut"),
+])
+def test_parse_random_tags_matches_tags_of_several_words(args, tags):
+    assert telegram_helper.parse_random_tags(args) == tags
+
+
+def test_parse_random_tags_rejects_unknown_words():
+    with pytest.raises(exceptions.InvalidRandomTagError):
+        telegram_helper.parse_random_tags(["main", "dish"])
+
+
+def test_prewarmed_tag_sets_can_be_asked_for():
+    """Pools nobody can reach would only burn quota on every refill."""
+    for tags in config.RANDOM_POOL_PREWARM_TAGS:
+        assert pools.normalize_tags(telegram_helper.parse_random_tags(
+            tags.split())) == pools.normalize_tags(tags)
+
+
 def test_format_message_and_get_parse_mode_returns_html_tuple():
     """Tests that we return proper tuple."""
     expected_msg = sp.SpoonacularFacade.format_recipe_data_as_html(
@@ -46,3 +80,134 @@ def test_format_message_and_get_parse_mode_returns_markdown_tuple():
 
     assert output[0] == expected_msg
     assert output[1] == telegram.ParseMode.MARKDOWN_V2
+
+
+def test_render_recipe_formats_once(monkeypatch):
+    """Tests that a cached recipe isn't formatted again."""
+    messages = cache.MemoryCache(10)
+    calls = []
+    original = telegram_helper.format_message_and_get_parse_mode
+
+    def counting_format(recipe):
+        calls.append(recipe.id)
+        return original(recipe)
+
+    monkeypatch.setattr(
+        telegram_helper, "format_message_and_get_parse_mode", counting_format)
+
+    first = telegram_helper.render_recipe(FAKE_RECIPE, messages)
+    second = telegram_helper.render_recipe(FAKE_RECIPE, messages)
+
+    assert first == second == original(FAKE_RECIPE)
+    assert calls == [FAKE_RECIPE["id"]]
+
+
+def test_refresh_rendered_recipes_replaces_stale_message():
+    """Fresh recipe data from the facade replaces the cached message."""
+    messages = cache.MemoryCache(10)
+    telegram_helper.render_recipe(FAKE_RECIPE, messages)
+
+    updated = dict(FAKE_RECIPE, title="NEW TITLE")
+    telegram_helper.refresh_rendered_recipes(
+        messages, [models.Recipe.from_json(updated)])
+
+    message, _ = telegram_helper.render_recipe(FAKE_RECIPE, messages)
+    assert "NEW TITLE" in message
+
+
+def test_render_recipe_is_keyed_by_format_version(monkeypatch):
+    """Bumping FORMAT_VERSION stops old renderings from being used."""
+    messages = cache.MemoryCache(10)
+    messages.put((FAKE_RECIPE["id"], sp.FORMAT_VERSION), ("old", None))
+    monkeypatch.setattr(sp, "FORMAT_VERSION", sp.FORMAT_VERSION + 1)
+
+    message, _ = telegram_helper.render_recipe(FAKE_RECIPE, messages)
+    assert message != "old"
+
+
+
+def inline_app(tmp_path, telegram_server, spoonacular_server=None):
+    settings = config.Settings(
+        CACHE_DB_PATH=str(tmp_path / "remy.db"),
+        TELEGRAM_BASE_URL=telegram_server.base_url,
+        SPOONACULAR_SLEEP_TIME=0
+    )
+    if spoonacular_server is not None:
+        settings.SPOONACULAR_API_ROOT = spoonacular_server.base_url
+    return app.create_app(settings)
+
+
+def send_inline_query(application, query, query_id="1", offset=""):
+    application.dispatcher.process_update(telegram.Update.de_json(
+        dict(fake_telegram.inline_query_update(query, query_id, offset),
+             update_id=int(query_id)),
+        application.updater.bot))
+
+
+def test_inline_query_pages_through_cached_recipes(tmp_path):
+    with fake_telegram.FakeTelegramServer() as fake:
+        application = inline_app(tmp_path, fake)
+        recipes = [
+            models.Recipe(i, f"Omelette {i}", ingredients=[
+                models.Ingredient("egg", "2 eggs")])
+            for i in range(config.INLINE_PAGE_SIZE + 2)
+        ]
+        application.spoon.recipe_cache.put_many(
+            {recipe.id: recipe for recipe in recipes})
+        application.spoon.ingredient_index.add_recipes(recipes)
+
+        send_inline_query(application, "Eggs", "1")
+        send_inline_query(
+            application, "Eggs", "2", offset=str(config.INLINE_PAGE_SIZE))
+        answers = fake.wait_for_sent(2)
+        application.shutdown()
+
+    first, second = sorted(answers, key=lambda a: a["inline_query_id"])
+    assert first["method"] == "answerInlineQuery"
+    assert len(json.loads(first["results"])) == config.INLINE_PAGE_SIZE
+    assert first["next_offset"] == str(config.INLINE_PAGE_SIZE)
+    assert int(first["cache_time"]) == config.INLINE_CACHE_TIME
+    assert [r["title"] for r in json.loads(second["results"])] == [
+        "Omelette 10", "Omelette 11"]
+    assert second["next_offset"] == ""
+
+
+def test_inline_query_only_searches_spoonacular_once_typing_stops(
+        tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "INLINE_DEBOUNCE", 0.2)
+    with fake_spoonacular.FakeSpoonacularServer() as spoonacular, \
+            fake_telegram.FakeTelegramServer() as fake:
+        application = inline_app(tmp_path, fake, spoonacular)
+        application.spoon
+        application.updater.job_queue.start()
+
+        for query_id, query in enumerate(["g", "ga", "garlic"], 1):
+            send_inline_query(application, query, str(query_id))
+        answers = fake.wait_for_sent(1)
+        time.sleep(0.3)
+        application.updater.job_queue.stop()
+        application.shutdown()
+
+    searches = [
+        params["ingredients"] for path, params in spoonacular.requests
+        if path == "recipes/findByIngredients"]
+    assert searches == ["garlic"]
+    assert [a["inline_query_id"] for a in fake.sent] == ["3"]
+    assert json.loads(answers[0]["results"])
+
+
+def test_dropped_updates_get_one_busy_reply():
+    """A chat over its pending cap hears back, without a reply per update."""
+    application = mock.Mock(busy_replies=cache.MemoryCache(10))
+    application.settings.HANDLER_BUSY_REPLY_INTERVAL = 60
+    application.executor.submit.return_value = False
+    context = mock.Mock(bot_data={"app": application})
+    update = mock.Mock()
+    update.effective_chat.id = 7
+    handler = telegram_helper.run_in_chat_order(mock.Mock(__name__="h"))
+
+    handler(update, context)
+    handler(update, context)
+
+    application.sender.send_message.assert_called_once()
+    assert application.sender.send_message.call_args.kwargs["chat_id"] == 7